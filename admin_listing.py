@@ -0,0 +1,57 @@
+import csv
+import io
+from collections import namedtuple
+
+# One page of a listing; `next_after` is the cursor for the following page, None on the last
+Page = namedtuple('Page', 'items next_after')
+
+# Upper bound for prefix searches: `column >= q AND column < q + PREFIX_END`
+# is a range scan on the column's index, unlike LIKE 'q%', which needs a
+# special operator class (PostgreSQL) or case-sensitive LIKE (SQLite) to use one
+PREFIX_END = '\uffff'
+
+
+def prefix_filter(query, column, prefix):
+    return query.filter(column >= prefix, column < prefix + PREFIX_END)
+
+
+def keyset_query(query, column, after=None, limit=50, descending=False):
+    """`query` narrowed to the `limit` rows after `after` in `column` order, plus one
+    to tell whether another page follows."""
+    if after is not None:
+        query = query.filter(column < after if descending else column > after)
+    return query.order_by(column.desc() if descending else column).limit(limit + 1)
+
+
+def keyset_page(query, column, after=None, limit=50, descending=False):
+    """The `limit` rows of `query` that follow `after` in `column` order.
+
+    `column` must be unique and indexed: the page is a range scan that
+    starts at the cursor instead of an OFFSET that has to walk past every
+    earlier row, so page 1000 costs the same as page 1.
+    """
+    rows = keyset_query(query, column, after, limit, descending).all()
+    next_after = getattr(rows[limit - 1], column.key) if len(rows) > limit else None
+    return Page(rows[:limit], next_after)
+
+
+def stream_csv(query, column, header, batch_size=1000):
+    """Yield `query` as CSV text, one chunk per `batch_size` rows.
+
+    `query` should select plain columns, not model instances, so rows are
+    not kept in the session's identity map; with keyset batches on the
+    unique `column` at most one batch is held in memory at a time.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    after = None
+    while True:
+        page = keyset_page(query, column, after, batch_size)
+        writer.writerows(page.items)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if page.next_after is None:
+            return
+        after = page.next_after
@@ -1,12 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_socketio import SocketIO, emit, join_room, leave_room
 import os
-import random
-import string
-import bcrypt
+import base64
+import binascii
+import uuid
+import secrets
+from collections import namedtuple
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from room_broadcast import RoomBroadcaster, spectator_room
+from lockstep import LockstepRooms, parse_packet
+from room_store import MemoryRoomStore, create_room_store, player_key
+from room_manager import RoomManager, RoomLimitReached
+from room_codes import CODE_SPACE, RoomCodeAllocator
+from matchmaking import Matchmaker
+from score_writer import ScoreWriter
+from leaderboard import Leaderboard, TournamentBoards
+from tournament_schedule import TournamentSchedule
+from admin_listing import keyset_page, prefix_filter, stream_csv
+from metrics import AppMetrics, sampled_logger
+from realtime import LazySocketIO, emit, join_room, leave_room
+from password_hasher import PasswordHasher, HasherBusy
+from score_verifier import ScoreVerifier
+from replay_store import ReplayStore
+from tetris_engine import unpack_actions
 
 
 
@@ -19,13 +36,140 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_secret_key')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'your_database_url')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
+app.config['ROOM_TICK_RATE'] = int(os.getenv('ROOM_TICK_RATE', 20))  # room snapshots per second
+app.config['SPECTATOR_TICK_RATE'] = int(os.getenv('SPECTATOR_TICK_RATE', 5))  # spectator snapshots per second
+# Shared room storage and Socket.IO message queue, needed when running more than one worker
+app.config['ROOM_STORE_URL'] = os.getenv('ROOM_STORE_URL', 'memory://')
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+# How often each worker applies the other workers' leaderboard changes (seconds)
+app.config['LEADERBOARD_SYNC_INTERVAL'] = float(os.getenv('LEADERBOARD_SYNC_INTERVAL', 1.0))
+# Rooms untouched for this long are deleted (seconds), by status; "unclaimed"
+# is a waiting room no socket has joined yet
+app.config['ROOM_UNCLAIMED_TTL'] = int(os.getenv('ROOM_UNCLAIMED_TTL', 120))
+app.config['ROOM_WAITING_TTL'] = int(os.getenv('ROOM_WAITING_TTL', 30 * 60))
+app.config['ROOM_PLAYING_TTL'] = int(os.getenv('ROOM_PLAYING_TTL', 2 * 3600))
+app.config['ROOM_FINISHED_TTL'] = int(os.getenv('ROOM_FINISHED_TTL', 5 * 60))
+app.config['ROOM_REAP_INTERVAL'] = int(os.getenv('ROOM_REAP_INTERVAL', 60))
+app.config['MAX_ROOMS_PER_HOST'] = int(os.getenv('MAX_ROOMS_PER_HOST', 3))
+# Quick match: players per matched room, seconds between matching passes, and
+# how long (seconds) a player waits before skill, then latency, matter less
+app.config['MATCH_ROOM_SIZE'] = int(os.getenv('MATCH_ROOM_SIZE', 2))
+app.config['MATCH_INTERVAL'] = float(os.getenv('MATCH_INTERVAL', 1.0))
+app.config['MATCH_WIDEN_AFTER'] = float(os.getenv('MATCH_WIDEN_AFTER', 10))
+app.config['MATCH_IGNORE_LATENCY_AFTER'] = float(os.getenv('MATCH_IGNORE_LATENCY_AFTER', 30))
+# Matched players who have not joined their room after this long (seconds) are dropped from it
+app.config['MATCH_JOIN_TIMEOUT'] = float(os.getenv('MATCH_JOIN_TIMEOUT', 30))
+# Score writes are buffered and flushed when this many are waiting or the oldest is this old (seconds)
+app.config['SCORE_BATCH_SIZE'] = int(os.getenv('SCORE_BATCH_SIZE', 500))
+app.config['SCORE_FLUSH_INTERVAL'] = float(os.getenv('SCORE_FLUSH_INTERVAL', 1.0))
+# Upper bound (seconds) on how long another worker's tournament edits can go unseen
+app.config['TOURNAMENT_CACHE_TTL'] = int(os.getenv('TOURNAMENT_CACHE_TTL', 300))
+# Rows per page in the admin listings and per chunk of the CSV exports
+app.config['ADMIN_PAGE_SIZE'] = int(os.getenv('ADMIN_PAGE_SIZE', 50))
+app.config['CSV_BATCH_SIZE'] = int(os.getenv('CSV_BATCH_SIZE', 1000))
+# bcrypt work factor; existing hashes are upgraded on the next successful login
+app.config['BCRYPT_ROUNDS'] = int(os.getenv('BCRYPT_ROUNDS', 12))
+app.config['BCRYPT_POOL_SIZE'] = int(os.getenv('BCRYPT_POOL_SIZE', 4))
+app.config['BCRYPT_MAX_PENDING'] = int(os.getenv('BCRYPT_MAX_PENDING', 32))
+# Worker processes replaying submitted games, per server process (default: the
+# cores shared out between the WEB_CONCURRENCY server processes gunicorn.conf.py runs)
+app.config['SCORE_VERIFY_PROCESSES'] = (int(os.getenv('SCORE_VERIFY_PROCESSES', 0)) or
+                                        max(1, (os.cpu_count() or 1) // int(os.getenv('WEB_CONCURRENCY', 1))))
+app.config['MAX_REPLAY_BYTES'] = int(os.getenv('MAX_REPLAY_BYTES', 256 * 1024))
+# Recorded games (see replay_store.py); segment files roll over at this size
+app.config['REPLAY_DIR'] = os.getenv('REPLAY_DIR', os.path.join(app.instance_path, 'replays'))
+app.config['REPLAY_SEGMENT_BYTES'] = int(os.getenv('REPLAY_SEGMENT_BYTES', 64 * 1024 * 1024))
+# Socket.IO and Engine.IO log one in this many packets as JSON lines (0: off);
+# warnings and errors are always logged
+app.config['SOCKETIO_LOG_SAMPLE'] = int(os.getenv('SOCKETIO_LOG_SAMPLE', 100))
+# Emits whose payload size is measured for the /metrics byte counters (1 in N)
+app.config['METRICS_PAYLOAD_SAMPLE'] = int(os.getenv('METRICS_PAYLOAD_SAMPLE', 10))
+# Bearer token for Prometheus to scrape /metrics; without it only admins can read it
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
 
 # Initialize SQLAlchemy and SocketIO
 db = SQLAlchemy(app)
-socketio = SocketIO(app, cors_allowed_origins="*", logger=True, engineio_logger=True)
-    
-# Game rooms dictionary to store active games
-game_rooms = {}
+
+# Flask-Migrate pulls in alembic and mako, a fifth of the import time, and is
+# only needed by the `flask db` commands (Flask sets FLASK_RUN_FROM_CLI for
+# every CLI command) and upgrade_database()
+def init_migrations():
+    if 'migrate' not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+# Schema that db.create_all() built before there were migrations
+INITIAL_REVISION = '3a1f0c9d2b7e'
+
+def upgrade_database(directory=None):
+    init_migrations()
+    from flask_migrate import stamp, upgrade
+    from alembic.migration import MigrationContext
+    with app.app_context():
+        # A database made by create_all() has the tables but no alembic_version
+        # row: mark it as the initial schema so only the later revisions run
+        with db.engine.connect() as conn:
+            current = MigrationContext.configure(conn).get_current_revision()
+            has_tables = db.inspect(conn).has_table('player')
+        if current is None and has_tables:
+            print(f"Database has tables but no migration version; stamping {INITIAL_REVISION}")
+            stamp(directory=directory, revision=INITIAL_REVISION)
+        upgrade(directory=directory)
+
+if os.getenv('FLASK_RUN_FROM_CLI'):
+    init_migrations()
+
+# Route, socket event, emit and query metrics, served on /metrics (see metrics.py)
+metrics = AppMetrics(payload_sample=app.config['METRICS_PAYLOAD_SAMPLE'])
+metrics.init_app(app)
+# The Socket.IO server is only built when a socket connects or something
+# emits, so HTTP-only requests (and serverless cold starts) skip it (see realtime.py)
+socketio = LazySocketIO(app, metrics=metrics, cors_allowed_origins="*",
+                        logger=sampled_logger('socketio', app.config['SOCKETIO_LOG_SAMPLE']),
+                        engineio_logger=sampled_logger('engineio', app.config['SOCKETIO_LOG_SAMPLE']),
+                        message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+    
+# Password hashing runs on a native thread pool so it never blocks the event loop
+password_hasher = PasswordHasher(socketio, rounds=app.config['BCRYPT_ROUNDS'],
+                                 pool_size=app.config['BCRYPT_POOL_SIZE'],
+                                 max_pending=app.config['BCRYPT_MAX_PENDING'])
+
+# Room store holding active games (see room_store.py)
+game_rooms = create_room_store(app.config['ROOM_STORE_URL'])
+
+# Coalesces game_update frames into one room_snapshot per room per tick
+# (and a slower one for spectators)
+room_broadcaster = RoomBroadcaster(socketio, tick_rate=app.config['ROOM_TICK_RATE'],
+                                   spectator_rate=app.config['SPECTATOR_TICK_RATE'],
+                                   local_spectators=app.config['SOCKETIO_MESSAGE_QUEUE'] is None)
+
+# Input streams of rooms playing in 'inputs' sync mode (see lockstep.py),
+# each cut off at the longest log a score submission may carry
+lockstep_rooms = LockstepRooms(max_actions=app.config['MAX_REPLAY_BYTES'] * 2)
+
+# Per-process state of a room that is gone
+def forget_room(room_code):
+    room_broadcaster.discard(room_code)
+    lockstep_rooms.discard(room_code)
+
+def close_reaped_room(room_code, room):
+    socketio.emit('room_closed', {'message': 'Room closed after being idle'},
+                  to=[room_code, spectator_room(room_code)])
+    forget_room(room_code)
+
+# Expires idle rooms and caps rooms per host (see room_manager.py)
+room_manager = RoomManager(socketio, game_rooms, on_reap=close_reaped_room,
+                           unclaimed_ttl=app.config['ROOM_UNCLAIMED_TTL'],
+                           waiting_ttl=app.config['ROOM_WAITING_TTL'],
+                           playing_ttl=app.config['ROOM_PLAYING_TTL'],
+                           finished_ttl=app.config['ROOM_FINISHED_TTL'],
+                           max_rooms_per_host=app.config['MAX_ROOMS_PER_HOST'],
+                           reap_interval=app.config['ROOM_REAP_INTERVAL'])
+
+# How clients keep opponents' boards up to date: 'frames' streams packed
+# boards (static/js/boardsync.js), 'inputs' streams only key presses and
+# gravity ticks and every peer replays them (static/js/lockstep.js)
+SYNC_MODES = ('frames', 'inputs')
 
 # Define models
 class Player(db.Model):
@@ -60,6 +204,11 @@ class Tournament(db.Model):
     # Relationship
     creator = db.relationship('Player', backref='created_tournaments')
     
+    __table_args__ = (
+        # Active-tournament lookup: end_date >= now AND start_date <= now
+        db.Index('ix_tournament_end_start', 'end_date', 'start_date'),
+    )
+    
     @property
     def is_active(self):
         now = datetime.now()
@@ -71,14 +220,249 @@ class Highscore(db.Model):
     player_id = db.Column(db.Integer, db.ForeignKey('player.player_id'))
     score = db.Column(db.Integer, nullable=False)
     time = db.Column(db.DateTime, default=datetime.now)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournament.tournament_id'))
     
     # Relationship
     player = db.relationship('Player', backref=db.backref('highscores'))
+    tournament = db.relationship('Tournament', backref=db.backref('highscores'))
+    
+    __table_args__ = (
+        # Tournament standings are built from (tournament_id, score)
+        db.Index('ix_highscore_tournament_score', 'tournament_id', 'score'),
+        # Per-player best score and the score-writer upsert lookup
+        db.Index('ix_highscore_player_score', 'player_id', 'score'),
+        # Top-N and rank (COUNT WHERE score > x) queries
+        db.Index('ix_highscore_score', 'score'),
+    )
+
+class FlaggedScore(db.Model):
+    # Submitted games whose replay did not reproduce the claimed score
+    flag_id = db.Column(db.Integer, primary_key=True)
+    player_id = db.Column(db.Integer, db.ForeignKey('player.player_id'), index=True)
+    claimed_score = db.Column(db.Integer)
+    replayed_score = db.Column(db.Integer)  # None if the log could not be replayed
+    seed = db.Column(db.BigInteger, nullable=False)
+    actions = db.Column(db.LargeBinary, nullable=False)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournament.tournament_id'))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    # Relationship
+    player = db.relationship('Player', backref=db.backref('flagged_scores'))
 
-# Generate a random room code
-def generate_room_code():
-    letters = string.ascii_uppercase
-    return ''.join(random.choice(letters) for i in range(6))
+# Write-behind buffer for score inserts, flushed in batches
+score_writer = ScoreWriter(app, db, Highscore, socketio, flagged_model=FlaggedScore,
+                           batch_size=app.config['SCORE_BATCH_SIZE'],
+                           flush_interval=app.config['SCORE_FLUSH_INTERVAL'])
+
+# Cached per-tournament standings, updated as tournament scores come in
+tournament_boards = TournamentBoards(app, db, Highscore, Player)
+
+# In-memory score index serving the dashboard and /api/leaderboard; with a
+# shared room store, changes reach the other workers through its feed
+leaderboard = Leaderboard(app, db, Highscore, Player,
+                          feed=None if isinstance(game_rooms, MemoryRoomStore) else game_rooms,
+                          tournament_boards=tournament_boards)
+
+# Active and upcoming tournaments, invalidated by the admin routes
+tournament_schedule = TournamentSchedule(app, Tournament, ttl=app.config['TOURNAMENT_CACHE_TTL'])
+
+# Called for every replayed game: verified scores are recorded, the rest flagged
+def record_verified_score(job, result):
+    player_id, username = job['player_id'], job['username']
+    
+    if result is None or result.score != job['score']:
+        replayed = result.score if result else None
+        print(f"Flagged score from player {player_id}: claimed {job['score']}, replay gave {replayed}")
+        score_writer.submit_flagged(
+            player_id,
+            claimed_score=min(max(job['score'], 0), MAX_SCORE),
+            replayed_score=replayed,
+            seed=job['seed'],
+            actions=job['actions'],
+            tournament_id=job.get('tournament_id')
+        )
+        announce_replay(job, None)
+        return
+    
+    # Stored with the score the server replayed, not the one the client claimed
+    announce_replay(job, save_replay(player_id, result.score, job['seed'], job['actions']))
+    
+    now = datetime.now()
+    if job['kind'] == 'best':
+        best = leaderboard.best(player_id)
+        if best is None or result.score > best.score:
+            score_writer.submit_best(player_id, result.score, when=now)
+            leaderboard.set_best(player_id, username, result.score, now)
+    else:
+        tournament_id = job.get('tournament_id')
+        score_writer.submit(player_id, result.score, when=now, tournament_id=tournament_id)
+        leaderboard.add_score(player_id, username, result.score, now, tournament_id=tournament_id)
+        if tournament_id:
+            tournament_boards.record(tournament_id, player_id, username, result.score, now)
+
+# Replays submitted games on a process pool before their scores are saved
+score_verifier = ScoreVerifier(socketio, app.config['SECRET_KEY'], record_verified_score, claims=game_rooms,
+                               processes=app.config['SCORE_VERIFY_PROCESSES'])
+
+# Largest score a Highscore or FlaggedScore row can hold (32-bit Integer columns)
+MAX_SCORE = 2**31 - 1
+
+# Claimed score from a score submission, or None if it is not a whole number in 0..MAX_SCORE
+def read_score(data):
+    score = data.get('score', 0)
+    if isinstance(score, bool) or not isinstance(score, int) or not 0 <= score <= MAX_SCORE:
+        return None
+    return score
+
+# Seed and packed input log from a score submission, or None if missing or
+# invalid; a valid submission uses up its seed token
+def read_replay(data, player_id):
+    try:
+        actions = base64.b64decode(data.get('actions') or '', validate=True)
+    except (binascii.Error, TypeError, ValueError):
+        return None
+    if not actions or len(actions) > app.config['MAX_REPLAY_BYTES']:
+        return None
+    seed = score_verifier.use_seed(data.get('seed_token'), player_id)
+    if seed is None:
+        return None
+    return seed, actions
+
+# Every submitted game, kept for playback
+replay_store = ReplayStore(app.config['REPLAY_DIR'], segment_bytes=app.config['REPLAY_SEGMENT_BYTES'])
+
+# Record a verified game; returns its replay id, or None if it could not be stored.
+# The file writes run on a native thread, so the event loop is not held up
+def save_replay(player_id, score, seed, actions):
+    try:
+        actions = unpack_actions(actions)
+        if socketio.async_mode == 'eventlet':
+            from eventlet import tpool
+            return tpool.execute(replay_store.append, player_id, score, seed, actions)
+        if socketio.async_mode == 'gevent':
+            import gevent
+            return gevent.get_hub().threadpool.apply(replay_store.append, (player_id, score, seed, actions))
+        return replay_store.append(player_id, score, seed, actions)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Could not store replay from player {player_id}: {e}")
+        return None
+
+# Tell the player where a verified game's replay is (replay_id None if it has
+# none): over the socket it was submitted from, or, for a score posted over
+# HTTP, under its replay key for the page to poll for (10 minutes)
+def announce_replay(job, replay_id):
+    if job.get('sid') and replay_id is not None:
+        socketio.emit('replay_saved', {'replay_id': replay_id}, to=job['sid'])
+    if job.get('replay_key'):
+        game_rooms.put('replay:' + job['replay_key'], {'player_id': job['player_id'], 'replay_id': replay_id}, 600)
+
+# Who a request or socket belongs to, taken from the login session
+Identity = namedtuple('Identity', 'player_id username role')
+
+def session_identity():
+    return Identity(session['user_id'], session['username'], session.get('user_type'))
+
+# Identity of each connected socket, filled once in handle_connect
+connected_players = {}
+
+def current_player():
+    return connected_players[request.sid]
+
+# Room each spectating socket on this process is watching
+spectators = {}
+
+# Unique room codes, drawn from a counter shared through the room store; the
+# in-memory counter restarts at 1, so each process starts it somewhere random
+room_codes = RoomCodeAllocator(app.config['SECRET_KEY'], lambda: game_rooms.next_value('room_code'),
+                               offset=secrets.randbelow(CODE_SPACE) if isinstance(game_rooms, MemoryRoomStore) else 0)
+
+# Open a room for a group the matchmaker formed and send everyone to it;
+# the longest-waiting player hosts
+def open_matched_room(tickets):
+    room_code = room_codes.reserve()
+    host = tickets[0]
+    room_manager.open(room_code, {
+        'host_id': host.player_id,
+        'host_name': host.username,
+        'players': {
+            player_key(ticket.player_id): {
+                'id': ticket.player_id,
+                'username': ticket.username,
+                'sid': None
+            } for ticket in tickets
+        },
+        'status': 'waiting',
+        'matched': True
+    }, capped=False)
+    for ticket in tickets:
+        socketio.emit('match_found', {'room_code': room_code}, to=ticket.sid)
+    socketio.start_background_task(drop_no_shows, room_code, app.config['MATCH_JOIN_TIMEOUT'])
+
+# Background task: matched players who never connected to the room are taken
+# out of it, so it does not wait on them to start or to decide a winner. A
+# missing host closes the room, as a host leaving a waiting room does.
+def drop_no_shows(room_code, delay):
+    socketio.sleep(delay)
+    winner = None
+    closed = False
+    with game_rooms.transaction(room_code) as room:
+        if room is None:
+            return
+        no_shows = [player for player in room['players'].values() if player['sid'] is None]
+        if not no_shows:
+            return
+        for player in no_shows:
+            del room['players'][player_key(player['id'])]
+        room_manager.touch(room)
+        
+        if room['status'] == 'waiting' and (not room['players'] or player_key(room['host_id']) not in room['players']):
+            game_rooms.delete(room_code)
+            closed = True
+        else:
+            # Mid-game, the no-shows were the only ones still "playing": last player standing wins
+            active_players = [p for p in room['players'].values() if not p.get('game_over', False)]
+            if room['status'] == 'playing' and len(active_players) == 1 and 'countdown' not in room:
+                room['countdown'] = uuid.uuid4().hex
+                winner = active_players[0]
+    
+    # Sent once the room is saved and unlocked
+    for player in no_shows:
+        socketio.emit('player_left', {
+            'player_id': player['id'],
+            'username': player['username']
+        }, to=[room_code, spectator_room(room_code)])
+    
+    if closed:
+        socketio.emit('room_closed', {'message': 'A matched player did not join'},
+                      to=[room_code, spectator_room(room_code)])
+        forget_room(room_code)
+    elif winner is not None:
+        socketio.start_background_task(return_to_waiting, room_code, room['countdown'])
+        socketio.emit('you_win', {'username': winner['username'], 'score': None}, to=winner['sid'])
+
+# Quick match queue (see matchmaking.py); shared through the room store's feed
+# unless rooms are in process memory
+matchmaker = Matchmaker(socketio, open_matched_room,
+                        feed=None if isinstance(game_rooms, MemoryRoomStore) else game_rooms,
+                        room_size=app.config['MATCH_ROOM_SIZE'],
+                        interval=app.config['MATCH_INTERVAL'],
+                        widen_after=app.config['MATCH_WIDEN_AFTER'],
+                        ignore_latency_after=app.config['MATCH_IGNORE_LATENCY_AFTER'])
+
+# Live gauges; rooms by status and players in rooms are from the reaper's last scan
+metrics.registry.gauge('rooms', 'Rooms in the room store', lambda: len(game_rooms))
+metrics.registry.gauge('rooms_by_status', 'Rooms by status at the last reaper scan',
+                       lambda: {(status,): count for status, count
+                                in room_manager.stats().get('rooms_by_status', {}).items()}, ('status',))
+metrics.registry.gauge('room_players', 'Players in rooms at the last reaper scan',
+                       lambda: room_manager.stats().get('players', 0))
+metrics.registry.gauge('connected_sockets', 'Sockets connected to this process', lambda: len(connected_players))
+metrics.registry.gauge('spectators', 'Spectating sockets on this process', lambda: len(spectators))
+metrics.registry.gauge('matchmaking_queue', 'Players waiting for a quick match', lambda: len(matchmaker))
+metrics.registry.gauge('score_verify_queue', 'Submitted games waiting for or in replay on this process',
+                       lambda: score_verifier.pending())
+metrics.registry.gauge('score_verify_last_batch_seconds', 'Replay time of the last verified batch on this process',
+                       lambda: score_verifier.last_batch_ms / 1000)
 
 # Routes
 @app.route('/')
@@ -93,14 +477,22 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        # Find player
-        player = Player.query.filter_by(username=username).first()
+        # Find player and login information in one round trip
+        player, login_info = db.session.query(Player, LoginInformation).outerjoin(
+            LoginInformation, LoginInformation.player_id == Player.player_id
+        ).filter(Player.username == username).first() or (None, None)
         
         if player:
-            # Get login information
-            login_info = LoginInformation.query.filter_by(player_id=player.player_id).first()
+            try:
+                valid = login_info and password_hasher.verify(password, login_info.password)
+                # Upgrade the stored hash if the work factor has changed
+                if valid and password_hasher.needs_rehash(login_info.password):
+                    login_info.password = password_hasher.hash(password)
+            except HasherBusy:
+                flash('Too many sign-ins right now, please try again in a moment')
+                return render_template('login.html'), 503
             
-            if login_info and bcrypt.checkpw(password.encode('utf-8'), login_info.password.encode('utf-8')):
+            if valid:
                 # Create session
                 session['user_id'] = player.player_id
                 session['username'] = player.username
@@ -136,7 +528,11 @@ def signup():
             return redirect(url_for('signup'))
         
         # Hash the password
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HasherBusy:
+            flash('Too many sign-ups right now, please try again in a moment')
+            return redirect(url_for('signup'))
         
         # Create new player
         new_player = Player(username=username, email=email)
@@ -146,7 +542,7 @@ def signup():
         # Create login information (always as PLAYER role)
         login_info = LoginInformation(
             player_id=new_player.player_id,
-            password=hashed_password.decode('utf-8'),
+            password=hashed_password,
             role='PLAYER'  # Always set to PLAYER
         )
         db.session.add(login_info)
@@ -174,35 +570,37 @@ def save_highscore():
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
     data = request.json
-    score = data.get('score', 0)
-    
-    # Check if player already has a highscore
-    existing_highscore = Highscore.query.filter_by(player_id=session['user_id']).first()
-    
-    is_new_highscore = False
-    
-    if existing_highscore:
-        # Update if new score is higher
-        if score > existing_highscore.score:
-            existing_highscore.score = score
-            existing_highscore.time = datetime.now()
-            db.session.commit()
-            is_new_highscore = True
-    else:
-        # Create new highscore
-        new_highscore = Highscore(
-            player_id=session['user_id'],
-            score=score,
-            time=datetime.now()
-        )
-        db.session.add(new_highscore)
-        db.session.commit()
-        is_new_highscore = True
+    score = read_score(data)
+    if score is None:
+        return jsonify({'success': False, 'message': 'Invalid score'}), 400
+    
+    replay = read_replay(data, session['user_id'])
+    if replay is None:
+        return jsonify({'success': False, 'message': 'Missing or invalid game replay'}), 400
+    
+    best = leaderboard.best(session['user_id'])
+    is_new_highscore = best is None or score > best.score
+    
+    # The player's single highscore row is updated, and the replay stored,
+    # once the replay checks out
+    replay_key = uuid.uuid4().hex
+    seed, actions = replay
+    score_verifier.submit({
+        'kind': 'best',
+        'player_id': session['user_id'],
+        'username': session['username'],
+        'score': score,
+        'seed': seed,
+        'actions': actions,
+        'replay_key': replay_key
+    })
     
     return jsonify({
         'success': True, 
         'is_new_highscore': is_new_highscore,
-        'score': score
+        'score': score,
+        'replay_key': replay_key,
+        'next_seed': score_verifier.issue_seed(session['user_id'])
     })
 
 @app.route('/admin_login', methods=['GET', 'POST'])
@@ -211,7 +609,15 @@ def admin_login():
         username = request.form.get('username')
         password = request.form.get('password')
         admin = Admin.query.filter_by(username=username).first()
-        if admin and bcrypt.checkpw(password.encode('utf-8'), admin.password.encode('utf-8')):
+        try:
+            valid = admin and password_hasher.verify(password, admin.password)
+            if valid and password_hasher.needs_rehash(admin.password):
+                admin.password = password_hasher.hash(password)
+                db.session.commit()
+        except HasherBusy:
+            flash('Too many sign-ins right now, please try again in a moment')
+            return render_template('admin_login.html'), 503
+        if valid:
             session.clear()  # Clear any existing session data
             session['admin_id'] = admin.admin_id
             session['admin_username'] = admin.username
@@ -230,8 +636,10 @@ def admin_tournaments():
         flash('Access denied')
         return redirect(url_for('dashboard'))
     
-    tournaments = Tournament.query.all()
-    return render_template('admin/tournaments.html', tournaments=tournaments)
+    tournaments = keyset_page(Tournament.query, Tournament.tournament_id,
+                              request.args.get('after', type=int),
+                              app.config['ADMIN_PAGE_SIZE'], descending=True)
+    return render_template('admin/tournaments.html', tournaments=tournaments, now=datetime.now())
 
 @app.route('/admin/tournaments/create', methods=['GET', 'POST'])
 def create_tournament():
@@ -250,12 +658,12 @@ def create_tournament():
             description=description,
             start_date=start_date,
             end_date=end_date,
-            created_by=session['user_id'],
-            is_active=request.form.get('is_active') == 'on'
+            created_by=None  # Admins are not players
         )
         
         db.session.add(new_tournament)
         db.session.commit()
+        tournament_schedule.invalidate()
         
         flash('Tournament created successfully')
         return redirect(url_for('admin_tournaments'))
@@ -275,9 +683,9 @@ def edit_tournament(tournament_id):
         tournament.description = request.form.get('description')
         tournament.start_date = datetime.strptime(request.form.get('start_date'), '%Y-%m-%dT%H:%M')
         tournament.end_date = datetime.strptime(request.form.get('end_date'), '%Y-%m-%dT%H:%M')
-        tournament.is_active = request.form.get('is_active') == 'on'
         
         db.session.commit()
+        tournament_schedule.invalidate()
         
         flash('Tournament updated successfully')
         return redirect(url_for('admin_tournaments'))
@@ -291,10 +699,52 @@ def admin_dashboard():
     if 'admin_id' not in session or session.get('user_type') != 'ADMIN':
         flash('Access denied')
         return redirect(url_for('dashboard'))
-    players = Player.query.all()
-    tournaments = Tournament.query.all()
-    now = datetime.utcnow()
-    return render_template('admin.html', players=players, tournaments=tournaments, now=now)
+    
+    # Newest players first, or a prefix search on username (or email, if
+    # the search has an @) in that column's order; both are index range scans
+    search = request.args.get('q', '').strip()
+    if search:
+        column = Player.email if '@' in search else Player.username
+        players = keyset_page(prefix_filter(Player.query, column, search), column,
+                              request.args.get('players_after') or None, app.config['ADMIN_PAGE_SIZE'])
+    else:
+        players = keyset_page(Player.query, Player.player_id, request.args.get('players_after', type=int),
+                              app.config['ADMIN_PAGE_SIZE'], descending=True)
+    tournaments = keyset_page(Tournament.query, Tournament.tournament_id,
+                              request.args.get('tournaments_after', type=int),
+                              app.config['ADMIN_PAGE_SIZE'], descending=True)
+    now = datetime.now()
+    return render_template('admin.html', players=players, tournaments=tournaments, search=search, now=now)
+
+
+def csv_response(filename, chunks):
+    return Response(stream_with_context(chunks), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/admin/export/players.csv')
+def export_players():
+    if 'admin_id' not in session or session.get('user_type') != 'ADMIN':
+        flash('Access denied')
+        return redirect(url_for('dashboard'))
+    
+    # Plain columns rather than Player objects, so streamed rows are not kept in the session
+    query = db.session.query(Player.player_id, Player.username, Player.email,
+                             Player.created_at, Player.last_login)
+    return csv_response('players.csv', stream_csv(
+        query, Player.player_id, ['player_id', 'username', 'email', 'created_at', 'last_login'],
+        app.config['CSV_BATCH_SIZE']))
+
+@app.route('/admin/export/tournaments.csv')
+def export_tournaments():
+    if 'admin_id' not in session or session.get('user_type') != 'ADMIN':
+        flash('Access denied')
+        return redirect(url_for('dashboard'))
+    
+    query = db.session.query(Tournament.tournament_id, Tournament.name, Tournament.start_date,
+                             Tournament.end_date, Tournament.created_by)
+    return csv_response('tournaments.csv', stream_csv(
+        query, Tournament.tournament_id, ['tournament_id', 'name', 'start_date', 'end_date', 'created_by'],
+        app.config['CSV_BATCH_SIZE']))
 
 
 @app.route('/admin/add_admin', methods=['GET', 'POST'])
@@ -314,7 +764,11 @@ def add_admin():
             return redirect(url_for('add_admin'))
         
         # Create new admin directly
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HasherBusy:
+            flash('Server busy, please try again in a moment')
+            return redirect(url_for('add_admin'))
         new_admin = Admin(
             username=username,
             password=hashed_password
@@ -347,6 +801,7 @@ def add_tournament():
         )
         db.session.add(tournament)
         db.session.commit()
+        tournament_schedule.invalidate()
         flash('Tournament added!')
         return redirect(url_for('admin_dashboard'))
     return render_template('add_tournament.html')
@@ -357,61 +812,119 @@ def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    player = Player.query.get(session['user_id'])
+    player = session_identity()
     
-    # Get top 10 highscores from all players
-    leaderboard = db.session.query(
-        Highscore, Player.username
-    ).join(
-        Player, Highscore.player_id == Player.player_id
-    ).order_by(
-        Highscore.score.desc()
-    ).limit(10).all()
+    # Get top 10 highscores from all players (from the in-memory leaderboard)
+    leaderboard_rows = [(entry, entry.username) for entry in leaderboard.top(10)]
     
     # Get current player's highscore and rank
-    player_highscore = Highscore.query.filter_by(player_id=session['user_id']).first()
-    
-    if player_highscore:
-        # Calculate player's rank
-        rank_query = db.session.query(
-            db.func.count(Highscore.highscore_id)
-        ).filter(
-            Highscore.score > player_highscore.score
-        ).scalar()
-        
-        player_rank = rank_query + 1
-    else:
-        player_highscore = None
-        player_rank = None
+    player_highscore = leaderboard.best(session['user_id'])
+    player_rank = leaderboard.rank(session['user_id'])
     
     return render_template(
         'dashboard.html', 
         player=player, 
-        leaderboard=leaderboard,
+        leaderboard=leaderboard_rows,
         player_highscore=player_highscore,
         player_rank=player_rank
     )
 
 
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    limit = min(request.args.get('limit', 10, type=int), 100)
+    
+    top = [{
+        'rank': leaderboard.rank_of_score(entry.score),
+        'player_id': entry.player_id,
+        'username': entry.username,
+        'score': entry.score,
+        'time': entry.time.isoformat() if entry.time else None
+    } for entry in leaderboard.top(limit)]
+    
+    player = None
+    if 'user_id' in session:
+        best = leaderboard.best(session['user_id'])
+        if best:
+            player = {'score': best.score, 'rank': leaderboard.rank_of_score(best.score)}
+    
+    return jsonify({'leaderboard': top, 'player': player, 'total': len(leaderboard)})
+
+@app.route('/api/leaderboard/check')
+def api_leaderboard_check():
+    if 'admin_id' not in session or session.get('user_type') != 'ADMIN':
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    # Write out buffered scores first so the database has caught up
+    score_writer.flush()
+    if request.args.get('reload'):
+        leaderboard.load()
+    return jsonify(leaderboard.check())
+
+
+@app.route('/api/verifier')
+def api_verifier():
+    if 'admin_id' not in session or session.get('user_type') != 'ADMIN':
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    return jsonify(score_verifier.stats())
+
+
+@app.route('/api/rooms')
+def api_rooms():
+    if 'admin_id' not in session or session.get('user_type') != 'ADMIN':
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    return jsonify(room_manager.stats())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config['METRICS_TOKEN']
+    authorized = token and secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and ('admin_id' not in session or session.get('user_type') != 'ADMIN'):
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/matchmaking')
+def api_matchmaking():
+    if 'admin_id' not in session or session.get('user_type') != 'ADMIN':
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    return jsonify(matchmaker.stats())
+
+
 @app.route('/host')
 def host_game():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    # Generate a unique room code
-    room_code = generate_room_code()
+    # Reserve a unique room code
+    room_code = room_codes.reserve()
     
     # Create a new game room
-    game_rooms[room_code] = {
-        'host_id': session['user_id'],
-        'host_name': session['username'],
-        'players': [{
-            'id': session['user_id'],
-            'username': session['username'],
-            'sid': None  # Will be updated when socket connects
-        }],
-        'status': 'waiting'
-    }
+    try:
+        room_manager.open(room_code, {
+            'host_id': session['user_id'],
+            'host_name': session['username'],
+            'players': {
+                player_key(session['user_id']): {
+                    'id': session['user_id'],
+                    'username': session['username'],
+                    'sid': None  # Will be updated when socket connects
+                }
+            },
+            'status': 'waiting'
+        })
+    except RoomLimitReached:
+        flash(f"You already have {app.config['MAX_ROOMS_PER_HOST']} open rooms")
+        return redirect(url_for('dashboard'))
+    except ValueError as e:
+        print(f"Could not open room {room_code}: {e}")
+        flash('Could not open a game room, please try again')
+        return redirect(url_for('dashboard'))
     
     # Store room code in session
     session['current_room'] = room_code
@@ -423,14 +936,20 @@ def join_game(room_code):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    if room_code not in game_rooms:
+    room = game_rooms.get(room_code)
+    if room is None:
         flash('Game room not found')
         return redirect(url_for('dashboard'))
     
-    if game_rooms[room_code]['status'] != 'waiting':
+    if room['status'] != 'waiting':
         flash('Game has already started')
         return redirect(url_for('dashboard'))
     
+    # Quick match sends the host here too
+    if room['host_id'] == session['user_id']:
+        session['current_room'] = room_code
+        return render_template('host.html', room_code=room_code)
+    
     return render_template('waiting_room.html', room_code=room_code)
 
 @app.route('/play/<room_code>')
@@ -438,67 +957,173 @@ def play_game(room_code):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    if room_code not in game_rooms:
+    room = game_rooms.get(room_code)
+    if room is None:
         flash('Game room not found')
         return redirect(url_for('dashboard'))
     
-    is_host = game_rooms[room_code]['host_id'] == session['user_id']
+    is_host = room['host_id'] == session['user_id']
+    
+    # Everyone in a started room plays the same piece sequence
+    game_seed = score_verifier.issue_seed(session['user_id'], room.get('seed'))
     
-    return render_template('play.html', room_code=room_code, is_host=is_host)
+    return render_template('play.html', room_code=room_code, is_host=is_host, game_seed=game_seed,
+                           sync_mode=room.get('mode', 'frames'))
+
+@app.route('/watch/<room_code>')
+def watch_game(room_code):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    room = game_rooms.get(room_code)
+    if room is None:
+        flash('Game room not found')
+        return redirect(url_for('dashboard'))
+    
+    return render_template('watch.html', room_code=room_code)
+
+@app.route('/replay/<int:replay_id>')
+def watch_replay(replay_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    replay = replay_store.get(replay_id)
+    if replay is None:
+        flash('Replay not found')
+        return redirect(url_for('dashboard'))
+    
+    player = Player.query.filter_by(player_id=replay.player_id).first()
+    return render_template('replay.html', replay=replay,
+                           username=player.username if player else f'Player {replay.player_id}',
+                           recorded_at=datetime.fromtimestamp(replay.recorded_at))
+
+# The raw replay record (layout in replay_store.py), streamed from the
+# memory-mapped segment; records never change once written
+@app.route('/api/replays/<int:replay_id>')
+def api_replay(replay_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    found = replay_store.stream(replay_id)
+    if found is None:
+        return jsonify({'success': False, 'message': 'Replay not found'}), 404
+    
+    length, chunks = found
+    return Response(chunks, mimetype='application/octet-stream', headers={
+        'Content-Length': str(length),
+        'Cache-Control': 'private, max-age=31536000, immutable'
+    })
+
+# Replay id of a score posted over HTTP (see announce_replay), once verified
+@app.route('/api/replays/pending/<replay_key>')
+def api_pending_replay(replay_key):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    entry = game_rooms.fetch('replay:' + replay_key)
+    if entry is None or entry['player_id'] != session['user_id']:
+        return jsonify({'success': True, 'pending': True})
+    return jsonify({'success': True, 'pending': False, 'replay_id': entry['replay_id']})
+
+@app.route('/api/replays')
+def api_replays():
+    if 'admin_id' not in session or session.get('user_type') != 'ADMIN':
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    return jsonify(replay_store.stats())
 
 @app.route('/singleplayer')
 def singleplayer():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    # Check for active tournaments
-    active_tournament = Tournament.query.filter(
-        Tournament.start_date <= datetime.now(),
-        Tournament.end_date >= datetime.now(),
-        Tournament.is_active == True
-    ).first()
+    # Check for active tournaments (served from the schedule cache)
+    active_tournament = tournament_schedule.active()
     
     tournament_id = active_tournament.tournament_id if active_tournament else None
     
-    return render_template('singleplayer.html', tournament_id=tournament_id)
+    return render_template('singleplayer.html', tournament_id=tournament_id,
+                           game_seed=score_verifier.issue_seed(session['user_id']))
 
 
 from datetime import datetime
 
 @app.route('/tournaments')
 def tournaments():
-    tournaments = Tournament.query.all()
+    tournaments = tournament_schedule.all()
     return render_template('tournaments.html', tournaments=tournaments, datetime=datetime, now=datetime.utcnow())
 
 
+@app.route('/tournaments/<int:tournament_id>/results')
+def tournament_results(tournament_id):
+    tournament = Tournament.query.get_or_404(tournament_id)
+    
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    
+    # Standings come from the cache, not from aggregating Highscore rows
+    standings = tournament_boards.get(tournament_id)
+    entries = standings.page((page - 1) * per_page, per_page)
+    total = len(standings)
+    
+    player_rank = standings.rank(session['user_id']) if 'user_id' in session else None
+    
+    return render_template(
+        'tournament_results.html',
+        tournament=tournament,
+        entries=entries,
+        page=page,
+        per_page=per_page,
+        total=total,
+        pages=max((total + per_page - 1) // per_page, 1),
+        player_rank=player_rank
+    )
+
+
 @app.route('/api/save_score', methods=['POST'])
 def save_score():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
     data = request.json
-    score = data.get('score', 0)
+    score = read_score(data)
+    if score is None:
+        return jsonify({'success': False, 'message': 'Invalid score'}), 400
     tournament_id = data.get('tournament_id')
     
+    replay = read_replay(data, session['user_id'])
+    if replay is None:
+        return jsonify({'success': False, 'message': 'Missing or invalid game replay'}), 400
+    
     # Check if this is a new high score for the player
-    player_best = Highscore.query.filter_by(player_id=session['user_id']).order_by(Highscore.score.desc()).first()
+    player_best = leaderboard.best(session['user_id'])
     
-    is_new_highscore = not player_best or score > player_best.score
+    is_new_highscore = player_best is None or score > player_best.score
     
-    # Save the score
-    new_score = Highscore(
-        player_id=session['user_id'],
-        score=score,
-        tournament_id=tournament_id if tournament_id else None
-    )
+    # Only count the score towards a tournament that is running right now
+    tournament = tournament_schedule.get(tournament_id) if tournament_id else None
+    tournament_id = tournament.tournament_id if tournament and tournament.is_active else None
     
-    db.session.add(new_score)
-    db.session.commit()
+    # Saved, with its replay, once the replay checks out
+    replay_key = uuid.uuid4().hex
+    seed, actions = replay
+    score_verifier.submit({
+        'kind': 'score',
+        'player_id': session['user_id'],
+        'username': session['username'],
+        'score': score,
+        'tournament_id': tournament_id,
+        'seed': seed,
+        'actions': actions,
+        'replay_key': replay_key
+    })
     
     return jsonify({
         'success': True, 
         'is_new_highscore': is_new_highscore,
-        'score': score
+        'score': score,
+        'replay_key': replay_key,
+        'next_seed': score_verifier.issue_seed(session['user_id'])
     })
 
 
@@ -512,119 +1137,271 @@ def logout():
 def handle_connect():
     if 'user_id' not in session:
         return False
+    connected_players[request.sid] = session_identity()
     print(f"Client connected: {request.sid}")
 
 @socketio.on('join_room')
 def handle_join_room(data):
     room_code = data['room_code']
-    
-    if room_code not in game_rooms:
-        emit('error', {'message': 'Room not found'})
-        return
-    
-    join_room(room_code)
-    
+    me = current_player()
     player_info = {
-        'id': session['user_id'],
-        'username': session['username'],
+        'id': me.player_id,
+        'username': me.username,
         'sid': request.sid
     }
     
-    # Update player's socket ID if they're already in the room
-    player_exists = False
-    for player in game_rooms[room_code]['players']:
-        if player['id'] == session['user_id']:
-            player['sid'] = request.sid
-            player_exists = True
-            break
+    with game_rooms.transaction(room_code) as room:
+        if room is not None:
+            # Update player's socket ID if they're already in the room,
+            # otherwise add them
+            player = room['players'].get(player_key(me.player_id))
+            if player is not None:
+                if player['sid'] and player['sid'] != request.sid:
+                    game_rooms.unbind_sid(player['sid'])
+                player['sid'] = request.sid
+            else:
+                room['players'][player_key(me.player_id)] = player_info
+            game_rooms.bind_sid(request.sid, room_code, me.player_id)
+            room_manager.touch(room)
+    
+    if room is None:
+        emit('error', {'message': 'Room not found'})
+        return
     
-    # Add player to the room if not already in
-    if not player_exists:
-        game_rooms[room_code]['players'].append(player_info)
+    join_room(room_code)
     
     # Notify everyone in the room
     emit('player_joined', {
         'player': player_info,
-        'players': game_rooms[room_code]['players'],
-        'host_id': game_rooms[room_code]['host_id']
+        'players': list(room['players'].values()),
+        'host_id': room['host_id']
     }, to=room_code)
 
+# Acknowledged straight away so the client can time a round trip for join_queue
+@socketio.on('matchmaking_ping')
+def handle_matchmaking_ping(data=None):
+    return True
+
+@socketio.on('join_queue')
+def handle_join_queue(data=None):
+    me = current_player()
+    data = data if isinstance(data, dict) else {}
+    try:
+        rtt = min(max(float(data.get('rtt', 0)), 0), 10000)
+    except (TypeError, ValueError):
+        rtt = 0
+    best = leaderboard.best(me.player_id)
+    matchmaker.join(request.sid, me.player_id, me.username, best.score if best else 0, rtt)
+    emit('queue_joined', {'queued': len(matchmaker)})
+
+@socketio.on('leave_queue')
+def handle_leave_queue(data=None):
+    matchmaker.leave(current_player().player_id, request.sid)
+    emit('queue_left', {})
+
+@socketio.on('spectate')
+def handle_spectate(data):
+    room_code = data['room_code']
+    
+    if room_code not in game_rooms:
+        emit('error', {'message': 'Room not found'})
+        return
+    
+    # Spectators are not players: they only join the room's watch channel,
+    # so they get the (slower) snapshot stream and none of the player events
+    if spectators.get(request.sid) != room_code:
+        if request.sid in spectators:
+            leave_room(spectator_room(spectators[request.sid]))
+            room_broadcaster.unwatch(spectators[request.sid])
+        join_room(spectator_room(room_code))
+        spectators[request.sid] = room_code
+        room_broadcaster.watch(room_code)
+    send_game_state(room_code)
+
+@socketio.on('request_game_state')
+def handle_request_game_state(data):
+    room_code = data['room_code']
+    
+    if room_code in game_rooms:
+        send_game_state(room_code)
+
+# Bring a late joiner up to date from the cached state: the latest frames of
+# every player, or their whole input streams in input mode
+def send_game_state(room_code):
+    snapshot = room_broadcaster.snapshot(room_code)
+    if snapshot:
+        emit('room_snapshot', {'players': snapshot})
+    streams = lockstep_rooms.streams(room_code)
+    if streams:
+        emit('room_inputs', {'players': [{'player_id': player_id, 'inputs': stream.packet()}
+                                         for player_id, stream in streams.items()]})
+
 @socketio.on('get_players')
 def handle_get_players(data):
     room_code = data['room_code']
+    room = game_rooms.get(room_code)
     
-    if room_code not in game_rooms:
+    if room is None:
         emit('error', {'message': 'Room not found'})
         return
     
     emit('player_joined', {
-        'players': game_rooms[room_code]['players'],
-        'host_id': game_rooms[room_code]['host_id']
+        'players': list(room['players'].values()),
+        'host_id': room['host_id']
     })
 
 @socketio.on('start_game')
 def handle_start_game(data):
     room_code = data['room_code']
-    
-    if room_code not in game_rooms:
-        emit('error', {'message': 'Room not found'})
+    error = None
+    
+    with game_rooms.transaction(room_code) as room:
+        if room is None:
+            error = 'Room not found'
+        elif current_player().player_id != room['host_id']:
+            error = 'Only the host can start the game'
+        else:
+            # Starting again cancels any pending return to the waiting room
+            room.pop('countdown', None)
+            room['status'] = 'playing'
+            for player in room['players'].values():
+                player.pop('game_over', None)
+            room_manager.touch(room)
+            # Shared seed for this round's piece sequence (see tetris_engine.PieceSequence)
+            room['seed'] = secrets.randbits(32)
+            mode = data.get('mode', 'frames')
+            room['mode'] = mode if mode in SYNC_MODES else 'frames'
+    
+    if error is not None:
+        emit('error', {'message': error})
         return
     
-    if session['user_id'] != game_rooms[room_code]['host_id']:
-        emit('error', {'message': 'Only the host can start the game'})
-        return
+    # Frames and inputs from the last round must not reach late joiners
+    room_broadcaster.discard(room_code)
+    lockstep_rooms.discard(room_code)
     
-    game_rooms[room_code]['status'] = 'playing'
-    emit('game_started', {}, to=room_code)
+    emit('game_started', {'seed': room['seed']}, to=[room_code, spectator_room(room_code)])
 
 @socketio.on('game_update')
 def handle_game_update(data):
     room_code = data['room_code']
-    game_state = data['game_state']
     
     if room_code not in game_rooms:
         return
     
-    # Broadcast game state to all players in the room except sender
-    emit('game_update', {
-        'player_id': session['user_id'],
-        'game_state': game_state
-    }, to=room_code, include_self=False)
+    if 'inputs' in data:
+        handle_input_packet(room_code, data['inputs'])
+        return
+    
+    # Queue the packed board frame (see static/js/boardsync.js) for the next
+    # room_snapshot. The bytes are passed through untouched; superseded
+    # frames are dropped before the flush.
+    room_broadcaster.submit(room_code, current_player().player_id, data['frame'], key=data.get('key', False))
+
+# Input-mode update: record the player's new actions and relay them with the
+# next tick. Anything already received is skipped, and a gap asks the sender
+# to resend from the last action we have.
+def handle_input_packet(room_code, packet):
+    player_id = current_player().player_id
+    try:
+        seed, game, start, actions = parse_packet(packet)
+        if seed is not None:
+            # Only the room's own seed: any other would build (and cache) a new piece sequence
+            room = game_rooms.get(room_code)
+            if room is None or seed != room.get('seed'):
+                return
+        stream, first, new = lockstep_rooms.submit(room_code, player_id, seed, game, start, actions)
+    except (TypeError, ValueError):
+        return
+    except LookupError as e:
+        emit('input_resend', {'from': e.args[0]})
+        return
+    
+    # An empty packet from index 0 announces a new game and is relayed too
+    if new or start == 0:
+        room_broadcaster.submit_inputs(room_code, player_id, stream.seed, game, first, new)
+
+@socketio.on('request_inputs')
+def handle_request_inputs(data):
+    room_code = data['room_code']
+    
+    # Someone missed part of a player's inputs: send them the whole stream
+    stream = lockstep_rooms.stream(room_code, data['player_id'])
+    if stream is not None:
+        emit('room_inputs', {'players': [{'player_id': data['player_id'], 'inputs': stream.packet()}]})
+
+@socketio.on('request_resync')
+def handle_request_resync(data):
+    room_code = data['room_code']
+    player_id = data['player_id']
+    room = game_rooms.get(room_code)
+    
+    if room is None:
+        return
+    
+    # Ask the player whose frames were missed to send a full keyframe
+    player = room['players'].get(player_key(player_id))
+    if player and player['sid']:
+        emit('resync_requested', {}, room=player['sid'])
 
 @socketio.on('game_over')
 def handle_game_over(data):
     room_code = data['room_code']
-    score = data['score']
+    score = read_score(data)
     
     if room_code not in game_rooms:
         return
+    if score is None:
+        emit('error', {'message': 'Invalid score'})
+        return
     
-    # Save highscore
-    new_highscore = Highscore(
-        player_id=session['user_id'],
-        score=score
-    )
-    db.session.add(new_highscore)
-    db.session.commit()
+    # Save the score once its replay has been verified
+    me = current_player()
+    replay = read_replay(data, me.player_id)
+    if replay is not None:
+        seed, actions = replay
+        score_verifier.submit({
+            'kind': 'score',
+            'player_id': me.player_id,
+            'username': me.username,
+            'score': score,
+            'seed': seed,
+            'actions': actions,
+            'sid': request.sid  # replay_saved goes here once the game is stored
+        })
+    else:
+        print(f"game_over from player {me.player_id} without a valid replay; score not saved")
+    emit('game_seed', score_verifier.issue_seed(me.player_id))
     
     # Mark this player as game over
-    for player in game_rooms[room_code]['players']:
-        if player['id'] == session['user_id']:
+    with game_rooms.transaction(room_code) as room:
+        if room is None:
+            return
+        player = room['players'].get(player_key(me.player_id))
+        if player is not None:
             player['game_over'] = True
+        
+        room_manager.touch(room)
+        
+        # Check if only one player is still active
+        active_players = [p for p in room['players'].values() if not p.get('game_over', False)]
+        
+        # Last player standing wins; schedule the return to the waiting room
+        if len(active_players) == 1:
+            room['countdown'] = uuid.uuid4().hex
+        elif not active_players and 'countdown' not in room:
+            # Nobody left to win (a one-player room)
+            room['status'] = 'finished'
     
     # Notify all players in the room
     emit('player_game_over', {
-        'player_id': session['user_id'],
-        'username': session['username'],
+        'player_id': me.player_id,
+        'username': me.username,
         'score': score
-    }, to=room_code)
-    
-    # Check if only one player is still active
-    active_players = [p for p in game_rooms[room_code]['players'] if not p.get('game_over', False)]
+    }, to=[room_code, spectator_room(room_code)])
     
     if len(active_players) == 1:
-        # Last player standing wins
-        winner_id = active_players[0]['id']
+        socketio.start_background_task(return_to_waiting, room_code, room['countdown'])
         winner_sid = active_players[0]['sid']
         winner_username = active_players[0]['username']
         
@@ -633,43 +1410,87 @@ def handle_game_over(data):
             'username': winner_username,
             'score': score
         }, room=winner_sid)
-        
-        # After 5 seconds, redirect everyone back to waiting room
-        socketio.sleep(5)
-        game_rooms[room_code]['status'] = 'waiting'
-        emit('return_to_waiting', {}, to=room_code)
+
+
+# Background task: after the post-game delay, send everyone back to the waiting room.
+# Clearing room['countdown'] (or deleting the room) before then cancels it.
+def return_to_waiting(room_code, countdown, delay=5):
+    socketio.sleep(delay)
+    with game_rooms.transaction(room_code) as room:
+        if room is None or room.get('countdown') != countdown:
+            return
+        del room['countdown']
+        room['status'] = 'waiting'
+        room_manager.touch(room)
+    socketio.emit('return_to_waiting', {}, to=room_code)
 
 
 @socketio.on('disconnect')
 def handle_disconnect(reason=None):
     print(f"Client disconnected: {request.sid}, reason: {reason}")
+    me = connected_players.pop(request.sid, None)
     
-    # Remove player from any game rooms they were in
-    for room_code, room_data in list(game_rooms.items()):
-        for player in list(room_data['players']):
-            if player['sid'] == request.sid:
-                room_data['players'].remove(player)
-                emit('player_left', {
-                    'player_id': player['id'],
-                    'username': player['username']
-                }, to=room_code)
-                
-                # If host left and game hasn't started, close the room
-                if room_data['host_id'] == player['id'] and room_data['status'] == 'waiting':
-                    emit('room_closed', {'message': 'Host has left the game'}, to=room_code)
-                    if room_code in game_rooms:  # Check if room still exists
-                        del game_rooms[room_code]
-                    break
-                
-                # If room is empty and game hasn't started, remove it
-                if not room_data['players'] and room_data['status'] == 'waiting':
-                    if room_code in game_rooms:  # Check if room still exists
-                        del game_rooms[room_code]
-                    break
+    watching = spectators.pop(request.sid, None)
+    if watching is not None:
+        room_broadcaster.unwatch(watching)
+    
+    if me is not None:
+        matchmaker.leave(me.player_id, request.sid)
+    
+    # Find the room this socket was in through the sid index
+    entry = game_rooms.lookup_sid(request.sid)
+    if entry is None:
+        return
+    room_code, user_id = entry
+    game_rooms.unbind_sid(request.sid)
+    
+    host_left = deleted = False
+    with game_rooms.transaction(room_code) as room:
+        player = room['players'].get(player_key(user_id)) if room else None
+        # Ignore sockets that were replaced by a newer connection
+        if player is None or player['sid'] != request.sid:
+            return
+        
+        del room['players'][player_key(user_id)]
+        room_manager.touch(room)
+        
+        # If host left and game hasn't started, close the room
+        if room['host_id'] == player['id'] and room['status'] == 'waiting':
+            game_rooms.delete(room_code)
+            host_left = deleted = True
+        
+        # If room is empty and game hasn't started, remove it
+        elif not room['players'] and room['status'] == 'waiting':
+            game_rooms.delete(room_code)
+            deleted = True
+        
+        # Everyone left mid-game: keep it briefly for reconnects, then the reaper takes it
+        elif not room['players']:
+            room['status'] = 'finished'
+    
+    # Sent once the room is saved and unlocked
+    room_broadcaster.discard(room_code, user_id)
+    lockstep_rooms.discard(room_code, user_id)
+    emit('player_left', {
+        'player_id': player['id'],
+        'username': player['username']
+    }, to=[room_code, spectator_room(room_code)])
+    if host_left:
+        emit('room_closed', {'message': 'Host has left the game'}, to=[room_code, spectator_room(room_code)])
+    if deleted:
+        forget_room(room_code)
+
 
 
+# Run once per server process before it takes requests (gunicorn calls it
+# from post_worker_init): the first page should not pay for loading the leaderboard
+def warm_up():
+    leaderboard.load()
+    leaderboard.start_sync(socketio, app.config['LEADERBOARD_SYNC_INTERVAL'])
+    if matchmaker.feed is not None:
+        matchmaker.start()
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
+    upgrade_database()
+    warm_up()
     socketio.run(app)
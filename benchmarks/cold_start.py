@@ -0,0 +1,103 @@
+"""Cold start: time to import app.py and serve the first requests, in fresh interpreters.
+
+Each run starts a new Python process (as a serverless cold start does) and
+times importing the app, then the first GET /login, then the first
+Socket.IO poll, which is when the realtime stack starts. The same is done
+with everything started eagerly at import (Flask-Migrate registered and the
+Socket.IO server built), as before the lazy initialization. Also lists
+which heavy packages a /login request loaded.
+
+--importtime prints the modules app.py spends its import time on, from
+python -X importtime.
+
+Usage: python benchmarks/cold_start.py [--runs 7] [--importtime] [--top 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+HEAVY = ('flask_socketio', 'socketio', 'engineio', 'flask_migrate', 'alembic', 'mako')
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+if EAGER:
+    app.init_migrations()
+    app.socketio.start()
+imported = time.perf_counter()
+client = app.app.test_client()
+assert client.get('/login').status_code == 200
+login = time.perf_counter()
+loaded = [name for name in HEAVY if name in sys.modules]
+assert client.get('/socket.io/?EIO=4&transport=polling').status_code == 200
+socket = time.perf_counter()
+print(json.dumps({'import': imported - start, 'login': login - imported,
+                  'socket': socket - login, 'loaded': loaded}))
+'''
+
+
+def child_env():
+    env = dict(os.environ)
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'cold.db')
+    env['SOCKETIO_LOG_SAMPLE'] = '0'
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    return env
+
+
+def run_child(eager):
+    code = f'EAGER = {eager}\nHEAVY = {HEAVY!r}\n' + CHILD
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=child_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_report(top):
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT,
+                            env=child_env(), capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative), int(own), depth, name.strip()))
+    total = next(cumulative for cumulative, _, _, name in rows if name == 'app')
+    print(f'\nimport app: {total / 1000:.0f} ms; packages app.py imports directly, by cumulative time:')
+    direct = sorted((row for row in rows if row[2] == 1), reverse=True)
+    for cumulative, own, _, name in direct[:top]:
+        print(f'  {name:<32} {cumulative / 1000:8.1f} ms  {cumulative / total:6.1%}')
+    print(f'\nmodules with the most time of their own:')
+    for cumulative, own, _, name in sorted(rows, key=lambda row: -row[1])[:top]:
+        print(f'  {name:<48} {own / 1000:8.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--importtime', action='store_true')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'median of {args.runs} fresh processes (ms)')
+    print(f'{"":<8} {"import":>8} {"GET /login":>11} {"first socket":>13} {"import+login":>13}')
+    for label, eager in (('eager', True), ('lazy', False)):
+        runs = [run_child(eager) for _ in range(args.runs)]
+        median = {key: statistics.median(run[key] for run in runs) * 1000
+                  for key in ('import', 'login', 'socket')}
+        print(f'{label:<8} {median["import"]:8.0f} {median["login"]:11.0f} {median["socket"]:13.0f} '
+              f'{median["import"] + median["login"]:13.0f}')
+        if not eager:
+            print(f'heavy packages loaded by GET /login: {", ".join(runs[0]["loaded"]) or "none"}')
+
+    if args.importtime:
+        import_report(args.top)
+
+
+if __name__ == '__main__':
+    main()
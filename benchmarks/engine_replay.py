@@ -0,0 +1,94 @@
+"""Replay throughput of tetris_engine: games verified per second on one core.
+
+Generates --games action logs with a simple greedy player (random pieces,
+best-looking column and rotation, occasional gravity ticks and soft drops),
+then times replaying all of them from scratch.
+
+Usage: python benchmarks/engine_replay.py [--games 500] [--max-pieces 200] [--seed 0]
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tetris_engine import (COLS, PLACEMENTS, ROWS, FULL_ROW, GRAVITY, HARD_DROP, LEFT, RIGHT,
+                           ROTATE_CW, SOFT_DROP, Game, replay)
+
+
+def placement_cost(game):
+    # Drop a copy of the current piece and score the resulting board
+    trial = copy.copy(game)
+    while trial._move(0, 1):
+        pass
+    board = list(game.board)
+    for dy, mask in PLACEMENTS[trial.type][trial.rotation][trial.x]:
+        if trial.y + dy >= 0:
+            board[trial.y + dy] |= mask
+    cleared = board.count(FULL_ROW)
+    board = [row for row in board if row != FULL_ROW]
+    height = next((ROWS - cleared - y for y, row in enumerate(board) if row), 0)
+    holes = sum(bin(~board[y] & board[y - 1] & FULL_ROW).count('1') for y in range(1, len(board)))
+    return height + 4 * holes - 10 * cleared
+
+
+def play(rng, max_pieces, pieces=None):
+    if pieces is None:
+        pieces = [rng.randrange(7) for _ in range(max_pieces + 8)]
+    game = Game(pieces)
+    actions = []
+    for _ in range(max_pieces):
+        best = None
+        for turns in range(4):
+            for dx in range(-COLS // 2, COLS // 2 + 1):
+                trial = copy.copy(game)
+                for _ in range(turns):
+                    trial._rotate(1)
+                for _ in range(abs(dx)):
+                    trial._move(-1 if dx < 0 else 1, 0)
+                cost = placement_cost(trial)
+                if best is None or cost < best[0]:
+                    best = (cost, turns, dx)
+        _, turns, dx = best
+        moves = [rng.choice([GRAVITY, SOFT_DROP]) for _ in range(rng.randrange(3))]
+        moves += [ROTATE_CW] * turns + [LEFT if dx < 0 else RIGHT] * abs(dx) + [HARD_DROP]
+        for action in moves:
+            actions.append(action)
+            if not game.step(action):
+                return pieces, bytes(actions), game
+    return pieces, bytes(actions), game
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=500)
+    parser.add_argument('--max-pieces', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    games = [play(rng, args.max_pieces) for _ in range(args.games)]
+    print(f'Generated {args.games} games in {time.perf_counter() - start:.1f}s')
+
+    actions = sum(len(log) for _, log, _ in games)
+    pieces = sum(game.pieces_locked for _, _, game in games)
+    lines = sum(game.lines for _, _, game in games)
+
+    start = time.perf_counter()
+    for piece_list, log, expected in games:
+        result = replay(log, piece_list)
+        assert (result.score, result.lines) == (expected.score, expected.lines)
+    elapsed = time.perf_counter() - start
+
+    print(f'{actions} actions, {pieces} pieces locked, {lines} lines cleared '
+          f'({actions / args.games:.0f} actions/game)')
+    print(f'Replayed in {elapsed:.2f}s: {args.games / elapsed:.0f} games/s, '
+          f'{actions / elapsed / 1e6:.2f}M actions/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""Multiplayer load test: drives the real app with simulated players and checks it against a baseline.
+
+Runs app.py in-process on a fresh SQLite database (built through the
+migrations) with Flask test clients for HTTP and Flask-SocketIO test
+clients for sockets, so every request and event goes through the real
+handlers, room store and room broadcaster. Phases:
+
+  1. signup + login          HTTP, bcrypt cost lowered to --rounds
+  2. rooms                   /host, join_room, start_game; traced with
+                             tracemalloc for the server-side memory per room
+  3. play                    game_update stream at --apm actions per minute
+                             per player for --duration seconds; frames carry
+                             a sequence number so every room_snapshot a
+                             player receives gives a fan-out latency (send
+                             to delivery, including the broadcaster tick)
+  4. game over               every player sends game_over
+  5. disconnect storm        every socket disconnects at once
+
+Signup, game over and disconnect are a few hundred events each, so they are
+reported as median latency per event, which is steadier than a rate.
+
+--save-baseline writes the results and the parameters used to --baseline;
+--check reruns with the baseline's parameters and exits 1 if any figure is
+more than --tolerance worse. Baselines are machine-specific: save one on the
+machine that runs the check.
+
+Usage: python benchmarks/load_test.py [--rooms 50] [--players 4] [--apm 150] [--duration 10]
+                                      [--spectators 0] [--store memory://] [--rounds 4]
+                                      [--save-baseline | --check] [--baseline path] [--tolerance 0.3]
+"""
+import argparse
+import contextlib
+import heapq
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+BASELINE = os.path.join(os.path.dirname(__file__), 'load_test_baseline.json')
+PARAMS = ('rooms', 'players', 'apm', 'duration', 'spectators', 'store', 'rounds', 'frame_bytes', 'key_every')
+
+# Result -> True if higher is better
+RESULTS = {
+    'signup_login_p50_ms': False,
+    'updates_per_s': True,
+    'update_handler_per_s': True,
+    'fanout_p50_ms': False,
+    'fanout_p99_ms': False,
+    'game_over_p50_ms': False,
+    'disconnect_p50_ms': False,
+    'memory_per_room_kb': False,
+}
+
+# Allocations made by the simulated clients, not the server
+CLIENT_FILES = ('*/flask_socketio/test_client.py', '*/flask/testing.py', '*/werkzeug/test.py',
+                '*/werkzeug/sansio/*', '*/http/cookiejar.py', __file__, tracemalloc.__file__)
+
+
+class TimedQueue(list):
+    """A test client's receive queue that stamps each packet on arrival."""
+
+    def append(self, packet):
+        packet['received_at'] = time.perf_counter()
+        super().append(packet)
+
+
+def drain(client):
+    packets = client.queue[:]
+    del client.queue[:len(packets)]
+    return packets
+
+
+def percentile(samples, q):
+    return samples[min(int(len(samples) * q), len(samples) - 1)] if samples else 0.0
+
+
+def run(args, appmod):
+    app, socketio = appmod.app, appmod.socketio
+    results = {}
+
+    def connect(http):
+        client = socketio.test_client(app, flask_test_client=http)
+        client.queue = TimedQueue(client.queue)
+        sid = socketio.server.manager.sid_from_eio_sid(client.eio_sid, '/')
+        client.player_id = appmod.connected_players[sid].player_id
+        return client
+
+    # 1. Accounts
+    total = args.rooms * (args.players + args.spectators)
+    http_clients = []
+    samples = []
+    for i in range(total):
+        start = time.perf_counter()
+        http = app.test_client()
+        name = f'load{i}'
+        http.post('/signup', data={'username': name, 'password': 'password', 'email': f'{name}@example.com'})
+        response = http.post('/login', data={'username': name, 'password': 'password'})
+        assert response.status_code == 302, f'login failed for {name}'
+        http_clients.append(http)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    results['signup_login_p50_ms'] = percentile(samples, 0.5) * 1000
+
+    # 2. Rooms, traced. The Socket.IO server starts on first use; start it
+    # first so its one-off imports are not counted against the rooms
+    socketio.start()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    rooms = []  # (room_code, player clients, spectator clients)
+    per_room = args.players + args.spectators
+    for r in range(args.rooms):
+        group = http_clients[r * per_room:(r + 1) * per_room]
+        host = group[0]
+        assert host.get('/host').status_code == 200
+        with host.session_transaction() as session:
+            room_code = session['current_room']
+        players = []
+        for http in group[:args.players]:
+            client = connect(http)
+            client.emit('join_room', {'room_code': room_code})
+            players.append(client)
+        spectators = []
+        for http in group[args.players:]:
+            client = connect(http)
+            client.emit('spectate', {'room_code': room_code})
+            spectators.append(client)
+        players[0].emit('start_game', {'room_code': room_code})
+        rooms.append((room_code, players, spectators))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    server = [tracemalloc.Filter(False, pattern) for pattern in CLIENT_FILES]
+    grown = sum(stat.size_diff for stat in after.filter_traces(server).compare_to(before.filter_traces(server), 'filename'))
+    results['memory_per_room_kb'] = grown / args.rooms / 1024
+    del before, after
+
+    # 3. Play: each player sends an update every 60/apm seconds, staggered
+    interval = 60.0 / args.apm
+    filler = 'A' * args.frame_bytes
+    schedule = []
+    for r, (room_code, players, _) in enumerate(rooms):
+        for p, client in enumerate(players):
+            offset = interval * (r * args.players + p) / (args.rooms * args.players)
+            heapq.heappush(schedule, (offset, r, p))
+    sent = {}  # sequence number -> send time
+    latencies = []
+    receivers = [client for _, players, spectators in rooms for client in players + spectators]
+
+    def collect():
+        for client in receivers:
+            for packet in drain(client):
+                if packet['name'] != 'room_snapshot':
+                    continue
+                for update in packet['args'][0]['players']:
+                    if update['player_id'] == client.player_id:
+                        continue  # our own board, echoed back
+                    for frame in update['frames']:
+                        sent_at = sent.get(int(frame.split(':', 1)[0], 16))
+                        if sent_at is not None:
+                            latencies.append(packet['received_at'] - sent_at)
+
+    for client in receivers:
+        drain(client)
+    seq = 0
+    handler_time = 0.0
+    begin = time.perf_counter()
+    next_collect = begin
+    while True:
+        due, r, p = schedule[0]
+        now = time.perf_counter() - begin
+        if due >= args.duration:
+            break
+        if due > now:
+            time.sleep(min(due - now, 0.005))
+        else:
+            heapq.heapreplace(schedule, (due + interval, r, p))
+            room_code, players, _ = rooms[r]
+            seq += 1
+            frame = f'{seq:x}:{filler}'
+            sent_at = time.perf_counter()
+            sent[seq] = sent_at
+            players[p].emit('game_update', {'room_code': room_code, 'frame': frame,
+                                            'key': seq % args.key_every == 0})
+            handler_time += time.perf_counter() - sent_at
+        if time.perf_counter() >= next_collect:
+            collect()
+            next_collect = time.perf_counter() + 0.01
+    elapsed = time.perf_counter() - begin
+    time.sleep(3.0 / appmod.app.config['ROOM_TICK_RATE'])  # let the last ticks flush
+    collect()
+    latencies.sort()
+    results['updates_per_s'] = seq / elapsed
+    results['update_handler_per_s'] = seq / handler_time if handler_time else 0.0
+    results['fanout_p50_ms'] = percentile(latencies, 0.5) * 1000
+    results['fanout_p99_ms'] = percentile(latencies, 0.99) * 1000
+    results['fanout_samples'] = len(latencies)
+
+    # 4. Game over
+    samples = []
+    for room_code, players, _ in rooms:
+        for client in players:
+            start = time.perf_counter()
+            client.emit('game_over', {'room_code': room_code, 'score': 0})
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    results['game_over_p50_ms'] = percentile(samples, 0.5) * 1000
+    results['game_over_p99_ms'] = percentile(samples, 0.99) * 1000
+
+    # 5. Disconnect storm
+    samples = []
+    for client in receivers:
+        start = time.perf_counter()
+        client.disconnect()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    results['disconnect_p50_ms'] = percentile(samples, 0.5) * 1000
+    results['disconnect_p99_ms'] = percentile(samples, 0.99) * 1000
+    results['rooms_left'] = len(appmod.game_rooms)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    failures = []
+    for name, higher_is_better in RESULTS.items():
+        expected = baseline['results'].get(name)
+        if not expected:
+            continue
+        change = (results[name] - expected) / expected
+        worse = -change if higher_is_better else change
+        status = 'REGRESSED' if worse > tolerance else 'ok'
+        print(f'  {name:<22} {results[name]:>12.2f}   baseline {expected:>12.2f}   {change:+7.1%}   {status}')
+        if worse > tolerance:
+            failures.append(name)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--apm', type=float, default=150)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--spectators', type=int, default=0)
+    parser.add_argument('--store', default='memory://')
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--frame-bytes', type=int, default=40)
+    parser.add_argument('--key-every', type=int, default=20)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--save-baseline', action='store_true')
+    mode.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for name in PARAMS:
+            setattr(args, name, baseline['params'][name])
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'load.db')
+    os.environ['ROOM_STORE_URL'] = args.store
+    os.environ['BCRYPT_ROUNDS'] = str(args.rounds)
+    os.environ['SOCKETIO_LOG_SAMPLE'] = '0'
+    os.environ.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    sys.path.insert(0, ROOT)
+
+    params = {name: getattr(args, name) for name in PARAMS}
+    print('load test: ' + ', '.join(f'{k}={v}' for k, v in params.items()))
+
+    # The app prints a line per connection and game over; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as appmod
+    
+        appmod.upgrade_database(os.path.join(ROOT, 'migrations'))
+        results = run(args, appmod)
+
+    for name, value in results.items():
+        print(f'  {name:<22} {value:>12.2f}')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=2)
+            f.write('\n')
+        print(f'baseline saved to {args.baseline}')
+    elif args.check:
+        print(f'against {args.baseline} (tolerance {args.tolerance:.0%}):')
+        failures = compare(results, baseline, args.tolerance)
+        if failures:
+            print('regressions: ' + ', '.join(failures))
+            sys.exit(1)
+        print('no regressions')
+
+
+if __name__ == '__main__':
+    main()
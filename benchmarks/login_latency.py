@@ -0,0 +1,107 @@
+"""Login latency (p50/p99): credential lookup before and after the joined query, and full POST /login.
+
+Seeds a fresh SQLite database with --players accounts, then times
+  * the old two-query lookup (Player by username, then LoginInformation),
+  * the joined single-query lookup used by login(),
+  * complete POST /login requests through the test client.
+bcrypt cost is lowered (--rounds) so the lookup is not drowned out by hashing.
+
+Usage: python benchmarks/login_latency.py [--players 100000] [--logins 2000] [--rounds 4]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import bcrypt
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+
+def seed(path, players, rounds):
+    # One shared hash keeps seeding fast; lookups don't care
+    hashed = bcrypt.hashpw(b'password', bcrypt.gensalt(rounds)).decode('utf-8')
+    now = datetime.now()
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            'INSERT INTO player (player_id, username, email, created_at) VALUES (?, ?, ?, ?)',
+            ((i, f'player{i}', f'player{i}@example.com', now) for i in range(1, players + 1))
+        )
+        conn.executemany(
+            'INSERT INTO login_information (player_id, password, role) VALUES (?, ?, ?)',
+            ((i, hashed, 'PLAYER') for i in range(1, players + 1))
+        )
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(len(samples) * q), len(samples) - 1)] * 1000
+    return pick(0.5), pick(0.99)
+
+
+def timed(fn, usernames):
+    samples = []
+    for username in usernames:
+        start = time.perf_counter()
+        fn(username)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--logins', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=4)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'login.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['BCRYPT_ROUNDS'] = str(args.rounds)
+    sys.path.insert(0, ROOT)
+
+    import app as appmod
+
+    appmod.upgrade_database(os.path.join(ROOT, 'migrations'))
+    seed(path, args.players, args.rounds)
+
+    db, Player, LoginInformation = appmod.db, appmod.Player, appmod.LoginInformation
+    rng = random.Random(0)
+    usernames = [f'player{rng.randint(1, args.players)}' for _ in range(args.logins)]
+
+    def two_queries(username):
+        player = Player.query.filter_by(username=username).first()
+        LoginInformation.query.filter_by(player_id=player.player_id).first()
+        db.session.remove()
+
+    def joined(username):
+        db.session.query(Player, LoginInformation).outerjoin(
+            LoginInformation, LoginInformation.player_id == Player.player_id
+        ).filter(Player.username == username).first()
+        db.session.remove()
+
+    client = appmod.app.test_client()
+
+    def post_login(username):
+        response = client.post('/login', data={'username': username, 'password': 'password'})
+        assert response.status_code == 302, response.status_code
+
+    print(f'{args.players} players, {args.logins} logins, bcrypt cost {args.rounds}\n')
+    with appmod.app.app_context():
+        for name, fn in [('lookup: two queries (before)', two_queries),
+                         ('lookup: joined query (after)', joined),
+                         ('POST /login', post_login)]:
+            fn(usernames[0])  # warm up
+            p50, p99 = timed(fn, usernames)
+            print(f'{name:<32} p50 {p50:7.3f} ms   p99 {p99:7.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Query-plan report for the hot queries in app.py on a seeded SQLite database.
+
+Builds a fresh database through the migrations, seeds it (1M Highscore rows
+by default) and prints SQLite's EXPLAIN QUERY PLAN for each query, flagging
+any that fall back to a full table scan.
+
+Usage: python benchmarks/query_plans.py [--rows 1000000] [--players 100000] [--db path]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+
+def seed(path, rows, players, tournaments):
+    rng = random.Random(0)
+    now = datetime.now()
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            'INSERT INTO player (player_id, username, email, created_at) VALUES (?, ?, ?, ?)',
+            ((i, f'player{i}', f'player{i}@example.com', now) for i in range(1, players + 1))
+        )
+        conn.executemany(
+            'INSERT INTO tournament (tournament_id, name, start_date, end_date) VALUES (?, ?, ?, ?)',
+            ((i, f'Tournament {i}', now - timedelta(days=tournaments - i + 1), now - timedelta(days=tournaments - i))
+             for i in range(1, tournaments + 1))
+        )
+        conn.executemany(
+            'INSERT INTO highscore (player_id, score, time, tournament_id) VALUES (?, ?, ?, ?)',
+            ((rng.randint(1, players), rng.randint(0, 200000), now,
+              rng.randint(1, tournaments) if rng.random() < 0.1 else None) for _ in range(rows))
+        )
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def hot_queries(appmod):
+    from admin_listing import keyset_query, prefix_filter
+
+    db, Player, Tournament, Highscore = appmod.db, appmod.Player, appmod.Tournament, appmod.Highscore
+    LoginInformation = appmod.LoginInformation
+    page_size, batch_size = appmod.app.config['ADMIN_PAGE_SIZE'], appmod.app.config['CSV_BATCH_SIZE']
+    now = datetime.now()
+    return [
+        ('login', 'player and credentials by username',
+         db.session.query(Player, LoginInformation).outerjoin(
+             LoginInformation, LoginInformation.player_id == Player.player_id
+         ).filter(Player.username == 'player42').limit(1)),
+        ('signup', 'player by email',
+         Player.query.filter_by(email='player42@example.com')),
+        ('dashboard', 'player by id',
+         Player.query.filter_by(player_id=42)),
+        ('singleplayer', 'active tournament',
+         Tournament.query.filter(Tournament.start_date <= now, Tournament.end_date >= now)),
+        ('save_score', 'tournament by id',
+         Tournament.query.filter_by(tournament_id=7)),
+        ('score writer', 'existing best rows for a batch of players',
+         db.session.query(Highscore.highscore_id, Highscore.player_id, Highscore.score)
+         .filter(Highscore.player_id.in_([1, 2, 3])).order_by(Highscore.highscore_id)),
+        ('tournament_results', 'standings load',
+         db.session.query(Highscore.player_id, Player.username, Highscore.score, Highscore.time)
+         .join(Player, Highscore.player_id == Player.player_id).filter(Highscore.tournament_id == 7)),
+        ('leaderboard check', 'top 10 scores',
+         db.session.query(Highscore.score).order_by(Highscore.score.desc()).limit(10)),
+        ('leaderboard check', 'player best',
+         db.session.query(db.func.max(Highscore.score)).filter(Highscore.player_id == 42)),
+        ('leaderboard check', 'rank of a score',
+         db.session.query(db.func.count(Highscore.highscore_id)).filter(Highscore.score > 150000)),
+        ('admin_dashboard', 'players page, newest first',
+         keyset_query(Player.query, Player.player_id, 50000, page_size, descending=True)),
+        ('admin_dashboard', 'players by username prefix',
+         keyset_query(prefix_filter(Player.query, Player.username, 'player4'), Player.username,
+                      'player4123', page_size)),
+        ('admin_dashboard', 'players by email prefix',
+         keyset_query(prefix_filter(Player.query, Player.email, 'player4@'), Player.email, None, page_size)),
+        ('admin_tournaments', 'tournaments page, newest first',
+         keyset_query(Tournament.query, Tournament.tournament_id, 1000, page_size, descending=True)),
+        ('export_players', 'CSV batch',
+         keyset_query(db.session.query(Player.player_id, Player.username, Player.email,
+                                       Player.created_at, Player.last_login),
+                      Player.player_id, 50000, batch_size)),
+        ('export_tournaments', 'CSV batch',
+         keyset_query(db.session.query(Tournament.tournament_id, Tournament.name, Tournament.start_date,
+                                       Tournament.end_date, Tournament.created_by),
+                      Tournament.tournament_id, 1000, batch_size)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--tournaments', type=int, default=2000)
+    parser.add_argument('--db', help='SQLite file to (re)create; defaults to a temp file')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'plans.db')
+    if os.path.exists(path):
+        os.remove(path)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(path)
+    sys.path.insert(0, ROOT)
+
+    import app as appmod
+
+    appmod.upgrade_database(os.path.join(ROOT, 'migrations'))
+
+    start = time.perf_counter()
+    seed(path, args.rows, args.players, args.tournaments)
+    print(f'Seeded {args.rows} highscores / {args.players} players in {time.perf_counter() - start:.1f}s ({path})\n')
+
+    conn = sqlite3.connect(path)
+    full_scans = checked = 0
+    with appmod.app.app_context():
+        dialect = appmod.db.engine.dialect
+        for route, name, query in hot_queries(appmod):
+            checked += 1
+            sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+            plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+            scans = [step for step in plan if step.startswith('SCAN') and 'INDEX' not in step]
+            full_scans += bool(scans)
+            start = time.perf_counter()
+            conn.execute(sql).fetchall()
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"[{'FULL SCAN' if scans else 'indexed'}] {route}: {name} ({elapsed:.2f} ms)")
+            for step in plan:
+                print(f'    {step}')
+
+    print(f'\n{full_scans} of {checked} queries use a full table scan')
+    sys.exit(1 if full_scans else 0)
+
+
+if __name__ == '__main__':
+    main()
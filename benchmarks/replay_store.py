@@ -0,0 +1,141 @@
+"""Replay storage: bytes per recorded game, append rate and lookup latency.
+
+Plays --games games with the greedy player from engine_replay.py, timed
+like a person at the keyboard: every input takes 80-250 ms, gravity ticks
+fall in between at the level's speed (as in game.js), and some pieces are
+brought down by holding soft drop, which repeats every 100 ms. Game length
+is drawn between half and one and a half times --pieces.
+
+Reports the size of each game as submitted (tetris_engine.pack_actions,
+two actions per byte) and as stored by replay_store.py, then appends
+every game to a fresh store and reads --reads random games back through
+a second store instance, as another worker process would.
+
+Usage: python benchmarks/replay_store.py [--games 300] [--pieces 100] [--reads 20000]
+                                         [--segment-bytes 65536] [--seed 0]
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from engine_replay import placement_cost
+from replay_store import ReplayStore, encode_replay
+from tetris_engine import (COLS, GRAVITY, HARD_DROP, LEFT, RIGHT, ROTATE_CW, SOFT_DROP, Game,
+                           pack_actions, seeded_pieces)
+
+KEY_REPEAT = 0.1  # seconds, autoRepeatRate in game.js
+
+
+def gravity_interval(game):
+    if game.lines == 0:
+        return 1.0
+    return max(0.016, max(1, 48 - game.level * 5) * 0.01667)
+
+
+def play(rng, seed, pieces):
+    game = Game(seeded_pieces(seed))
+    actions = []
+    clock = 0.0  # time since the last gravity tick
+
+    def act(action, seconds):
+        nonlocal clock
+        clock += seconds
+        while clock >= gravity_interval(game):
+            clock -= gravity_interval(game)
+            actions.append(GRAVITY)
+            if not game.step(GRAVITY):
+                return False
+        actions.append(action)
+        return game.step(action)
+
+    for _ in range(pieces):
+        best = None
+        for turns in range(4):
+            for dx in range(-COLS // 2, COLS // 2 + 1):
+                trial = copy.copy(game)
+                for _ in range(turns):
+                    trial._rotate(1)
+                for _ in range(abs(dx)):
+                    trial._move(-1 if dx < 0 else 1, 0)
+                cost = placement_cost(trial)
+                if best is None or cost < best[0]:
+                    best = (cost, turns, dx)
+        _, turns, dx = best
+        moves = [(ROTATE_CW, rng.uniform(0.08, 0.25)) for _ in range(turns)]
+        if dx:
+            # Held: the first move, then auto-repeat
+            move = LEFT if dx < 0 else RIGHT
+            moves += [(move, rng.uniform(0.08, 0.25))] + [(move, KEY_REPEAT)] * (abs(dx) - 1)
+        if rng.random() < 0.3:
+            moves += [(SOFT_DROP, KEY_REPEAT)] * rng.randrange(3, 15)
+        moves += [(HARD_DROP, rng.uniform(0.08, 0.25))]
+        for action, seconds in moves:
+            if not act(action, seconds):
+                return bytes(actions), game
+    return bytes(actions), game
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=300)
+    parser.add_argument('--pieces', type=int, default=100)
+    parser.add_argument('--reads', type=int, default=20000)
+    parser.add_argument('--segment-bytes', type=int, default=64 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    games = []
+    for _ in range(args.games):
+        seed = rng.getrandbits(32)
+        actions, game = play(rng, seed, rng.randint(args.pieces // 2, args.pieces * 3 // 2))
+        games.append((seed, actions, game))
+
+    packed = [len(pack_actions(actions)) for _, actions, _ in games]
+    stored = [len(encode_replay(1000, game.score, seed, actions)) for seed, actions, game in games]
+    print(f'{args.games} games, {sum(game.pieces_locked for *_, game in games) / args.games:.0f} pieces '
+          f'and {sum(len(actions) for _, actions, _ in games) / args.games:.0f} actions each on average')
+    print(f'{"bytes per game":<16} {"mean":>8} {"p50":>8} {"p99":>8}')
+    for label, sizes in (('submitted', packed), ('stored', stored)):
+        print(f'{label:<16} {sum(sizes) / len(sizes):8.0f} {percentile(sizes, 0.5):8} {percentile(sizes, 0.99):8}')
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ReplayStore(directory, segment_bytes=args.segment_bytes)
+        start = time.perf_counter()
+        ids = [store.append(1000, game.score, seed, actions) for seed, actions, game in games]
+        elapsed = time.perf_counter() - start
+        print(f'append: {len(ids) / elapsed:,.0f} games/s ({elapsed / len(ids) * 1e6:.0f} us each)')
+        stats = store.stats()
+        print(f'store: {stats["games"]} games in {stats["segments"]} segments, '
+              f'{stats["avg_bytes_per_game"]} bytes per game on disk')
+
+        reader = ReplayStore(directory)
+        picks = [rng.choice(ids) for _ in range(args.reads)]
+        start = time.perf_counter()
+        for game_id in picks:
+            reader.record(game_id)
+        elapsed = time.perf_counter() - start
+        print(f'record lookup: {elapsed / args.reads * 1e6:.1f} us each')
+        start = time.perf_counter()
+        for game_id in picks[:args.reads // 10]:
+            reader.get(game_id)
+        elapsed = time.perf_counter() - start
+        print(f'lookup + decode: {elapsed / (args.reads // 10) * 1e6:.1f} us each')
+        for (seed, actions, _), game_id in zip(games, ids):
+            assert reader.get(game_id).actions == actions
+
+
+if __name__ == '__main__':
+    main()
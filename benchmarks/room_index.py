@@ -0,0 +1,75 @@
+"""Disconnect lookup cost with 10k active rooms: sid index vs. scanning every room.
+
+Usage: python benchmarks/room_index.py [--rooms 10000] [--players 4] [--store memory://]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from room_store import create_room_store, player_key
+
+
+def populate(store, rooms, players_per_room):
+    sids = []
+    for r in range(rooms):
+        room_code = f'R{r:05d}'
+        players = {}
+        for p in range(players_per_room):
+            user_id = r * players_per_room + p
+            sid = f'sid-{user_id}'
+            players[player_key(user_id)] = {'id': user_id, 'username': f'user{user_id}', 'sid': sid}
+            store.bind_sid(sid, room_code, user_id)
+            sids.append(sid)
+        store.save(room_code, {'host_id': r * players_per_room, 'players': players, 'status': 'playing'})
+    return sids
+
+
+def scan_lookup(store, sid):
+    # What handle_disconnect used to do: walk every room and every player
+    for room_code, room in store.items():
+        for player in room['players'].values():
+            if player['sid'] == sid:
+                return room_code, player['id']
+    return None
+
+
+def timed(fn, sids):
+    start = time.perf_counter()
+    for sid in sids:
+        assert fn(sid) is not None
+    return (time.perf_counter() - start) / len(sids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=10000)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--scan-lookups', type=int, default=20)
+    parser.add_argument('--store', default='memory://')
+    args = parser.parse_args()
+
+    url = args.store
+    if url == 'sqlite':
+        url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'rooms.db')
+    store = create_room_store(url)
+
+    sids = populate(store, args.rooms, args.players)
+    rng = random.Random(0)
+
+    indexed = timed(store.lookup_sid, rng.sample(sids, args.lookups))
+    scanned = timed(lambda sid: scan_lookup(store, sid), rng.sample(sids, args.scan_lookups))
+
+    print(f'store: {type(store).__name__}, rooms: {args.rooms}, players/room: {args.players}')
+    print(f'sid index lookup: {indexed * 1e6:10.2f} us/disconnect')
+    print(f'full room scan:   {scanned * 1e6:10.2f} us/disconnect')
+    print(f'speedup:          {scanned / indexed:10.0f}x')
+
+
+if __name__ == '__main__':
+    main()
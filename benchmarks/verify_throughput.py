@@ -0,0 +1,63 @@
+"""Score verification throughput against the number of worker processes.
+
+Plays --games seeded games with the greedy player from engine_replay.py,
+packs their logs as the browser does, and replays --jobs of them through
+score_verifier.verify_replay on multiprocessing pools of 1, 2, 4, ... up
+to --processes workers.
+
+Usage: python benchmarks/verify_throughput.py [--games 100] [--jobs 4000] [--processes N]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from engine_replay import play
+from score_verifier import verify_replay
+from tetris_engine import pack_actions, seeded_pieces
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--jobs', type=int, default=4000)
+    parser.add_argument('--max-pieces', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    games = []
+    for _ in range(args.games):
+        seed = rng.getrandbits(32)
+        _, actions, game = play(rng, args.max_pieces, seeded_pieces(seed))
+        games.append((seed, pack_actions(actions), game.score))
+    jobs = [games[i % len(games)][:2] for i in range(args.jobs)]
+    expected = [games[i % len(games)][2] for i in range(args.jobs)]
+    print(f'{args.jobs} jobs from {args.games} games, '
+          f'{sum(len(log) for _, log in jobs) / len(jobs):.0f} bytes/log on average\n')
+
+    counts = [1]
+    while counts[-1] * 2 <= args.processes:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != args.processes:
+        counts.append(args.processes)
+
+    base = None
+    for processes in counts:
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            pool.starmap(verify_replay, jobs[:processes])  # warm up the workers
+            start = time.perf_counter()
+            results = pool.starmap(verify_replay, jobs, max(1, len(jobs) // (processes * 4)))
+            elapsed = time.perf_counter() - start
+        assert [result.score for result in results] == expected
+        rate = args.jobs / elapsed
+        base = base or rate
+        print(f'{processes:>3} processes: {rate:8.0f} games/s  ({rate / base:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import multiprocessing
+import os
+
+# Run with: gunicorn -c gunicorn.conf.py app:app
+#
+# Running more than one worker needs shared state:
+#   ROOM_STORE_URL          sqlite:///instance/rooms.db (one host) or redis://host:6379/0
+#   SOCKETIO_MESSAGE_QUEUE  redis://host:6379/0 (or any kombu URL) so broadcasts reach
+#                           clients connected to other workers
+#   REPLAY_DIR              a directory every worker can write; replays are appended
+#                           under flock, so workers on one host share it safely
+# Each Socket.IO client must also stay on the worker it connected to, so put a
+# sticky load balancer in front or have clients use the websocket transport only.
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+worker_class = 'eventlet'
+
+if os.getenv('ROOM_STORE_URL', 'memory://').startswith('memory://'):
+    # Rooms live in process memory; a second worker would not see them
+    workers = 1
+else:
+    workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Read by app.py to share the cores out between the workers' score verifier pools
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+
+def post_worker_init(worker):
+    # The app is imported by now; load the leaderboard before the first request
+    from app import warm_up
+    warm_up()
@@ -0,0 +1,394 @@
+import itertools
+import random
+import threading
+import time as clock
+import uuid
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
+
+from sortedcontainers import SortedList
+
+from room_store import FeedLost
+
+# Room store feed channel carrying score changes between workers
+FEED_CHANNEL = 'leaderboard'
+
+LeaderboardEntry = namedtuple('LeaderboardEntry', 'score player_id username time')
+
+
+class Leaderboard:
+    """In-memory index of every Highscore row, ordered by score.
+
+    Rows are kept in a SortedList keyed by (-score, seq), where seq is the
+    highscore_id for rows loaded from the database and a local counter for
+    rows added since, so top-N and rank queries are O(log n).
+
+    Servers call `load()` before taking requests (the first query loads it
+    otherwise) and it is updated in place when scores are submitted. Every
+    worker holds its own index, so with a shared room store (`feed`) each
+    change is also published there, and `start_sync()` applies the other
+    workers' changes every few seconds; tournament scores are passed on to
+    `tournament_boards`. A worker that falls further behind than the feed
+    reloads.
+
+    Highscore rows are written behind (see ScoreWriter), so `load()` can
+    read the table before a change's row is flushed. Changes from the last
+    `pending_ttl` seconds are kept, including the feed messages that arrive
+    while the table is read, and applied again after it unless the row was
+    read with the same player, score and time. `check()` reports any drift
+    that remains and `load()` repairs it.
+    """
+
+    def __init__(self, app, db, highscore_model, player_model, feed=None, tournament_boards=None, pending_ttl=60.0):
+        self.app = app
+        self.db = db
+        self.Highscore = highscore_model
+        self.Player = player_model
+        self.feed = feed
+        self.tournament_boards = tournament_boards
+        self.pending_ttl = pending_ttl
+        self.origin = uuid.uuid4().hex  # tells this process's feed messages apart
+        self._recent = deque()  # (received at, op, player_id, username, score, time), oldest first
+        self._cursor = None
+        self._task = None
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self._order = SortedList()  # (-score, seq)
+        self._entries = {}  # seq -> LeaderboardEntry
+        self._first = {}  # player_id -> seq of the player's oldest row
+        self._best = {}  # player_id -> seq of the player's best row
+        self._seq = itertools.count(1)
+
+    def load(self):
+        Highscore, Player = self.Highscore, self.Player
+        with self._lock, self.app.app_context():
+            cursor = None
+            if self.feed is not None:
+                # Changes up to here are kept in _recent, later ones are read after the table
+                self._read_messages()
+                cursor = self.feed.feed_cursor(FEED_CHANNEL)
+            self._reset()
+            self._prune()
+            unseen = {(player_id, score, time) for _, _, player_id, _, score, time in self._recent}
+            max_id = 0
+            rows = self.db.session.query(
+                Highscore.highscore_id, Highscore.score, Highscore.player_id, Highscore.time, Player.username
+            ).join(Player, Highscore.player_id == Player.player_id).order_by(Highscore.highscore_id)
+            for highscore_id, score, player_id, time, username in rows.yield_per(10000):
+                self._insert(highscore_id, LeaderboardEntry(score, player_id, username, time))
+                unseen.discard((player_id, score, time))
+                max_id = highscore_id
+            self._seq = itertools.count(max_id + 1)
+            if self.feed is not None:
+                self._cursor = cursor
+                self._read_messages()
+            # Rows still waiting to be written
+            for _, op, player_id, username, score, time in self._recent:
+                if (player_id, score, time) not in unseen:
+                    continue
+                unseen.discard((player_id, score, time))
+                if op == 'best':
+                    self._raise_best(player_id, username, score, time)
+                else:
+                    self._insert(next(self._seq), LeaderboardEntry(score, player_id, username, time))
+            self._loaded = True
+
+    def _read_messages(self):
+        """Keep the other workers' changes since the cursor in _recent without applying them."""
+        if self._cursor is None:
+            return
+        try:
+            messages, self._cursor = self.feed.read_feed(FEED_CHANNEL, self._cursor)
+        except FeedLost:
+            return
+        for message in messages:
+            if message['origin'] != self.origin:
+                self._remember(message)
+
+    def _remember(self, message):
+        time = datetime.fromisoformat(message['time'])
+        self._recent.append((clock.monotonic(), message['op'], message['player_id'], message['username'],
+                             message['score'], time))
+        if message.get('tournament_id') and self.tournament_boards is not None:
+            self.tournament_boards.record(message['tournament_id'], message['player_id'], message['username'],
+                                          message['score'], time)
+
+    def _prune(self):
+        expired = clock.monotonic() - self.pending_ttl
+        while self._recent and self._recent[0][0] < expired:
+            self._recent.popleft()
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    def _insert(self, seq, entry):
+        self._order.add((-entry.score, seq))
+        self._entries[seq] = entry
+        self._first.setdefault(entry.player_id, seq)
+        best = self._best.get(entry.player_id)
+        if best is None or (-entry.score, seq) < (-self._entries[best].score, best):
+            self._best[entry.player_id] = seq
+
+    def add_score(self, player_id, username, score, time, tournament_id=None):
+        """Mirror a new Highscore row."""
+        self.ensure_loaded()
+        self._add(player_id, username, score, time)
+        self._publish('add', player_id, username, score, time, tournament_id)
+
+    def set_best(self, player_id, username, score, time):
+        """Mirror save_highscore: raise the player's first row, or add one."""
+        self.ensure_loaded()
+        self._set_best(player_id, username, score, time)
+        self._publish('best', player_id, username, score, time)
+
+    def _add(self, player_id, username, score, time):
+        with self._lock:
+            self._recent.append((clock.monotonic(), 'add', player_id, username, score, time))
+            self._prune()
+            self._insert(next(self._seq), LeaderboardEntry(score, player_id, username, time))
+
+    def _set_best(self, player_id, username, score, time):
+        with self._lock:
+            self._recent.append((clock.monotonic(), 'best', player_id, username, score, time))
+            self._prune()
+            self._raise_best(player_id, username, score, time)
+
+    def _raise_best(self, player_id, username, score, time):
+        seq = self._first.get(player_id)
+        if seq is None:
+            self._insert(next(self._seq), LeaderboardEntry(score, player_id, username, time))
+            return
+        old = self._entries[seq]
+        if score <= old.score:
+            return
+        self._order.remove((-old.score, seq))
+        self._order.add((-score, seq))
+        self._entries[seq] = LeaderboardEntry(score, player_id, username, time)
+        if score > self._entries[self._best[player_id]].score:
+            self._best[player_id] = seq
+
+    def _publish(self, op, player_id, username, score, time, tournament_id=None):
+        if self.feed is None:
+            return
+        try:
+            self.feed.publish(FEED_CHANNEL, {
+                'origin': self.origin, 'op': op, 'player_id': player_id, 'username': username,
+                'score': score, 'time': time.isoformat(), 'tournament_id': tournament_id
+            })
+        except Exception as e:
+            # The other workers catch up at their next reload
+            print(f"Leaderboard change not shared: {e}")
+
+    def sync(self):
+        """Apply the changes other workers published since the last sync; returns how many."""
+        if self.feed is None or self._cursor is None:
+            return 0
+        with self._lock:
+            try:
+                messages, cursor = self.feed.read_feed(FEED_CHANNEL, self._cursor)
+            except FeedLost:
+                self.load()
+                return 0
+            applied = 0
+            for message in messages:
+                if message['origin'] == self.origin:
+                    continue
+                time = datetime.fromisoformat(message['time'])
+                args = message['player_id'], message['username'], message['score'], time
+                if message['op'] == 'best':
+                    self._set_best(*args)
+                else:
+                    self._add(*args)
+                    if message.get('tournament_id') and self.tournament_boards is not None:
+                        self.tournament_boards.record(message['tournament_id'], *args)
+                applied += 1
+            self._cursor = cursor
+            return applied
+
+    def start_sync(self, socketio, interval=1.0):
+        """Follow the other workers' changes from a background task (needs a feed)."""
+        if self.feed is None or self._task is not None:
+            return
+        self._task = socketio.start_background_task(self._run, socketio, interval)
+
+    def _run(self, socketio, interval):
+        while True:
+            socketio.sleep(interval)
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Leaderboard sync failed: {e}")
+
+    def top(self, n=10):
+        self.ensure_loaded()
+        with self._lock:
+            return [self._entries[seq] for _, seq in self._order.islice(0, n)]
+
+    def best(self, player_id):
+        self.ensure_loaded()
+        seq = self._best.get(player_id)
+        return self._entries[seq] if seq is not None else None
+
+    def rank_of_score(self, score):
+        """1 + number of rows with a strictly higher score."""
+        self.ensure_loaded()
+        with self._lock:
+            return self._order.bisect_left((-score, 0)) + 1
+
+    def rank(self, player_id):
+        best = self.best(player_id)
+        return self.rank_of_score(best.score) if best else None
+
+    def __len__(self):
+        self.ensure_loaded()
+        return len(self._order)
+
+    def check(self, samples=20):
+        """Compare the index against the database and return a report."""
+        self.ensure_loaded()
+        Highscore, Player = self.Highscore, self.Player
+        mismatches = []
+        with self.app.app_context():
+            db_count = self.db.session.query(self.db.func.count(Highscore.highscore_id)).join(
+                Player, Highscore.player_id == Player.player_id
+            ).scalar()
+            if db_count != len(self):
+                mismatches.append({'check': 'count', 'db': db_count, 'index': len(self)})
+
+            db_top = [score for (score,) in self.db.session.query(Highscore.score).join(
+                Player, Highscore.player_id == Player.player_id
+            ).order_by(Highscore.score.desc()).limit(10)]
+            index_top = [entry.score for entry in self.top(10)]
+            if db_top != index_top:
+                mismatches.append({'check': 'top', 'db': db_top, 'index': index_top})
+
+            player_ids = random.sample(list(self._best), min(samples, len(self._best)))
+            for player_id in player_ids:
+                db_best = self.db.session.query(self.db.func.max(Highscore.score)).filter(
+                    Highscore.player_id == player_id
+                ).scalar()
+                db_rank = self.db.session.query(self.db.func.count(Highscore.highscore_id)).join(
+                    Player, Highscore.player_id == Player.player_id
+                ).filter(Highscore.score > db_best).scalar() + 1 if db_best is not None else None
+                index_best = self.best(player_id)
+                index_best = index_best.score if index_best else None
+                if (db_best, db_rank) != (index_best, self.rank(player_id)):
+                    mismatches.append({'check': 'player', 'player_id': player_id,
+                                       'db': [db_best, db_rank], 'index': [index_best, self.rank(player_id)]})
+
+        return {'consistent': not mismatches, 'rows': len(self), 'players_checked': len(player_ids),
+                'mismatches': mismatches}
+
+
+StandingsEntry = namedtuple('StandingsEntry', 'rank player_id username score time')
+
+
+class TournamentStandings:
+    """Best score per player for one tournament, kept in rank order."""
+
+    def __init__(self, rows):
+        self._order = SortedList()  # (-score, time, player_id)
+        self._players = {}  # player_id -> (score, time, username)
+        for player_id, username, score, time in rows:
+            self.record(player_id, username, score, time)
+
+    def record(self, player_id, username, score, time):
+        time = time or datetime.min
+        current = self._players.get(player_id)
+        if current is not None:
+            if score <= current[0]:
+                return
+            self._order.remove((-current[0], current[1], player_id))
+        # Ties go to whoever got there first
+        self._order.add((-score, time, player_id))
+        self._players[player_id] = (score, time, username)
+
+    def page(self, offset, limit):
+        entries = []
+        for neg_score, time, player_id in self._order.islice(offset, offset + limit):
+            rank = self._order.bisect_left((neg_score,)) + 1
+            entries.append(StandingsEntry(rank, player_id, self._players[player_id][2], -neg_score, time))
+        return entries
+
+    def rank(self, player_id):
+        current = self._players.get(player_id)
+        return self._order.bisect_left((-current[0],)) + 1 if current else None
+
+    def __len__(self):
+        return len(self._players)
+
+
+class TournamentBoards:
+    """Cache of TournamentStandings, built from the database on first access.
+
+    Standings are updated incrementally as tournament scores are submitted,
+    so result pages never aggregate raw scores. The least recently used
+    tournaments are dropped once more than `max_cached` are held. Scores
+    from the last `pending_ttl` seconds are merged into a board when it is
+    loaded, as their rows may not be written yet.
+    """
+
+    def __init__(self, app, db, highscore_model, player_model, max_cached=64, pending_ttl=60.0):
+        self.app = app
+        self.db = db
+        self.Highscore = highscore_model
+        self.Player = player_model
+        self.max_cached = max_cached
+        self.pending_ttl = pending_ttl
+        self._boards = OrderedDict()
+        self._pending = {}  # tournament_id -> deque of (recorded at, player_id, username, score, time)
+        self._lock = threading.RLock()
+
+    def get(self, tournament_id):
+        with self._lock:
+            board = self._boards.get(tournament_id)
+            if board is None:
+                board = self._boards[tournament_id] = TournamentStandings(self._load(tournament_id))
+                self._prune()
+                for _, player_id, username, score, time in self._pending.get(tournament_id, ()):
+                    board.record(player_id, username, score, time)
+                while len(self._boards) > self.max_cached:
+                    self._boards.popitem(last=False)
+            self._boards.move_to_end(tournament_id)
+            return board
+
+    def _load(self, tournament_id):
+        Highscore, Player = self.Highscore, self.Player
+        with self.app.app_context():
+            return self.db.session.query(
+                Highscore.player_id, Player.username, Highscore.score, Highscore.time
+            ).join(Player, Highscore.player_id == Player.player_id).filter(
+                Highscore.tournament_id == tournament_id
+            ).all()
+
+    def record(self, tournament_id, player_id, username, score, time):
+        with self._lock:
+            # Kept for a board loaded before the score's row is flushed
+            self._prune()
+            self._pending.setdefault(tournament_id, deque()).append(
+                (clock.monotonic(), player_id, username, score, time))
+            board = self._boards.get(tournament_id)
+            if board is not None:
+                board.record(player_id, username, score, time)
+
+    def _prune(self):
+        expired = clock.monotonic() - self.pending_ttl
+        for tournament_id in list(self._pending):
+            pending = self._pending[tournament_id]
+            while pending and pending[0][0] < expired:
+                pending.popleft()
+            if not pending:
+                del self._pending[tournament_id]
+
+    def invalidate(self, tournament_id=None):
+        with self._lock:
+            if tournament_id is None:
+                self._boards.clear()
+            else:
+                self._boards.pop(tournament_id, None)
@@ -0,0 +1,129 @@
+import struct
+import threading
+
+from tetris_engine import Game, pack_actions, seeded_pieces, unpack_actions
+
+# Input packet, little-endian: uint16 game number (counts the player's
+# restarts, which reuse the room seed), uint32 index of the first action,
+# the uint32 seed only when that index is 0, then actions packed two per
+# byte. Gravity ticks are actions too, so the log needs no timestamps to be
+# replayed. Same layout as encodeInputPacket() in static/js/lockstep.js.
+HEADER = struct.Struct('<HI')
+SEED = struct.Struct('<I')
+
+# Most actions in one packet (INPUT_MAX_PACKET_ACTIONS in lockstep.js, which
+# splits a long resend), and so the largest packet accepted
+MAX_PACKET_ACTIONS = 8192
+MAX_PACKET_BYTES = HEADER.size + SEED.size + MAX_PACKET_ACTIONS // 2
+
+
+def parse_packet(data):
+    """(seed or None, game, start, actions) from a packet; raises TypeError if it is not
+    bytes and ValueError if malformed or over MAX_PACKET_BYTES."""
+    if not isinstance(data, (bytes, bytearray)):
+        raise TypeError('input packet must be binary')
+    if len(data) > MAX_PACKET_BYTES:
+        raise ValueError('input packet too long')
+    data = bytes(data)
+    if len(data) < HEADER.size:
+        raise ValueError('input packet too short')
+    game, start = HEADER.unpack_from(data)
+    offset = HEADER.size
+    seed = None
+    if start == 0:
+        if len(data) < offset + SEED.size:
+            raise ValueError('input packet without a seed')
+        seed, = SEED.unpack_from(data, offset)
+        offset += SEED.size
+    return seed, game, start, unpack_actions(data[offset:])
+
+
+def build_packet(seed, game, start, actions):
+    header = HEADER.pack(game, start)
+    if start == 0:
+        header += SEED.pack(seed)
+    return header + pack_actions(actions)
+
+
+class InputStream:
+    """One player's input log for the current game, replayed as it arrives."""
+
+    def __init__(self, seed, number, max_actions=None):
+        self.seed = seed
+        self.number = number
+        self.max_actions = max_actions
+        self.actions = bytearray()
+        self.game = Game(seeded_pieces(seed))
+        self.valid = True
+
+    def extend(self, start, actions):
+        """Append actions beginning at index `start`.
+
+        Returns (index of the first new action, the new actions). Raises
+        LookupError (with the expected index) if there is a gap, and
+        ValueError if the log would grow past `max_actions`.
+        """
+        first = len(self.actions)
+        if start > first:
+            raise LookupError(first)
+        new = actions[first - start:]
+        if self.max_actions is not None and first + len(new) > self.max_actions:
+            raise ValueError('input log too long')
+        self.actions += new
+        for action in new:
+            try:
+                if self.valid and not self.game.step(action):
+                    break
+            except ValueError:
+                # Unknown action: the stream can no longer be followed
+                self.valid = False
+        return first, new
+
+    def packet(self, start=0):
+        return build_packet(self.seed, self.number, start, self.actions[start:])
+
+
+class LockstepRooms:
+    """Input streams of every player in input-sync rooms on this process.
+
+    The server follows each game with tetris_engine as the inputs arrive, so
+    a late or desynced client can be sent a player's whole stream. The
+    streams live in process memory; with several workers only the players
+    connected to this one are tracked. A stream stops growing at
+    `max_actions`.
+    """
+
+    def __init__(self, max_actions=None):
+        self.max_actions = max_actions
+        self._rooms = {}  # room_code -> {player_id: InputStream}
+        self._lock = threading.Lock()
+
+    def submit(self, room_code, player_id, seed, game, start, actions):
+        """Record a packet; returns (stream, index of the first new action, new actions).
+
+        A packet for another game must start at 0 (and so carry the seed) and
+        replaces the player's stream. Raises LookupError with the index to
+        resend from on a gap.
+        """
+        with self._lock:
+            players = self._rooms.setdefault(room_code, {})
+            stream = players.get(player_id)
+            if stream is None or stream.number != game or (start == 0 and stream.seed != seed):
+                if start:
+                    raise LookupError(0)
+                stream = players[player_id] = InputStream(seed, game, self.max_actions)
+            return (stream,) + stream.extend(start, actions)
+
+    def stream(self, room_code, player_id):
+        return self._rooms.get(room_code, {}).get(player_id)
+
+    def streams(self, room_code):
+        with self._lock:
+            return dict(self._rooms.get(room_code, {}))
+
+    def discard(self, room_code, player_id=None):
+        with self._lock:
+            if player_id is None:
+                self._rooms.pop(room_code, None)
+            elif room_code in self._rooms:
+                self._rooms[room_code].pop(player_id, None)
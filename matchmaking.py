@@ -0,0 +1,275 @@
+import bisect
+import collections
+import threading
+import time
+import uuid
+
+from room_store import FeedLost
+
+# Room store feed channel carrying queue changes between workers
+FEED_CHANNEL = 'matchmaking'
+
+# Upper bounds (seconds) of the wait-time histogram buckets; the last one is open
+WAIT_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120)
+
+
+class Ticket:
+    """A player waiting in the queue."""
+
+    __slots__ = ('ticket_id', 'sid', 'player_id', 'username', 'skill', 'latency', 'joined_at', 'cancelled')
+
+    def __init__(self, ticket_id, sid, player_id, username, skill, latency, joined_at):
+        self.ticket_id = ticket_id
+        self.sid = sid
+        self.player_id = player_id
+        self.username = username
+        self.skill = skill
+        self.latency = latency
+        self.joined_at = joined_at
+        self.cancelled = False
+
+
+class Matchmaker:
+    """Queue that groups waiting players into rooms of `room_size`.
+
+    Tickets are bucketed by skill (the bit length of the player's best score,
+    so each bucket spans a doubling of score) and by latency band (round-trip
+    ms, split at `latency_bands`). Joining and leaving are O(1): a ticket is
+    appended to its bucket's deque, and leaving only marks it cancelled.
+
+    Every `interval` seconds `match()` makes one pass over the queue:
+
+    1. full groups are taken from the front of every bucket, oldest first;
+    2. the few left over in each latency band are swept in skill order and
+       grouped with neighbouring buckets, allowing one skill bucket of
+       spread per `widen_after` seconds the oldest of them has waited;
+    3. players that have waited `ignore_latency_after` seconds are swept
+       once more across all latency bands.
+
+    A pass is linear in the number of queued tickets. `on_match(tickets)` is
+    called for every group formed.
+
+    With a shared room store (`feed`) every worker keeps a copy of the
+    whole queue: joins, leaves and matches are published there and applied
+    by the others each interval, and each pass is made by the one worker
+    that claims it in the store, so players on different workers are
+    matched together (their match_found reaches them through the Socket.IO
+    message queue). Call `start()` on every worker. Without a feed the
+    queue is this process's alone, which is only right with one worker.
+    """
+
+    def __init__(self, socketio, on_match, feed=None, room_size=2, interval=1.0, widen_after=10.0,
+                 ignore_latency_after=30.0, latency_bands=(60, 120, 250)):
+        self.socketio = socketio
+        self.on_match = on_match
+        self.feed = feed
+        self.origin = uuid.uuid4().hex  # tells this process's feed messages apart
+        self._cursor = None
+        self.room_size = room_size
+        self.interval = interval
+        self.widen_after = widen_after
+        self.ignore_latency_after = ignore_latency_after
+        self.latency_bands = latency_bands
+        self._buckets = collections.defaultdict(collections.deque)  # (latency band, skill) -> tickets
+        self._tickets = {}  # player_id -> Ticket
+        self._lock = threading.Lock()
+        self._task = None
+        self.waits = [0] * (len(WAIT_BUCKETS) + 1)
+        self.joined = 0
+        self.matched = 0
+        self.rooms_formed = 0
+        self.last_pass_ms = 0.0
+
+    @staticmethod
+    def skill_bucket(best_score):
+        return (best_score or 0).bit_length()
+
+    def latency_band(self, rtt_ms):
+        return bisect.bisect_left(self.latency_bands, rtt_ms)
+
+    def join(self, sid, player_id, username, best_score, rtt_ms):
+        """Queue a player; joining again (from any socket) replaces their earlier ticket."""
+        ticket = Ticket(uuid.uuid4().hex, sid, player_id, username, self.skill_bucket(best_score),
+                        self.latency_band(rtt_ms), time.time())
+        self._add(ticket)
+        self.joined += 1
+        self._publish({'op': 'join', 'ticket_id': ticket.ticket_id, 'sid': sid, 'player_id': player_id,
+                       'username': username, 'skill': ticket.skill, 'latency': ticket.latency,
+                       'joined_at': ticket.joined_at})
+        self._ensure_running()
+        return ticket
+
+    def leave(self, player_id, sid=None):
+        """Take a player out of the queue; with `sid`, only if they queued from that socket."""
+        ticket = self._remove(player_id, sid=sid)
+        if ticket is None:
+            return False
+        self._publish({'op': 'leave', 'ticket_id': ticket.ticket_id, 'player_id': player_id})
+        return True
+
+    def _add(self, ticket):
+        with self._lock:
+            previous = self._tickets.get(ticket.player_id)
+            if previous is not None:
+                previous.cancelled = True
+            self._tickets[ticket.player_id] = ticket
+            self._buckets[ticket.latency, ticket.skill].append(ticket)
+
+    def _remove(self, player_id, sid=None, ticket_id=None):
+        with self._lock:
+            ticket = self._tickets.get(player_id)
+            if ticket is None or (sid is not None and ticket.sid != sid) or \
+                    (ticket_id is not None and ticket.ticket_id != ticket_id):
+                return None
+            del self._tickets[player_id]
+        ticket.cancelled = True
+        return ticket
+
+    def _publish(self, message):
+        if self.feed is None:
+            return
+        try:
+            self.feed.publish(FEED_CHANNEL, dict(message, origin=self.origin))
+        except Exception as e:
+            print(f"Matchmaking change not shared: {e}")
+
+    def sync(self):
+        """Apply the queue changes other workers published since the last sync."""
+        if self.feed is None:
+            return 0
+        if self._cursor is None:
+            self._cursor = self.feed.feed_cursor(FEED_CHANNEL)
+            return 0
+        try:
+            messages, self._cursor = self.feed.read_feed(FEED_CHANNEL, self._cursor)
+        except FeedLost:
+            # Tickets from the lost stretch stay with the workers that took them
+            print("Matchmaking feed fell behind; skipping to its end")
+            self._cursor = self.feed.feed_cursor(FEED_CHANNEL)
+            return 0
+        for message in messages:
+            if message['origin'] == self.origin:
+                continue
+            if message['op'] == 'join':
+                self._add(Ticket(message['ticket_id'], message['sid'], message['player_id'], message['username'],
+                                 message['skill'], message['latency'], message['joined_at']))
+            elif message['op'] == 'leave':
+                self._remove(message['player_id'], ticket_id=message['ticket_id'])
+            elif message['op'] == 'matched':
+                for player_id, ticket_id in message['tickets']:
+                    self._remove(player_id, ticket_id=ticket_id)
+        return len(messages)
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def _sweep(self, tickets, now, groups):
+        """Group skill-sorted leftovers within the spread their waits allow; returns the rest."""
+        rest = []
+        window = collections.deque()
+        for ticket in tickets:
+            window.append(ticket)
+            while True:
+                oldest = min(t.joined_at for t in window)
+                allowed = int((now - oldest) / self.widen_after)
+                if window[-1].skill - window[0].skill <= allowed:
+                    break
+                rest.append(window.popleft())
+            if len(window) == self.room_size:
+                groups.append(list(window))
+                window.clear()
+        rest.extend(window)
+        return rest
+
+    def match(self):
+        """One matching pass. Returns the groups formed."""
+        start = time.perf_counter()
+        now = time.time()
+        groups = []
+        with self._lock:
+            leftovers = collections.defaultdict(list)  # latency band -> tickets
+            for (band, _), queue in self._buckets.items():
+                live = [t for t in queue if not t.cancelled]
+                full = len(live) - len(live) % self.room_size
+                for i in range(0, full, self.room_size):
+                    groups.append(live[i:i + self.room_size])
+                leftovers[band].extend(live[full:])
+
+            rest = []
+            for band in sorted(leftovers):
+                tickets = sorted(leftovers[band], key=lambda t: (t.skill, t.joined_at))
+                rest.extend(self._sweep(tickets, now, groups))
+
+            patient = [t for t in rest if now - t.joined_at >= self.ignore_latency_after]
+            if len(patient) >= self.room_size:
+                patient.sort(key=lambda t: (t.skill, t.joined_at))
+                left = set(map(id, self._sweep(patient, now, groups)))
+                rest = [t for t in rest if now - t.joined_at < self.ignore_latency_after or id(t) in left]
+
+            # Rebuild the queue from whoever is still waiting, oldest first
+            self._buckets = collections.defaultdict(collections.deque)
+            for ticket in sorted(rest, key=lambda t: t.joined_at):
+                self._buckets[ticket.latency, ticket.skill].append(ticket)
+            for group in groups:
+                for ticket in group:
+                    del self._tickets[ticket.player_id]
+                    self.waits[bisect.bisect_left(WAIT_BUCKETS, now - ticket.joined_at)] += 1
+            self.matched += sum(len(group) for group in groups)
+            self.rooms_formed += len(groups)
+        self.last_pass_ms = (time.perf_counter() - start) * 1000
+
+        if groups:
+            self._publish({'op': 'matched', 'tickets': [(t.player_id, t.ticket_id) for group in groups for t in group]})
+        for group in groups:
+            try:
+                self.on_match(group)
+            except Exception as e:
+                print(f"Matched room could not be opened: {e}")
+        return groups
+
+    def stats(self):
+        total = sum(self.waits)
+        histogram = {f'le_{bound}s': count for bound, count in zip(WAIT_BUCKETS, self.waits)}
+        histogram[f'gt_{WAIT_BUCKETS[-1]}s'] = self.waits[-1]
+
+        def quantile(q):
+            # Upper bound of the bucket holding the q-th wait
+            seen = 0
+            for bound, count in zip(WAIT_BUCKETS + (None,), self.waits):
+                seen += count
+                if total and seen >= q * total:
+                    return bound
+            return None
+
+        return {
+            'queued': len(self._tickets),
+            'joined': self.joined,
+            'matched': self.matched,
+            'rooms_formed': self.rooms_formed,
+            'last_pass_ms': round(self.last_pass_ms, 2),
+            'wait_histogram': histogram,
+            'wait_p50_le_s': quantile(0.5),
+            'wait_p99_le_s': quantile(0.99),
+        }
+
+    def start(self):
+        """Start following the queue; needed on every worker when there is a feed."""
+        self.sync()
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None:
+            with self._lock:
+                if self._task is None:
+                    self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.sync()
+                # One worker per pass; the claim lapses before the next one
+                if self._tickets and (self.feed is None or self.feed.claim('matchmaker', self.interval * 0.9)):
+                    self.match()
+            except Exception as e:
+                print(f"Matchmaking pass failed: {e}")
@@ -0,0 +1,339 @@
+import bisect
+import inspect
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from room_codes import CODE_LENGTH
+
+# Seconds; the defaults of the Prometheus client libraries
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def _samples(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for label_values, value in self._samples():
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last is +Inf) and the sum
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def _samples(self):
+        with self._lock:
+            return [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total) in self._samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read when the metrics are scraped.
+
+    `read()` returns a number, or with `labels` a dict of label-value
+    tuples to numbers.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, read, labels=()):
+        super().__init__(name, help, labels)
+        self.read = read
+
+    def _samples(self):
+        value = self.read()
+        return list(value.items()) if self.labels else [((), value)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read, labels=()):
+        return self._add(Gauge(name, help, read, labels))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # One broken gauge should not take the whole scrape down
+                lines.append(f'# {metric.name} unavailable: {e}')
+        return '\n'.join(lines) + '\n'
+
+
+def _audience_of(target):
+    """'players' or 'spectators' if `target` is a room or its spectator channel, else None."""
+    code, _, suffix = target.partition(':')
+    if len(code) == CODE_LENGTH and code.isalpha() and code.isupper():
+        return 'spectators' if suffix else 'players'
+    return None
+
+
+def payload_size(payload):
+    """Bytes of an emit payload: binary parts (sent as attachments) by length, the rest as compact JSON."""
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return len(payload)
+    binary = []
+
+    def attachment(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            binary.append(len(value))
+            return None
+        raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+    # Each attachment is written as null (4 characters) in the JSON
+    text = json.dumps(payload, separators=(',', ':'), default=attachment)
+    return len(text) - 4 * len(binary) + sum(binary)
+
+
+class AppMetrics:
+    """The app's metrics: HTTP routes, Socket.IO events and emits, database queries.
+
+    Emit payload sizes are measured on one emit in `payload_sample` and
+    counted `payload_sample` times, since serializing every payload a
+    second time would cost about as much as the emit itself. Room emits
+    are labelled by audience only: a label per room code would add series
+    for every room ever played.
+    """
+
+    def __init__(self, payload_sample=10):
+        r = self.registry = Registry()
+        self.payload_sample = max(1, payload_sample)
+        self._emit_seq = itertools.count()
+        self.http_latency = r.histogram('http_request_duration_seconds', 'HTTP request latency',
+                                        ('endpoint', 'method', 'status'))
+        self.http_queries = r.histogram('http_request_db_queries', 'Database queries per HTTP request',
+                                        ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.http_db_time = r.histogram('http_request_db_seconds', 'Database time per HTTP request',
+                                        ('endpoint',))
+        self.event_latency = r.histogram('socketio_event_duration_seconds', 'Socket.IO event handler latency',
+                                         ('event',))
+        self.event_errors = r.counter('socketio_event_errors_total', 'Socket.IO event handlers that raised',
+                                      ('event',))
+        self.emits = r.counter('socketio_emits_total', 'Socket.IO events emitted', ('event',))
+        self.room_emits = r.counter('socketio_room_emits_total', 'Socket.IO events emitted to rooms',
+                                    ('audience',))
+        self.room_bytes = r.counter('socketio_room_payload_bytes_total',
+                                    f'Payload bytes emitted to rooms (JSON plus binary attachments), '
+                                    f'estimated from 1 in {self.payload_sample} emits', ('audience',))
+        self.db_queries = r.counter('db_queries_total', 'Database queries by endpoint, socket event or background',
+                                    ('endpoint',))
+        self.db_time = r.counter('db_query_seconds_total', 'Database query time by endpoint, socket event or background',
+                                 ('endpoint',))
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(Engine, 'before_cursor_execute', self._before_query)
+        event.listen(Engine, 'after_cursor_execute', self._after_query)
+
+    def _before_request(self):
+        g.metrics_endpoint = request.endpoint or 'unmatched'
+        g.metrics_start = time.perf_counter()
+
+    def _after_request(self, response):
+        endpoint = g.get('metrics_endpoint', 'unmatched')
+        elapsed = time.perf_counter() - g.get('metrics_start', time.perf_counter())
+        self.http_latency.observe(elapsed, endpoint, request.method, response.status_code)
+        self.http_queries.observe(g.get('db_queries', 0), endpoint)
+        self.http_db_time.observe(g.get('db_seconds', 0.0), endpoint)
+        return response
+
+    def _before_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _after_query(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+        endpoint = 'background'
+        if has_app_context():
+            endpoint = g.get('metrics_endpoint', 'background')
+            g.db_queries = g.get('db_queries', 0) + 1
+            g.db_seconds = g.get('db_seconds', 0.0) + elapsed
+        self.db_queries.inc(endpoint)
+        self.db_time.inc(endpoint, amount=elapsed)
+
+    def timed_handler(self, message, handler):
+        """Wrap a Socket.IO handler to record its latency and failures."""
+        # Flask-SocketIO calls connect handlers with `auth` and retries
+        # without it on TypeError; call the handler the way it accepts
+        takes_args = bool(inspect.signature(handler).parameters)
+        name = f'socket:{message}'
+
+        @wraps(handler)
+        def timed(*args):
+            g.metrics_endpoint = name
+            start = time.perf_counter()
+            try:
+                return handler(*args) if takes_args else handler()
+            except Exception:
+                self.event_errors.inc(message)
+                raise
+            finally:
+                self.event_latency.observe(time.perf_counter() - start, message)
+        return timed
+
+    def count_emit(self, event_name, args, to):
+        self.emits.inc(event_name)
+        targets = to if isinstance(to, (list, tuple, set)) else (to,)
+        audiences = [audience for audience in map(_audience_of, filter(None, targets)) if audience]
+        if not audiences:
+            return
+        size = 0
+        if next(self._emit_seq) % self.payload_sample == 0:
+            try:
+                size = payload_size(args[0] if args else None) * self.payload_sample
+            except (TypeError, ValueError):
+                pass
+        for audience in audiences:
+            self.room_emits.inc(audience)
+            if size:
+                self.room_bytes.inc(audience, amount=size)
+
+
+class SocketIOMetrics:
+    """Mixin for flask_socketio.SocketIO reporting handler latency and emits to an AppMetrics.
+
+    A mixin rather than a subclass so this module does not import
+    Flask-SocketIO (see realtime.LazySocketIO).
+    """
+
+    def __init__(self, app=None, metrics=None, **kwargs):
+        self.metrics = metrics
+        super().__init__(app, **kwargs)
+
+    def on(self, message, namespace=None):
+        register = super().on(message, namespace)
+
+        def decorator(handler):
+            register(self.metrics.timed_handler(message, handler))
+            return handler
+        return decorator
+
+    def emit(self, event, *args, **kwargs):
+        self.metrics.count_emit(event, args, kwargs.get('to', kwargs.get('room')))
+        return super().emit(event, *args, **kwargs)
+
+
+class SampleFilter(logging.Filter):
+    """Pass one in `every` records below WARNING, and every record at or above it."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self._seq = itertools.count()
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or next(self._seq) % self.every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, sample_every=1):
+        super().__init__()
+        self.sample_every = sample_every
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.levelno < logging.WARNING and self.sample_every > 1:
+            entry['sampled_1_in'] = self.sample_every
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def sampled_logger(name, every):
+    """A logger writing one JSON line per sampled record to stderr; False (no logging) if `every` is 0."""
+    if not every:
+        return False
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(SampleFilter(every))
+    handler.setFormatter(JsonFormatter(every))
+    logger.handlers = [handler]
+    return logger
@@ -0,0 +1,74 @@
+"""initial schema
+
+The tables as they were created by db.create_all() before migrations were
+added. Databases created that way should be stamped with this revision
+(`flask db stamp 3a1f0c9d2b7e`) and then upgraded.
+
+Revision ID: 3a1f0c9d2b7e
+Revises: 
+Create Date: 2026-10-18 18:02:47.396477
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a1f0c9d2b7e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('admin',
+    sa.Column('admin_id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=100), nullable=False),
+    sa.Column('password', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('admin_id'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('player',
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=100), nullable=False),
+    sa.Column('email', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('last_login', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('player_id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('login_information',
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('password', sa.Text(), nullable=False),
+    sa.Column('role', sa.String(length=50), nullable=False),
+    sa.ForeignKeyConstraint(['player_id'], ['player.player_id'], ),
+    sa.PrimaryKeyConstraint('player_id')
+    )
+    op.create_table('tournament',
+    sa.Column('tournament_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('start_date', sa.DateTime(), nullable=False),
+    sa.Column('end_date', sa.DateTime(), nullable=False),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['player.player_id'], ),
+    sa.PrimaryKeyConstraint('tournament_id')
+    )
+    op.create_table('highscore',
+    sa.Column('highscore_id', sa.Integer(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=True),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.Column('time', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['player_id'], ['player.player_id'], ),
+    sa.PrimaryKeyConstraint('highscore_id')
+    )
+
+
+def downgrade():
+    op.drop_table('highscore')
+    op.drop_table('tournament')
+    op.drop_table('login_information')
+    op.drop_table('player')
+    op.drop_table('admin')
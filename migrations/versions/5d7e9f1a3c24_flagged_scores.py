@@ -0,0 +1,41 @@
+"""flagged_score table for games whose replay did not match
+
+Revision ID: 5d7e9f1a3c24
+Revises: 8c4e2b6a1d90
+Create Date: 2026-10-18 21:02:44.531907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7e9f1a3c24'
+down_revision = '8c4e2b6a1d90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('flagged_score',
+    sa.Column('flag_id', sa.Integer(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=True),
+    sa.Column('claimed_score', sa.Integer(), nullable=True),
+    sa.Column('replayed_score', sa.Integer(), nullable=True),
+    sa.Column('seed', sa.BigInteger(), nullable=False),
+    sa.Column('actions', sa.LargeBinary(), nullable=False),
+    sa.Column('tournament_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['player_id'], ['player.player_id'], ),
+    sa.ForeignKeyConstraint(['tournament_id'], ['tournament.tournament_id'], ),
+    sa.PrimaryKeyConstraint('flag_id')
+    )
+    with op.batch_alter_table('flagged_score', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_flagged_score_player_id'), ['player_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('flagged_score', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_flagged_score_player_id'))
+
+    op.drop_table('flagged_score')
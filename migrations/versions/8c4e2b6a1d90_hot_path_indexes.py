@@ -0,0 +1,50 @@
+"""highscore tournament_id and hot-path indexes
+
+Adds Highscore.tournament_id and the indexes behind the queries in app.py:
+
+- ix_highscore_player_score      per-player best / score-writer upsert lookup
+- ix_highscore_score             top-N and rank (COUNT WHERE score > x)
+- ix_highscore_tournament_score  tournament standings
+- ix_tournament_end_start        active tournament lookup in /singleplayer
+
+Player.username and Player.email are already covered by their unique
+constraints.
+
+Revision ID: 8c4e2b6a1d90
+Revises: 3a1f0c9d2b7e
+Create Date: 2026-10-18 18:10:12.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2b6a1d90'
+down_revision = '3a1f0c9d2b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tournament', schema=None) as batch_op:
+        batch_op.create_index('ix_tournament_end_start', ['end_date', 'start_date'], unique=False)
+
+    with op.batch_alter_table('highscore', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tournament_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_highscore_tournament_id', 'tournament', ['tournament_id'], ['tournament_id'])
+        batch_op.create_index('ix_highscore_player_score', ['player_id', 'score'], unique=False)
+        batch_op.create_index('ix_highscore_score', ['score'], unique=False)
+        batch_op.create_index('ix_highscore_tournament_score', ['tournament_id', 'score'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('highscore', schema=None) as batch_op:
+        batch_op.drop_index('ix_highscore_tournament_score')
+        batch_op.drop_index('ix_highscore_score')
+        batch_op.drop_index('ix_highscore_player_score')
+        batch_op.drop_constraint('fk_highscore_tournament_id', type_='foreignkey')
+        batch_op.drop_column('tournament_id')
+
+    with op.batch_alter_table('tournament', schema=None) as batch_op:
+        batch_op.drop_index('ix_tournament_end_start')
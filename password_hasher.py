@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class HasherBusy(Exception):
+    """Raised when too many hashes are already queued."""
+
+
+class PasswordHasher:
+    """bcrypt hashing and verification on a bounded pool of OS threads.
+
+    bcrypt releases the GIL, so running it on real threads keeps the event
+    loop (and every game socket) responsive while a password is checked.
+    Under eventlet and gevent the calling green thread waits cooperatively on
+    the hub's native thread pool; in threading mode a ThreadPoolExecutor is
+    used. At most `max_pending` hashes may be queued or running at once;
+    beyond that calls fail fast with HasherBusy instead of piling up.
+    """
+
+    def __init__(self, socketio, rounds=12, pool_size=4, max_pending=32):
+        self.rounds = rounds
+        self.pool_size = pool_size
+        self.max_pending = max_pending
+        self.async_mode = socketio.async_mode
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pool = None
+        self.rejected = 0
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password, hashed):
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        # $2b$<cost>$<salt+hash>
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def pending(self):
+        return self._pending
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise HasherBusy()
+            self._pending += 1
+        try:
+            return self._execute(fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _execute(self, fn, *args):
+        if self.async_mode == 'eventlet':
+            from eventlet import tpool
+            if self._pool is None:
+                tpool.set_num_threads(self.pool_size)
+                self._pool = tpool
+            return tpool.execute(fn, *args)
+        if self.async_mode == 'gevent':
+            if self._pool is None:
+                from gevent.threadpool import ThreadPool
+                self._pool = ThreadPool(self.pool_size)
+            return self._pool.apply(fn, args)
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(self.pool_size, thread_name_prefix='bcrypt')
+        return self._pool.submit(fn, *args).result()
@@ -0,0 +1,109 @@
+import importlib.util
+import os
+import threading
+
+# Order in which Flask-SocketIO picks an async mode when none is given
+ASYNC_MODES = ('eventlet', 'gevent', 'threading')
+
+
+def detect_async_mode():
+    """The async mode Flask-SocketIO would choose, found without importing it."""
+    mode = os.getenv('SOCKETIO_ASYNC_MODE')
+    if mode:
+        return mode
+    for mode in ASYNC_MODES[:-1]:
+        if importlib.util.find_spec(mode) is not None:
+            return mode
+    return 'threading'
+
+
+# flask_socketio's context helpers, imported on first call: handlers only
+# run once the realtime stack is up, so importing it here would be wasted
+def emit(*args, **kwargs):
+    from flask_socketio import emit
+    return emit(*args, **kwargs)
+
+
+def join_room(*args, **kwargs):
+    from flask_socketio import join_room
+    return join_room(*args, **kwargs)
+
+
+def leave_room(*args, **kwargs):
+    from flask_socketio import leave_room
+    return leave_room(*args, **kwargs)
+
+
+class LazySocketIO:
+    """Flask-SocketIO, started on first use.
+
+    Importing Flask-SocketIO and building its server (python-socketio,
+    engineio and the async driver) is a good part of the app's cold start,
+    and HTTP-only requests never need it. Handlers registered with `on()`
+    are recorded and attached when the server starts, which happens on the
+    first request under `/socket.io`, or the first time anything else is
+    used (`emit`, `start_background_task`, `test_client`, `run`...).
+
+    `async_mode` is answered without starting: it is detected the way
+    Flask-SocketIO does it and then passed to the server, so code that only
+    needs to know the mode (the password hasher) does not start it either.
+    """
+
+    def __init__(self, app, metrics=None, path='socket.io', **options):
+        self.app = app
+        self.metrics = metrics
+        self.path = path
+        self.endpoint = '/' + path.strip('/')
+        self.options = options
+        self.options.setdefault('async_mode', detect_async_mode())
+        self._handlers = []  # (message, namespace, handler)
+        self._server = None
+        self._lock = threading.Lock()
+        # Until the server exists, only its endpoint needs intercepting
+        self._flask_wsgi = app.wsgi_app
+        app.wsgi_app = self._wsgi
+
+    @property
+    def async_mode(self):
+        return self._server.async_mode if self._server else self.options['async_mode']
+
+    @property
+    def started(self):
+        return self._server is not None
+
+    def on(self, message, namespace=None):
+        def decorator(handler):
+            with self._lock:
+                self._handlers.append((message, namespace, handler))
+                if self._server is not None:
+                    self._server.on(message, namespace)(handler)
+            return handler
+        return decorator
+
+    def start(self):
+        if self._server is None:
+            with self._lock:
+                if self._server is None:
+                    from flask_socketio import SocketIO
+                    from metrics import SocketIOMetrics
+
+                    class MeteredSocketIO(SocketIOMetrics, SocketIO):
+                        pass
+
+                    server = MeteredSocketIO(self.app, metrics=self.metrics, path=self.path, **self.options)
+                    for message, namespace, handler in self._handlers:
+                        server.on(message, namespace)(handler)
+                    self._server = server
+        return self._server
+
+    def _wsgi(self, environ, start_response):
+        if self._server is None and environ.get('PATH_INFO', '').startswith(self.endpoint):
+            self.start()
+            # Flask-SocketIO has put its middleware in front of this one
+            return self.app.wsgi_app(environ, start_response)
+        return self._flask_wsgi(environ, start_response)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.start(), name)
@@ -0,0 +1,317 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): appends are only serialized within this process
+    fcntl = None
+
+# Record layout, version 1:
+#   version (1 byte), then varints: player id, score, recorded at (unix
+#   seconds); the seed (uint32, little endian); a varint action count; then
+#   the actions as runs, one nibble each, low nibble first (see pack_runs)
+VERSION = 1
+SEED = struct.Struct('<I')
+
+# Per-segment index entry: offset and length of the record in the segment.
+# Game ids are handed out in order, so a game's entry is at
+# (game id - segment's first id) * INDEX_ENTRY.size; no search needed
+INDEX_ENTRY = struct.Struct('<II')
+
+# Flag on an action nibble: the action repeats, count follows (see pack_runs)
+RUN = 0x8
+
+Replay = namedtuple('Replay', 'game_id player_id score recorded_at seed actions')
+
+
+def write_varint(out, value):
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def pack_runs(actions):
+    """Pack unpacked action codes (0-7) as runs of the same action, in nibbles.
+
+    A single action is its code. A repeated one is its code | RUN followed
+    by (count - 2) as a nibble varint: 3 bits per nibble, low bits first,
+    0x8 set on every nibble but the last. Gravity ticks are logged as
+    actions, so runs of gravity are the game's timing, and held keys
+    (soft drop, auto-repeat moves) collapse into one or two bytes. Never
+    longer than tetris_engine.pack_actions.
+    """
+    nibbles = []
+    i, n = 0, len(actions)
+    while i < n:
+        action = actions[i]
+        j = i + 1
+        while j < n and actions[j] == action:
+            j += 1
+        if j - i == 1:
+            nibbles.append(action)
+        else:
+            nibbles.append(action | RUN)
+            extra = j - i - 2
+            while extra > 0x7:
+                nibbles.append(extra & 0x7 | 0x8)
+                extra >>= 3
+            nibbles.append(extra)
+        i = j
+    if len(nibbles) % 2:
+        nibbles.append(0)
+    return bytes(nibbles[k] | nibbles[k + 1] << 4 for k in range(0, len(nibbles), 2))
+
+
+def unpack_runs(data, count):
+    """The first `count` actions of a pack_runs stream; ValueError if it is short."""
+    nibbles = [nibble for byte in data for nibble in (byte & 0xF, byte >> 4)]
+    actions = bytearray()
+    i = 0
+    try:
+        while len(actions) < count:
+            nibble = nibbles[i]
+            i += 1
+            if not nibble & RUN:
+                actions.append(nibble)
+                continue
+            extra = shift = 0
+            while True:
+                part = nibbles[i]
+                i += 1
+                extra |= (part & 0x7) << shift
+                shift += 3
+                if not part & 0x8:
+                    break
+            actions += bytes([nibble & 0x7]) * (extra + 2)
+    except IndexError:
+        raise ValueError('replay action stream is truncated') from None
+    if len(actions) != count:
+        raise ValueError('replay action stream overruns its count')
+    return bytes(actions)
+
+
+def encode_replay(player_id, score, seed, actions, recorded_at=None):
+    """One record for unpacked `actions`."""
+    out = bytearray([VERSION])
+    write_varint(out, player_id)
+    write_varint(out, max(0, score))
+    write_varint(out, int(time.time() if recorded_at is None else recorded_at))
+    out += SEED.pack(seed & 0xFFFFFFFF)
+    write_varint(out, len(actions))
+    out += pack_runs(actions)
+    return bytes(out)
+
+
+def decode_replay(game_id, record):
+    if not record or record[0] != VERSION:
+        raise ValueError(f'unknown replay record version in game {game_id}')
+    player_id, pos = read_varint(record, 1)
+    score, pos = read_varint(record, pos)
+    recorded_at, pos = read_varint(record, pos)
+    seed, = SEED.unpack_from(record, pos)
+    count, pos = read_varint(record, pos + SEED.size)
+    return Replay(game_id, player_id, score, recorded_at, seed, unpack_runs(record[pos:], count))
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class _Segment:
+    """A segment's data and index files, memory-mapped read-only.
+
+    The newest segment keeps growing; a read past what is mapped maps the
+    files again. Old maps are dropped rather than closed, so a reader
+    still slicing one is not cut off; they unmap once unreferenced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.index = None
+
+    @staticmethod
+    def _map(path, old):
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if old is not None and len(old) == size:
+                    return old
+                # mmap cannot map an empty file
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        except FileNotFoundError:
+            return None
+
+    def entry(self, position):
+        end = (position + 1) * INDEX_ENTRY.size
+        index = self.index
+        if index is None or len(index) < end:
+            index = self.index = self._map(self.path + '.idx', index)
+            if index is None or len(index) < end:
+                return None
+        offset, length = INDEX_ENTRY.unpack_from(index, position * INDEX_ENTRY.size)
+        data = self.data
+        if data is None or len(data) < offset + length:
+            data = self.data = self._map(self.path + '.seg', data)
+            if data is None or len(data) < offset + length:
+                return None
+        return data, offset, length
+
+
+class ReplayStore:
+    """Finished games as compact binary replays in append-only segment files.
+
+    Each game is one record (seed, player, score and its input stream, see
+    encode_replay), appended to the newest `<first id>.seg` file in
+    `directory`, with its offset and length appended to the matching
+    `.idx` file. A segment is closed once it reaches `segment_bytes` and a
+    new one is started at the next game id.
+
+    Reads map the files with mmap and copy out one record, so looking up a
+    game costs the same however many are stored, and no file is read in
+    whole. Appends from several processes (gunicorn workers) are
+    serialized with flock on a lock file in the directory; game ids are
+    allocated under that lock, so they stay in index order.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        # Offsets in the index are uint32
+        self.segment_bytes = min(segment_bytes, 0xFFFFFFFF)
+        self._first_ids = []
+        self._segments = {}  # first id -> _Segment
+        self._lock = threading.Lock()
+
+    def _path(self, first_id):
+        return os.path.join(self.directory, f'{first_id:012d}')
+
+    def _scan(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        self._first_ids = sorted(int(name[:-4]) for name in names
+                                 if name.endswith('.idx') and name[:-4].isdigit())
+
+    def append(self, player_id, score, seed, actions):
+        """Store a game's unpacked `actions`; returns its game id."""
+        record = encode_replay(player_id, score, seed, actions)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, 'lock'), 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    return self._append_locked(record)
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _append_locked(self, record):
+        # Another process may have started a segment since the last look
+        self._scan()
+        first_id = self._first_ids[-1] if self._first_ids else 1
+        path = self._path(first_id)
+        count = os.path.getsize(path + '.idx') // INDEX_ENTRY.size if self._first_ids else 0
+        game_id = first_id + count
+        if count and _size(path + '.seg') + len(record) > self.segment_bytes:
+            first_id, path = game_id, self._path(game_id)
+        # Offsets come from the file, so bytes left by a write that died
+        # before its index entry are skipped over, not misread
+        size = _size(path + '.seg')
+        # Data first: an entry in the index always points at a whole record
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        for suffix, chunk in (('.seg', record), ('.idx', INDEX_ENTRY.pack(size, len(record)))):
+            fd = os.open(path + suffix, flags, 0o644)
+            try:
+                os.write(fd, chunk)
+            finally:
+                os.close(fd)
+        if first_id not in self._first_ids:
+            self._first_ids.append(first_id)
+        return game_id
+
+    def _locate(self, game_id):
+        """(mapped data, offset, length) of a game's record, or None."""
+        for attempt in range(2):
+            with self._lock:
+                if attempt:
+                    self._scan()
+                i = bisect.bisect_right(self._first_ids, game_id) - 1
+                if i >= 0:
+                    first_id = self._first_ids[i]
+                    segment = self._segments.get(first_id)
+                    if segment is None:
+                        segment = self._segments[first_id] = _Segment(self._path(first_id))
+                    found = segment.entry(game_id - first_id)
+                    if found is not None:
+                        return found
+                # Only the newest segment can be missing entries
+                if 0 <= i < len(self._first_ids) - 1:
+                    return None
+        return None
+
+    def record(self, game_id):
+        """The raw record of a game (what the replay endpoint sends), or None."""
+        found = self._locate(game_id) if game_id > 0 else None
+        if found is None:
+            return None
+        data, offset, length = found
+        return data[offset:offset + length]
+
+    def get(self, game_id):
+        """The decoded Replay of a game, or None."""
+        record = self.record(game_id)
+        return decode_replay(game_id, record) if record is not None else None
+
+    def stream(self, game_id, chunk_size=16 * 1024):
+        """A game's record in chunks straight from the map, or None if there is no such game."""
+        found = self._locate(game_id) if game_id > 0 else None
+        if found is None:
+            return None
+        data, offset, length = found
+
+        def chunks():
+            for start in range(offset, offset + length, chunk_size):
+                yield data[start:min(start + chunk_size, offset + length)]
+        return length, chunks()
+
+    def stats(self):
+        with self._lock:
+            self._scan()
+            segments = len(self._first_ids)
+            games = data_bytes = 0
+            for first_id in self._first_ids:
+                path = self._path(first_id)
+                try:
+                    games += os.path.getsize(path + '.idx') // INDEX_ENTRY.size
+                    data_bytes += os.path.getsize(path + '.seg')
+                except FileNotFoundError:
+                    pass
+        return {
+            'segments': segments,
+            'games': games,
+            'bytes': data_bytes,
+            'avg_bytes_per_game': round(data_bytes / games, 1) if games else None
+        }
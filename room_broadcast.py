@@ -0,0 +1,195 @@
+import collections
+import threading
+
+from lockstep import build_packet
+
+
+def spectator_room(room_code):
+    """Socket.IO room of the sockets watching `room_code`."""
+    return f'{room_code}:watch'
+
+
+def _queue_frame(rooms, room_code, player_id, frame, key):
+    """Coalesce a frame into rooms[room_code][player_id]; returns how many frames it superseded."""
+    players = rooms.setdefault(room_code, {})
+    entry = players.get(player_id)
+    dropped = 0
+    if entry is None:
+        entry = players[player_id] = {'key': None, 'frame': None}
+    elif entry['frame'] is not None:
+        dropped += 1
+    if key:
+        # A new keyframe makes everything queued before it redundant
+        if entry['key'] is not None:
+            dropped += 1
+        entry['key'] = frame
+        entry['frame'] = None
+    else:
+        entry['frame'] = frame
+    return dropped
+
+
+def _queue_inputs(rooms, room_code, player_id, seed, game, start, actions):
+    players = rooms.setdefault(room_code, {})
+    entry = players.get(player_id)
+    if (entry is None or (entry['seed'], entry['game']) != (seed, game)
+            or start != entry['start'] + len(entry['actions'])):
+        # First batch since the last flush, or a new game that replaces the old one
+        entry = players[player_id] = {'seed': seed, 'game': game, 'start': start,
+                                      'actions': bytearray()}
+    entry['actions'] += actions
+
+
+def _frames(entry):
+    return [f for f in (entry['key'], entry['frame']) if f is not None]
+
+
+class RoomBroadcaster:
+    """Coalesces per-player game frames and flushes one snapshot per room per tick.
+
+    Frames are opaque bytes (see static/js/boardsync.js). A delta frame
+    supersedes every frame since its keyframe, so per player we only keep the
+    latest keyframe and the latest frame after it.
+
+    Rooms in input mode (see lockstep.py) submit actions instead. Those
+    cannot be dropped, so a player's actions within a tick are concatenated
+    into one input packet.
+
+    Spectators get the same events in a Socket.IO room of their own (see
+    `spectator_room()`), flushed `spectator_rate` times a second, so several
+    ticks of frames collapse into one and the cost of a flush does not
+    depend on how many are watching. The latest keyframe and frame of every
+    player are kept (`snapshot()`) for anyone who arrives mid-game.
+
+    Watchers are counted per process (`watch()`). With a message queue the
+    spectators of a room may be connected to another worker, so pass
+    `local_spectators=False` to flush the spectator view of every room.
+    """
+
+    def __init__(self, socketio, tick_rate=20, spectator_rate=5, event='room_snapshot',
+                 input_event='room_inputs', local_spectators=True):
+        self.socketio = socketio
+        self.interval = 1.0 / tick_rate
+        self.spectator_every = max(1, round(tick_rate / spectator_rate))
+        self.event = event
+        self.input_event = input_event
+        self.local_spectators = local_spectators
+        self._pending = {}  # room_code -> {player_id: {'key': bytes, 'frame': bytes}}
+        self._inputs = {}  # room_code -> {player_id: {'seed', 'game', 'start', 'actions'}}
+        self._latest = {}  # like _pending, but kept across flushes
+        self._spectator_dirty = {}  # room_code -> {player_id: True} for new frames since the last spectator flush
+        self._spectator_inputs = {}  # like _inputs, flushed on the spectator tick
+        self._spectators = collections.Counter()  # room_code -> watching sockets on this process
+        self._ticks = 0
+        self._lock = threading.Lock()
+        self._task = None
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.snapshots_sent = 0
+        self.spectator_snapshots_sent = 0
+        self.input_packets_received = 0
+
+    def _watched(self, room_code):
+        return not self.local_spectators or self._spectators[room_code] > 0
+
+    def submit(self, room_code, player_id, frame, key=False):
+        with self._lock:
+            self.frames_dropped += _queue_frame(self._pending, room_code, player_id, frame, key)
+            _queue_frame(self._latest, room_code, player_id, frame, key)
+            if self._watched(room_code):
+                self._spectator_dirty.setdefault(room_code, {})[player_id] = True
+            self.frames_received += 1
+        self._ensure_running()
+
+    def submit_inputs(self, room_code, player_id, seed, game, start, actions):
+        """Queue actions `start`.. of a player's game for the next flush."""
+        with self._lock:
+            _queue_inputs(self._inputs, room_code, player_id, seed, game, start, actions)
+            if self._watched(room_code):
+                _queue_inputs(self._spectator_inputs, room_code, player_id, seed, game, start, actions)
+            self.input_packets_received += 1
+        self._ensure_running()
+
+    def watch(self, room_code):
+        with self._lock:
+            self._spectators[room_code] += 1
+
+    def unwatch(self, room_code):
+        with self._lock:
+            self._spectators[room_code] -= 1
+            if self._spectators[room_code] <= 0:
+                del self._spectators[room_code]
+
+    def spectators(self, room_code):
+        return self._spectators[room_code]
+
+    def snapshot(self, room_code):
+        """Latest frames of every player in the room, decodable on their own."""
+        with self._lock:
+            players = self._latest.get(room_code, {})
+            return [{'player_id': player_id, 'frames': _frames(entry)}
+                    for player_id, entry in players.items()]
+
+    def discard(self, room_code, player_id=None):
+        with self._lock:
+            for pending in (self._pending, self._inputs, self._latest,
+                            self._spectator_dirty, self._spectator_inputs):
+                if player_id is None:
+                    pending.pop(room_code, None)
+                elif room_code in pending:
+                    pending[room_code].pop(player_id, None)
+
+    def flush(self):
+        self._ticks += 1
+        spectator_tick = self._ticks % self.spectator_every == 0
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            inputs, self._inputs = self._inputs, {}
+            spectator_frames, spectator_inputs = {}, {}
+            if spectator_tick:
+                dirty, self._spectator_dirty = self._spectator_dirty, {}
+                spectator_inputs, self._spectator_inputs = self._spectator_inputs, {}
+                for room_code, player_ids in dirty.items():
+                    latest = self._latest.get(room_code, {})
+                    spectator_frames[room_code] = [{'player_id': player_id, 'frames': _frames(latest[player_id])}
+                                                   for player_id in player_ids if player_id in latest]
+
+        for room_code, players in pending.items():
+            snapshot = [{'player_id': player_id, 'frames': _frames(entry)}
+                        for player_id, entry in players.items()]
+            self.socketio.emit(self.event, {'players': snapshot}, to=room_code)
+            self.snapshots_sent += 1
+
+        for room_code, players in inputs.items():
+            self.socketio.emit(self.input_event, {'players': self._packets(players)}, to=room_code)
+            self.snapshots_sent += 1
+
+        for room_code, snapshot in spectator_frames.items():
+            if snapshot:
+                self.socketio.emit(self.event, {'players': snapshot}, to=spectator_room(room_code))
+                self.spectator_snapshots_sent += 1
+
+        for room_code, players in spectator_inputs.items():
+            self.socketio.emit(self.input_event, {'players': self._packets(players)},
+                               to=spectator_room(room_code))
+            self.spectator_snapshots_sent += 1
+
+    @staticmethod
+    def _packets(players):
+        return [{'player_id': player_id,
+                 'inputs': build_packet(e['seed'], e['game'], e['start'], e['actions'])}
+                for player_id, e in players.items()]
+
+    def _ensure_running(self):
+        if self._task is None:
+            with self._lock:
+                if self._task is None:
+                    self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Room snapshot flush failed: {e}")
@@ -0,0 +1,54 @@
+import hashlib
+import string
+
+LETTERS = string.ascii_uppercase
+CODE_LENGTH = 6
+HALF = len(LETTERS) ** (CODE_LENGTH // 2)  # 26**3: codes are pairs of 3-letter halves
+CODE_SPACE = HALF * HALF
+ROUNDS = 4
+
+
+class RoomCodeAllocator:
+    """Unique room codes from a shared counter.
+
+    Each code is the `n`th value of a counter (`next_value()`, atomic across
+    workers when the room store is shared) put through a keyed Feistel
+    permutation of the 26**6 possible codes. The permutation is a bijection,
+    so no two counter values give the same code and no code is repeated
+    until all 308,915,776 have been handed out; consecutive codes still look
+    random, so they cannot be guessed from your own. Allocation is a counter
+    increment and a few hashes: no lookups and no retries.
+
+    `offset` is added to every counter value. A counter that does not
+    survive a restart (the memory:// store) should get a random one, or
+    every run hands out the same codes in the same order.
+    """
+
+    def __init__(self, secret_key, next_value, offset=0):
+        self._key = hashlib.sha256(b'room-codes:' + secret_key.encode()).digest()
+        self._next_value = next_value
+        self._offset = offset
+
+    def _round(self, i, half):
+        digest = hashlib.blake2b(half.to_bytes(2, 'little'), digest_size=8, key=self._key,
+                                 person=b'room-code-%d' % i).digest()
+        return int.from_bytes(digest, 'little') % HALF
+
+    def permute(self, n):
+        """The code number for counter value `n` (a bijection on range(CODE_SPACE))."""
+        left, right = divmod(n % CODE_SPACE, HALF)
+        for i in range(ROUNDS):
+            left, right = right, (left + self._round(i, right)) % HALF
+        return left * HALF + right
+
+    @staticmethod
+    def encode(number):
+        letters = []
+        for _ in range(CODE_LENGTH):
+            number, digit = divmod(number, len(LETTERS))
+            letters.append(LETTERS[digit])
+        return ''.join(reversed(letters))
+
+    def reserve(self):
+        """A room code no other caller of this allocator has been given."""
+        return self.encode(self.permute(self._offset + self._next_value()))
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+
+
+class RoomLimitReached(Exception):
+    """The host already has as many open rooms as allowed."""
+
+
+class RoomManager:
+    """Lifetimes of the rooms in a RoomStore.
+
+    Every room carries `created_at` and `touched_at` (epoch seconds, so they
+    survive the JSON stores); handlers call `touch()` when something happens
+    in a room. A background reaper deletes rooms that have not been touched
+    within the TTL for their status:
+
+    - unclaimed: waiting rooms no socket has ever joined (a /host page that
+      was closed or reloaded before connecting)
+    - waiting, playing, finished: by room['status']
+
+    and calls `on_reap(room_code, room)` for each so the caller can notify
+    the room and drop per-room state. Every worker runs the reaper, but
+    each round only the one that claims it in the store scans, so the
+    scan figures in `stats()` come from whichever worker did the last one
+    it ran. `open()` enforces a cap on open rooms per host, clearing out
+    the host's own unclaimed rooms first; it looks them up in the store's
+    per-host index instead of scanning.
+    """
+
+    def __init__(self, socketio, store, on_reap=None, waiting_ttl=30 * 60, playing_ttl=2 * 3600,
+                 finished_ttl=5 * 60, unclaimed_ttl=2 * 60, max_rooms_per_host=3, reap_interval=60):
+        self.socketio = socketio
+        self.store = store
+        self.on_reap = on_reap
+        self.ttls = {
+            'unclaimed': unclaimed_ttl,
+            'waiting': waiting_ttl,
+            'playing': playing_ttl,
+            'finished': finished_ttl,
+        }
+        self.max_rooms_per_host = max_rooms_per_host
+        self.reap_interval = reap_interval
+        self._task = None
+        self._lock = threading.Lock()
+        self.rooms_opened = 0
+        self.rooms_reaped = 0
+        self.rooms_refused = 0
+        self._last_scan = {}
+
+    @staticmethod
+    def touch(room):
+        room['touched_at'] = time.time()
+
+    @staticmethod
+    def _state(room):
+        if room['status'] == 'waiting' and not any(p.get('sid') for p in room['players'].values()):
+            return 'unclaimed'
+        return room['status']
+
+    def expired(self, room, now=None):
+        now = time.time() if now is None else now
+        ttl = self.ttls.get(self._state(room), self.ttls['playing'])
+        return now - room.get('touched_at', now) > ttl
+
+    def host_rooms(self, host_id):
+        rooms = ((code, self.store.get(code)) for code in self.store.host_codes(host_id))
+        return [(code, room) for code, room in rooms if room is not None]
+
+    def open(self, room_code, room, capped=True):
+        """Save a new room, enforcing the per-host cap unless `capped` is False.
+
+        Raises RoomLimitReached. Rooms the matchmaker opens are not capped:
+        their host did not ask for them.
+        """
+        if room_code in self.store:
+            # Codes come from RoomCodeAllocator, so this means a bug, not bad luck
+            raise ValueError(f'room {room_code} already exists')
+        if capped:
+            self._make_space(room['host_id'])
+
+        room['created_at'] = time.time()
+        self.touch(room)
+        self.store.save(room_code, room)
+        self.store.add_host_room(room['host_id'], room_code)
+        self.rooms_opened += 1
+        self._ensure_running()
+
+    def _make_space(self, host_id):
+        host_rooms = self.host_rooms(host_id)
+        # The host's earlier rooms that never got a socket are abandoned:
+        # make space by dropping the oldest of those
+        unclaimed = sorted((other.get('created_at', 0), code) for code, other in host_rooms
+                           if self._state(other) == 'unclaimed')
+        count = len(host_rooms)
+        for _, code in unclaimed:
+            if count < self.max_rooms_per_host:
+                break
+            if self._reap(code, lambda stored: self._state(stored) == 'unclaimed'):
+                count -= 1
+        if count >= self.max_rooms_per_host:
+            self.rooms_refused += 1
+            raise RoomLimitReached()
+
+    def _reap(self, room_code, should_reap):
+        with self.store.transaction(room_code) as room:
+            # Check again under the lock: someone may have touched it since the scan
+            if room is None or not should_reap(room):
+                return False
+            self.store.delete(room_code)
+        self.rooms_reaped += 1
+        if self.on_reap is not None:
+            try:
+                self.on_reap(room_code, room)
+            except Exception as e:
+                print(f"Room {room_code} reap handler failed: {e}")
+        return True
+
+    def reap(self):
+        """Delete every expired room. Returns the number deleted."""
+        now = time.time()
+        reaped = 0
+        by_state = {}
+        players = size = 0
+        for room_code, room in self.store.items():
+            if 'touched_at' not in room:
+                # Rooms from before TTLs existed: start their clock now
+                with self.store.transaction(room_code) as stored:
+                    if stored is not None:
+                        self.touch(stored)
+            elif self.expired(room, now) and self._reap(room_code, self.expired):
+                reaped += 1
+                continue
+            state = self._state(room)
+            by_state[state] = by_state.get(state, 0) + 1
+            players += len(room['players'])
+            size += len(json.dumps(room))
+        self._last_scan = {
+            'rooms_by_status': by_state,
+            'players': players,
+            'room_bytes': size,
+            'scanned_at': now,
+        }
+        return reaped
+
+    def stats(self):
+        """Live room count and the figures from the last reaper scan.
+
+        `room_bytes` is the serialized size of the live rooms, a lower bound
+        on what they take in memory.
+        """
+        return dict(self._last_scan, rooms=len(self.store), rooms_opened=self.rooms_opened,
+                    rooms_reaped=self.rooms_reaped, rooms_refused=self.rooms_refused,
+                    ttls=self.ttls, max_rooms_per_host=self.max_rooms_per_host)
+
+    def _ensure_running(self):
+        if self._task is None:
+            with self._lock:
+                if self._task is None:
+                    self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.reap_interval)
+            try:
+                # One worker per round; the claim lapses before the next round starts
+                if not self.store.claim('room-reaper', self.reap_interval * 0.9):
+                    continue
+                reaped = self.reap()
+                if reaped:
+                    print(f"Reaped {reaped} idle rooms ({len(self.store)} left)")
+            except Exception as e:
+                print(f"Room reaper failed: {e}")
@@ -0,0 +1,555 @@
+import collections
+import heapq
+import itertools
+import json
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Messages kept per feed channel; a reader further behind than this has lost messages
+FEED_RETENTION = 10000
+
+
+class FeedLost(Exception):
+    """The feed no longer holds the messages after this cursor."""
+
+
+class RoomStore(ABC):
+    """Storage for multiplayer game rooms, keyed by room code.
+
+    Rooms are plain JSON-serializable dicts. Backends that live outside the
+    process return copies, so changes must be written back with `save()` or
+    made inside `transaction()`, which saves the room when the block exits.
+    The room stays locked for the whole block, so callers collect the events
+    to send and emit them after it exits, never inside.
+
+    Players are stored under `room['players']` keyed by `player_key(user_id)`,
+    and every store keeps a socket id -> (room code, user id) index so
+    socket handlers never have to scan rooms, and a host -> room codes
+    index (filled by `add_host_room()`, cleared by `delete()`) so the
+    per-host room cap doesn't have to either.
+    """
+
+    @abstractmethod
+    def get(self, room_code):
+        ...
+
+    @abstractmethod
+    def save(self, room_code, room):
+        ...
+
+    @abstractmethod
+    def delete(self, room_code):
+        ...
+
+    @abstractmethod
+    def codes(self):
+        ...
+
+    @abstractmethod
+    def transaction(self, room_code):
+        ...
+
+    @abstractmethod
+    def add_host_room(self, host_id, room_code):
+        ...
+
+    @abstractmethod
+    def host_codes(self, host_id):
+        """Codes of the rooms `host_id` opened that still exist."""
+
+    @abstractmethod
+    def bind_sid(self, sid, room_code, user_id):
+        ...
+
+    @abstractmethod
+    def unbind_sid(self, sid):
+        ...
+
+    @abstractmethod
+    def lookup_sid(self, sid):
+        """Return (room_code, user_id) for a connected socket, or None."""
+
+    @abstractmethod
+    def next_value(self, name):
+        """Increment the counter `name` and return its new value (starting at 1), atomically."""
+
+    @abstractmethod
+    def claim(self, name, ttl):
+        """Mark `name` as taken for `ttl` seconds; True if nobody held it, atomically."""
+
+    @abstractmethod
+    def put(self, name, value, ttl):
+        """Keep a JSON-serializable `value` under `name` for `ttl` seconds."""
+
+    @abstractmethod
+    def fetch(self, name):
+        """The value `put()` under `name`, or None once it has expired."""
+
+    # A small shared feed, so per-process caches (the leaderboard) can follow
+    # changes made by other workers. Messages are JSON-serializable values.
+
+    @abstractmethod
+    def publish(self, channel, message):
+        """Append `message` to the feed `channel`."""
+
+    @abstractmethod
+    def feed_cursor(self, channel):
+        """Cursor just past the newest message in `channel`."""
+
+    @abstractmethod
+    def read_feed(self, channel, cursor, limit=1000):
+        """(messages after `cursor`, new cursor); FeedLost if they were trimmed."""
+
+    def items(self):
+        for room_code in self.codes():
+            room = self.get(room_code)
+            if room is not None:
+                yield room_code, room
+
+    def __contains__(self, room_code):
+        return self.get(room_code) is not None
+
+    def __len__(self):
+        return len(self.codes())
+
+
+class MemoryRoomStore(RoomStore):
+    """In-process store. Only valid with a single worker."""
+
+    def __init__(self):
+        self._rooms = {}
+        self._sids = {}
+        self._hosts = {}  # host_id -> set of room codes
+        self._counters = {}
+        self._feeds = {}  # channel -> (deque of messages, cursor of the first)
+        self._claims = {}  # name -> expiry
+        self._claim_expiry = []  # heap of (expiry, name)
+        self._values = {}  # name -> (expiry, value)
+        self._lock = threading.RLock()
+
+    def get(self, room_code):
+        return self._rooms.get(room_code)
+
+    def save(self, room_code, room):
+        self._rooms[room_code] = room
+
+    def delete(self, room_code):
+        room = self._rooms.pop(room_code, None)
+        if room is not None:
+            for player in room['players'].values():
+                if self._sids.get(player['sid'], (None,))[0] == room_code:
+                    del self._sids[player['sid']]
+            codes = self._hosts.get(room['host_id'])
+            if codes is not None:
+                codes.discard(room_code)
+                if not codes:
+                    del self._hosts[room['host_id']]
+
+    def add_host_room(self, host_id, room_code):
+        self._hosts.setdefault(host_id, set()).add(room_code)
+
+    def host_codes(self, host_id):
+        return list(self._hosts.get(host_id, ()))
+
+    def bind_sid(self, sid, room_code, user_id):
+        self._sids[sid] = (room_code, user_id)
+
+    def unbind_sid(self, sid):
+        self._sids.pop(sid, None)
+
+    def lookup_sid(self, sid):
+        return self._sids.get(sid)
+
+    def next_value(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def claim(self, name, ttl):
+        now = time.time()
+        with self._lock:
+            while self._claim_expiry and self._claim_expiry[0][0] <= now:
+                expiry, expired = heapq.heappop(self._claim_expiry)
+                if self._claims.get(expired) == expiry:
+                    del self._claims[expired]
+            if name in self._claims:
+                return False
+            self._claims[name] = now + ttl
+            heapq.heappush(self._claim_expiry, (now + ttl, name))
+            return True
+
+    def put(self, name, value, ttl):
+        now = time.time()
+        with self._lock:
+            if len(self._values) >= 1024:
+                for key in [key for key, (expiry, _) in self._values.items() if expiry <= now]:
+                    del self._values[key]
+            self._values[name] = (now + ttl, value)
+
+    def fetch(self, name):
+        expiry, value = self._values.get(name, (0, None))
+        return value if expiry > time.time() else None
+
+    def publish(self, channel, message):
+        with self._lock:
+            messages, first = self._feeds.setdefault(channel, (collections.deque(), 0))
+            messages.append(message)
+            if len(messages) > FEED_RETENTION:
+                messages.popleft()
+                self._feeds[channel] = (messages, first + 1)
+
+    def feed_cursor(self, channel):
+        with self._lock:
+            messages, first = self._feeds.get(channel, ((), 0))
+            return first + len(messages)
+
+    def read_feed(self, channel, cursor, limit=1000):
+        with self._lock:
+            messages, first = self._feeds.get(channel, ((), 0))
+            if cursor < first:
+                raise FeedLost(channel)
+            batch = list(itertools.islice(messages, cursor - first, cursor - first + limit))
+            return batch, cursor + len(batch)
+
+    def codes(self):
+        return list(self._rooms)
+
+    def __contains__(self, room_code):
+        return room_code in self._rooms
+
+    def __len__(self):
+        return len(self._rooms)
+
+    @contextmanager
+    def transaction(self, room_code):
+        with self._lock:
+            yield self._rooms.get(room_code)
+
+
+class SQLiteRoomStore(RoomStore):
+    """Store shared by every worker process on one host through a SQLite file.
+
+    Connections come from a pool of at most `pool_size`, checked out for
+    one call or one whole transaction and then handed back, so a worker
+    keeps a fixed number of connections however many threads or greenlets
+    pass through it.
+    """
+
+    def __init__(self, path, pool_size=8):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._pool_lock = threading.Lock()
+        # Connection held by the current thread or greenlet's transaction
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS game_room (code TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS game_room_sid '
+                '(sid TEXT PRIMARY KEY, code TEXT NOT NULL, user_id INTEGER NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_game_room_sid_code ON game_room_sid (code)')
+            conn.execute('CREATE TABLE IF NOT EXISTS game_room_host (code TEXT PRIMARY KEY, host_id INTEGER NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_game_room_host_host_id ON game_room_host (host_id)')
+            conn.execute('CREATE TABLE IF NOT EXISTS game_counter (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS game_feed '
+                '(seq INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, data TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_game_feed_channel ON game_feed (channel, seq)')
+            conn.execute('CREATE TABLE IF NOT EXISTS game_claim (name TEXT PRIMARY KEY, expires_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_game_claim_expires_at ON game_claim (expires_at)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS game_value (name TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_game_value_expires_at ON game_value (expires_at)')
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if self._opened < self.pool_size:
+                self._opened += 1
+                return sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        return self._pool.get(timeout=5)
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # Already inside a transaction on this thread
+            yield conn
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._pool.put(conn)
+
+    def close(self):
+        """Close the idle connections (all of them once nothing is using the store)."""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+            with self._pool_lock:
+                self._opened -= 1
+
+    def get(self, room_code):
+        with self._connection() as conn:
+            row = conn.execute('SELECT data FROM game_room WHERE code = ?', (room_code,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, room_code, room):
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO game_room (code, data) VALUES (?, ?)', (room_code, json.dumps(room)))
+
+    def delete(self, room_code):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM game_room WHERE code = ?', (room_code,))
+            conn.execute('DELETE FROM game_room_sid WHERE code = ?', (room_code,))
+            conn.execute('DELETE FROM game_room_host WHERE code = ?', (room_code,))
+
+    def codes(self):
+        with self._connection() as conn:
+            return [row[0] for row in conn.execute('SELECT code FROM game_room')]
+
+    def __contains__(self, room_code):
+        with self._connection() as conn:
+            return conn.execute('SELECT 1 FROM game_room WHERE code = ?', (room_code,)).fetchone() is not None
+
+    def add_host_room(self, host_id, room_code):
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO game_room_host (code, host_id) VALUES (?, ?)', (room_code, host_id))
+
+    def host_codes(self, host_id):
+        with self._connection() as conn:
+            return [row[0] for row in conn.execute('SELECT code FROM game_room_host WHERE host_id = ?', (host_id,))]
+
+    def bind_sid(self, sid, room_code, user_id):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO game_room_sid (sid, code, user_id) VALUES (?, ?, ?)', (sid, room_code, user_id)
+            )
+
+    def unbind_sid(self, sid):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM game_room_sid WHERE sid = ?', (sid,))
+
+    def lookup_sid(self, sid):
+        with self._connection() as conn:
+            row = conn.execute('SELECT code, user_id FROM game_room_sid WHERE sid = ?', (sid,)).fetchone()
+        return tuple(row) if row else None
+
+    def next_value(self, name):
+        # A single statement, so it is atomic without an explicit transaction
+        with self._connection() as conn:
+            return conn.execute(
+                'INSERT INTO game_counter (name, value) VALUES (?, 1) '
+                'ON CONFLICT (name) DO UPDATE SET value = value + 1 RETURNING value', (name,)
+            ).fetchone()[0]
+
+    def claim(self, name, ttl):
+        now = time.time()
+        with self._connection() as conn:
+            # An expired claim is taken over; a live one leaves the row unchanged
+            taken = conn.execute(
+                'INSERT INTO game_claim (name, expires_at) VALUES (?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET expires_at = excluded.expires_at WHERE expires_at <= ?',
+                (name, now + ttl, now)
+            ).rowcount == 1
+            if random.random() < 0.01:
+                conn.execute('DELETE FROM game_claim WHERE expires_at <= ?', (now,))
+        return taken
+
+    def put(self, name, value, ttl):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO game_value (name, data, expires_at) VALUES (?, ?, ?)',
+                         (name, json.dumps(value), now + ttl))
+            if random.random() < 0.01:
+                conn.execute('DELETE FROM game_value WHERE expires_at <= ?', (now,))
+
+    def fetch(self, name):
+        with self._connection() as conn:
+            row = conn.execute('SELECT data FROM game_value WHERE name = ? AND expires_at > ?',
+                               (name, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def publish(self, channel, message):
+        with self._connection() as conn:
+            seq = conn.execute('INSERT INTO game_feed (channel, data) VALUES (?, ?)',
+                               (channel, json.dumps(message))).lastrowid
+            if seq % 1000 == 0:
+                conn.execute('DELETE FROM game_feed WHERE channel = ? AND seq <= ?', (channel, seq - FEED_RETENTION))
+
+    def feed_cursor(self, channel):
+        with self._connection() as conn:
+            return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM game_feed WHERE channel = ?',
+                                (channel,)).fetchone()[0]
+
+    def read_feed(self, channel, cursor, limit=1000):
+        with self._connection() as conn:
+            rows = conn.execute('SELECT seq, data FROM game_feed WHERE channel = ? AND seq > ? ORDER BY seq LIMIT ?',
+                                (channel, cursor, limit)).fetchall()
+            # Sequence numbers are shared by every channel, so only a trim can
+            # leave nothing at or before the cursor while newer rows exist
+            if rows and cursor and conn.execute('SELECT 1 FROM game_feed WHERE channel = ? AND seq <= ? LIMIT 1',
+                                                (channel, cursor)).fetchone() is None:
+                raise FeedLost(channel)
+        return [json.loads(data) for _, data in rows], rows[-1][0] if rows else cursor
+
+    @contextmanager
+    def transaction(self, room_code):
+        with self._connection() as conn:
+            # BEGIN IMMEDIATE takes the write lock up front so concurrent
+            # read-modify-write cycles from other workers are serialized
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                room = self.get(room_code)
+                yield room
+                # Skip the write if the room was deleted inside the block
+                if room is not None and room_code in self:
+                    self.save(room_code, room)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+
+class RedisRoomStore(RoomStore):
+    """Store shared across hosts through Redis (or any Redis-compatible server)."""
+
+    def __init__(self, url, prefix='tetris:room:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('ROOM_STORE_URL uses redis:// but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.sid_key = prefix.rstrip(':') + '-sids'
+
+    def _key(self, room_code):
+        return self.prefix + room_code
+
+    def _host_key(self, host_id):
+        return self.prefix.rstrip(':') + '-host:' + str(host_id)
+
+    def get(self, room_code):
+        data = self.client.get(self._key(room_code))
+        return json.loads(data) if data else None
+
+    def save(self, room_code, room):
+        self.client.set(self._key(room_code), json.dumps(room))
+
+    def delete(self, room_code):
+        room = self.get(room_code)
+        self.client.delete(self._key(room_code))
+        if room is not None:
+            for player in room['players'].values():
+                entry = player['sid'] and self.lookup_sid(player['sid'])
+                if entry and entry[0] == room_code:
+                    self.unbind_sid(player['sid'])
+            self.client.srem(self._host_key(room['host_id']), room_code)
+
+    def add_host_room(self, host_id, room_code):
+        self.client.sadd(self._host_key(host_id), room_code)
+
+    def host_codes(self, host_id):
+        return [code.decode() for code in self.client.smembers(self._host_key(host_id))]
+
+    def codes(self):
+        return [key.decode()[len(self.prefix):] for key in self.client.scan_iter(self.prefix + '*')
+                if not key.endswith(b':lock')]
+
+    def bind_sid(self, sid, room_code, user_id):
+        self.client.hset(self.sid_key, sid, json.dumps([room_code, user_id]))
+
+    def unbind_sid(self, sid):
+        self.client.hdel(self.sid_key, sid)
+
+    def lookup_sid(self, sid):
+        data = self.client.hget(self.sid_key, sid)
+        return tuple(json.loads(data)) if data else None
+
+    def next_value(self, name):
+        return self.client.incr(self.prefix.rstrip(':') + '-counter:' + name)
+
+    def claim(self, name, ttl):
+        return bool(self.client.set(self.prefix.rstrip(':') + '-claim:' + name, 1, nx=True, ex=max(1, int(ttl))))
+
+    def put(self, name, value, ttl):
+        self.client.set(self.prefix.rstrip(':') + '-value:' + name, json.dumps(value), ex=max(1, int(ttl)))
+
+    def fetch(self, name):
+        data = self.client.get(self.prefix.rstrip(':') + '-value:' + name)
+        return json.loads(data) if data else None
+
+    def _feed_key(self, channel):
+        return self.prefix.rstrip(':') + '-feed:' + channel
+
+    def publish(self, channel, message):
+        self.client.xadd(self._feed_key(channel), {'data': json.dumps(message)},
+                         maxlen=FEED_RETENTION, approximate=True)
+
+    def feed_cursor(self, channel):
+        newest = self.client.xrevrange(self._feed_key(channel), count=1)
+        return newest[0][0].decode() if newest else '0-0'
+
+    def read_feed(self, channel, cursor, limit=1000):
+        key = self._feed_key(channel)
+        entries = self.client.xrange(key, '(' + cursor if cursor != '0-0' else '-', count=limit)
+        if entries and cursor != '0-0':
+            oldest = self.client.xrange(key, count=1)
+            if oldest and _stream_id(oldest[0][0]) > _stream_id(cursor):
+                raise FeedLost(channel)
+        messages = [json.loads(fields[b'data']) for _, fields in entries]
+        return messages, entries[-1][0].decode() if entries else cursor
+
+    @contextmanager
+    def transaction(self, room_code):
+        with self.client.lock(self._key(room_code) + ':lock', timeout=5, blocking_timeout=5):
+            room = self.get(room_code)
+            yield room
+            if room is not None and self.client.exists(self._key(room_code)):
+                self.save(room_code, room)
+
+
+def _stream_id(entry_id):
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    ms, _, seq = entry_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def player_key(user_id):
+    """Key for a player in `room['players']` (JSON object keys are strings)."""
+    return str(user_id)
+
+
+def create_room_store(url):
+    """Build a room store from a URL: memory://, sqlite:///path or redis://host."""
+    if not url or url.startswith('memory://'):
+        return MemoryRoomStore()
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteRoomStore(path)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisRoomStore(url)
+    raise ValueError(f'Unsupported ROOM_STORE_URL: {url}')
@@ -0,0 +1,208 @@
+import atexit
+import collections
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from room_store import MemoryRoomStore
+from tetris_engine import replay, seeded_pieces, unpack_actions
+
+ReplayResult = collections.namedtuple('ReplayResult', 'score lines level pieces')
+
+
+def verify_replay(seed, packed_actions):
+    """Replay one game; runs in the worker processes."""
+    try:
+        game = replay(unpack_actions(packed_actions), seeded_pieces(seed))
+    except ValueError:
+        # Unknown action code in the log
+        return None
+    return ReplayResult(game.score, game.lines, game.level, game.pieces_locked)
+
+
+class ScoreVerifier:
+    """Replays submitted games on a process pool before their scores count.
+
+    Games are played from a server-issued seed (`issue_seed()`, signed so
+    clients cannot pick their own piece sequence) and submitted as a packed
+    input log. Each token carries a nonce that `use_seed()` claims in the
+    `claims` store (the room store, so every worker sees it), so a token
+    buys one submission. `submit()` only queues the job. A background task hands the
+    queue to a multiprocessing pool in batches, waiting on it from a native
+    thread so the event loop keeps running, and calls
+    `on_result(job, result)` for each game; result is None when the log
+    could not be replayed at all.
+    """
+
+    def __init__(self, socketio, secret_key, on_result, claims=None, processes=None, batch_size=256,
+                 poll_interval=0.05, retry_interval=5.0, seed_max_age=24 * 3600):
+        self.socketio = socketio
+        self.on_result = on_result
+        self.claims = claims if claims is not None else MemoryRoomStore()
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.seed_max_age = seed_max_age
+        self._seeds = URLSafeTimedSerializer(secret_key, salt='game-seed')
+        self._queue = collections.deque()  # (submitted_at, job)
+        self._in_flight = 0
+        self._pool = None
+        self._task = None
+        self._lock = threading.Lock()
+        self._process_lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=1000)  # seconds, submit -> result
+        self.verified = 0
+        self.mismatched = 0
+        self.unreplayable = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+        atexit.register(self.close)
+
+    def issue_seed(self, player_id, seed=None):
+        """A fresh seed, or a room's shared one, signed for `player_id`."""
+        if seed is None:
+            seed = secrets.randbits(32)
+        return {'seed': seed, 'token': self._seeds.dumps([player_id, seed, secrets.token_urlsafe(12)])}
+
+    def _load_token(self, token, player_id):
+        try:
+            issued_to, seed, nonce = self._seeds.loads(token, max_age=self.seed_max_age)
+        except (BadSignature, TypeError, ValueError):
+            return None
+        return (seed, nonce) if issued_to == player_id else None
+
+    def read_seed(self, token, player_id):
+        """The seed in `token` if it was issued to `player_id` and is recent, else None."""
+        loaded = self._load_token(token, player_id)
+        return loaded[0] if loaded else None
+
+    def use_seed(self, token, player_id):
+        """read_seed(), but only the first time a token is used; later calls get None."""
+        loaded = self._load_token(token, player_id)
+        if loaded is None:
+            return None
+        seed, nonce = loaded
+        # Kept as long as the token is valid, so it can never be used twice
+        return seed if self.claims.claim('seed:' + nonce, self.seed_max_age) else None
+
+    def submit(self, job):
+        """Queue a game: job needs 'seed', 'actions' (packed bytes) and 'score'."""
+        self._queue.append((time.monotonic(), job))
+        self._ensure_running()
+
+    def pending(self):
+        return len(self._queue) + self._in_flight
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        pick = lambda q: round(latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000, 1) if latencies else None
+        return {
+            'queue_depth': len(self._queue),
+            'in_flight': self._in_flight,
+            'processes': self.processes,
+            'verified': self.verified,
+            'mismatched': self.mismatched,
+            'unreplayable': self.unreplayable,
+            'last_batch_size': self.last_batch_size,
+            'last_batch_ms': round(self.last_batch_ms, 1),
+            'latency_p50_ms': pick(0.5),
+            'latency_p99_ms': pick(0.99),
+        }
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # spawn: forking a process that runs an event loop and
+                    # database connections is not safe
+                    self._pool = multiprocessing.get_context('spawn').Pool(self.processes)
+        return self._pool
+
+    def _replay_batch(self, batch):
+        args = [(job['seed'], job['actions']) for _, job in batch]
+        chunksize = max(1, len(args) // (self.processes * 4))
+        pool = self._get_pool()
+        if self.socketio.async_mode == 'eventlet':
+            from eventlet import tpool
+            return tpool.execute(pool.starmap, verify_replay, args, chunksize)
+        if self.socketio.async_mode == 'gevent':
+            import gevent
+            return gevent.get_hub().threadpool.apply(pool.starmap, (verify_replay, args, chunksize))
+        return pool.starmap(verify_replay, args, chunksize)
+
+    def process(self):
+        """Verify one batch from the queue. Returns the number of games handled."""
+        with self._process_lock:
+            return self._process()
+
+    def _process(self):
+        batch = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self._queue.popleft())
+        if not batch:
+            return 0
+
+        self._in_flight = len(batch)
+        start = time.perf_counter()
+        try:
+            results = self._replay_batch(batch)
+        except Exception:
+            # Keep the games for the next attempt, on a fresh pool
+            self._queue.extendleft(reversed(batch))
+            self._close_pool()
+            raise
+        finally:
+            self._in_flight = 0
+        self.last_batch_size = len(batch)
+        self.last_batch_ms = (time.perf_counter() - start) * 1000
+
+        now = time.monotonic()
+        for (submitted_at, job), result in zip(batch, results):
+            self._latencies.append(now - submitted_at)
+            if result is None:
+                self.unreplayable += 1
+            elif result.score == job['score']:
+                self.verified += 1
+            else:
+                self.mismatched += 1
+            try:
+                self.on_result(job, result)
+            except Exception as e:
+                print(f"Verified score handling failed: {e}")
+        return len(batch)
+
+    def close(self):
+        while self._queue:
+            try:
+                self.process()
+            except Exception as e:
+                print(f"Score verify at shutdown failed, {len(self._queue)} games dropped: {e}")
+                break
+        self._close_pool()
+
+    def _close_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def _ensure_running(self):
+        if self._task is None:
+            with self._lock:
+                if self._task is None:
+                    self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.poll_interval)
+            if self._queue:
+                try:
+                    self.process()
+                except Exception as e:
+                    print(f"Score verify failed, retrying in {self.retry_interval}s: {e}")
+                    self.socketio.sleep(self.retry_interval)
@@ -0,0 +1,182 @@
+import atexit
+import collections
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import OperationalError
+
+
+class ScoreWriter:
+    """Write-behind buffer for Highscore rows.
+
+    Handlers call `submit()` (append a new score row) or `submit_best()` (keep
+    one row per player holding their best score) and return immediately;
+    `submit_flagged()` queues a `flagged_model` row for a game that failed
+    verification, written in the same transaction. A
+    background task flushes the buffer as one multi-row insert plus one bulk
+    update per batch, once `batch_size` scores are waiting or the oldest has
+    waited `flush_interval` seconds. `flush()` writes out everything queued
+    right away; the buffer is also flushed at exit.
+
+    A batch that fails on the database being unavailable (OperationalError)
+    is retried whole. Any other failure is a bad row, so the batch is then
+    written one row at a time and only the rows that fail are retried, up
+    to `max_attempts`, then dropped and logged.
+    """
+
+    def __init__(self, app, db, model, socketio, flagged_model=None, batch_size=500, flush_interval=1.0,
+                 poll_interval=0.05, max_attempts=3):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.flagged_model = flagged_model
+        self.socketio = socketio
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._queue = collections.deque()  # (kind, row, attempts, enqueued at), oldest first
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._task = None
+        self._retry_after = 0.0  # monotonic time before which a failed batch is not retried
+        self.rows_written = 0
+        self.last_flush_size = 0
+        self.last_flush_ms = 0.0
+        atexit.register(self.close)
+
+    def submit(self, player_id, score, when=None, **fields):
+        self._enqueue('insert', dict(fields, player_id=player_id, score=score, time=when or datetime.now()))
+
+    def submit_best(self, player_id, score, when=None):
+        self._enqueue('best', {'player_id': player_id, 'score': score, 'time': when or datetime.now()})
+
+    def submit_flagged(self, player_id, **fields):
+        self._enqueue('flag', dict(fields, player_id=player_id, created_at=datetime.now()))
+
+    def pending(self):
+        return len(self._queue)
+
+    def _enqueue(self, kind, row):
+        self._queue.append((kind, row, 0, time.monotonic()))
+        self._ensure_running()
+
+    def _waited(self):
+        """Seconds the oldest queued row has been waiting (0 if none)."""
+        try:
+            return time.monotonic() - self._queue[0][3]
+        except IndexError:
+            return 0.0
+
+    def flush(self):
+        """Write out every queued score now, in batches; returns how many were written."""
+        written = 0
+        while self._queue:
+            written += self._flush_batch()
+            if time.monotonic() < self._retry_after:
+                # Rows failed; leave them and the rest for the retry
+                break
+        return written
+
+    def _flush_batch(self):
+        with self._flush_lock:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            with self.app.app_context():
+                try:
+                    self._write(batch)
+                    failed = []
+                except OperationalError as e:
+                    self.db.session.rollback()
+                    print(f"Score flush of {len(batch)} rows failed: {e}")
+                    failed = [(entry, e) for entry in batch]
+                except Exception:
+                    self.db.session.rollback()
+                    failed = self._write_each(batch)
+
+            if failed:
+                # Back at the front with their enqueue times, so the queue stays oldest first
+                retry = []
+                for (kind, row, attempts, enqueued), e in failed:
+                    if attempts + 1 < self.max_attempts:
+                        retry.append((kind, row, attempts + 1, enqueued))
+                    else:
+                        print(f"Score row dropped after {attempts + 1} attempts: {kind} {row}: {e}")
+                self._queue.extendleft(reversed(retry))
+                self._retry_after = time.monotonic() + self.flush_interval
+
+            written = len(batch) - len(failed)
+            self.rows_written += written
+            self.last_flush_size = written
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            return written
+
+    def _write_each(self, batch):
+        """Write a batch that failed as a whole row by row; returns the [(entry, error)] that failed."""
+        failed = []
+        for entry in batch:
+            try:
+                self._write([entry])
+            except Exception as e:
+                self.db.session.rollback()
+                failed.append((entry, e))
+        return failed
+
+    def _write(self, batch):
+        inserts = [row for kind, row, _, _ in batch if kind == 'insert']
+
+        # Collapse best-score updates to one per player
+        best = {}
+        for kind, row, _, _ in batch:
+            if kind == 'best' and (row['player_id'] not in best or row['score'] > best[row['player_id']]['score']):
+                best[row['player_id']] = row
+
+        if best:
+            existing = {}
+            for highscore_id, player_id, score in self.db.session.query(
+                self.model.highscore_id, self.model.player_id, self.model.score
+            ).filter(self.model.player_id.in_(best)).order_by(self.model.highscore_id):
+                existing.setdefault(player_id, (highscore_id, score))
+
+            updates = []
+            for player_id, row in best.items():
+                if player_id not in existing:
+                    inserts.append(row)
+                elif row['score'] > existing[player_id][1]:
+                    updates.append({'highscore_id': existing[player_id][0], 'score': row['score'], 'time': row['time']})
+            if updates:
+                self.db.session.execute(update(self.model), updates)
+
+        if inserts:
+            self.db.session.execute(insert(self.model), inserts)
+        flagged = [row for kind, row, _, _ in batch if kind == 'flag']
+        if flagged:
+            self.db.session.execute(insert(self.flagged_model), flagged)
+        self.db.session.commit()
+
+    def close(self):
+        self.flush()
+
+    def _ensure_running(self):
+        if self._task is None:
+            with self._lock:
+                if self._task is None:
+                    self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.poll_interval)
+            if time.monotonic() < self._retry_after:
+                continue
+            if self._waited() >= self.flush_interval or len(self._queue) >= self.batch_size:
+                try:
+                    self._flush_batch()
+                except Exception as e:
+                    print(f"Score flush failed: {e}")
@@ -0,0 +1,229 @@
+// Compact binary board sync for multiplayer
+// The server relays these frames as opaque bytes; only clients encode/decode them.
+//
+// Frame layout (little endian):
+//   [0]      frame type (FRAME_KEY or FRAME_DELTA)
+//   [1..2]   sequence number (uint16, wraps)
+//   [3..4]   sequence number of the keyframe this frame is based on
+//   [5..8]   score (uint32)
+//   [9]      level (uint8)
+//   [10..11] lines (uint16)
+//   [12]     current piece type (0xFF = none)
+//   [13]     current piece x (int8)
+//   [14]     current piece y (int8)
+//   [15]     current piece size (rows << 4 | cols)
+//   [16..17] current piece cells (4x4 bitmask)
+//   keyframe: ROWS packed rows of ROW_BYTES each
+//   delta:    changed row count, then (row index, packed row) per changed row
+// A row packs one color index (0 = empty, 1..7 = COLORS[i - 1]) per nibble.
+//
+// Deltas are taken against the last keyframe rather than the previous frame,
+// so any frame supersedes the ones before it. That lets the server drop
+// intermediate frames when it coalesces a room's updates into one snapshot.
+
+const FRAME_KEY = 0;
+const FRAME_DELTA = 1;
+const HEADER_BYTES = 18;
+const ROW_BYTES = Math.ceil(COLS / 2);
+const KEYFRAME_INTERVAL = 30; // send a full board at least every N frames
+
+// Sender state
+let syncSeq = 0;
+let keySeq = 0;
+let framesSinceKey = KEYFRAME_INTERVAL;
+let keyRows = null;
+
+// Receiver state, keyed by opponent player id
+const opponentSync = {};
+
+// Pack a single board row into ROW_BYTES bytes
+function packRow(row) {
+    const packed = new Uint8Array(ROW_BYTES);
+    for (let x = 0; x < COLS; x++) {
+        const index = row[x] ? COLORS.indexOf(row[x]) + 1 : 0;
+        packed[x >> 1] |= (index & 0x0F) << ((x & 1) * 4);
+    }
+    return packed;
+}
+
+// Unpack a row back into the color strings used by the board
+function unpackRow(bytes, offset) {
+    const row = Array(COLS).fill(0);
+    for (let x = 0; x < COLS; x++) {
+        const index = (bytes[offset + (x >> 1)] >> ((x & 1) * 4)) & 0x0F;
+        row[x] = index ? COLORS[index - 1] : 0;
+    }
+    return row;
+}
+
+function rowsEqual(a, b) {
+    for (let i = 0; i < ROW_BYTES; i++) {
+        if (a[i] !== b[i]) return false;
+    }
+    return true;
+}
+
+// Write the frame header (sequence, stats and current piece)
+function writeHeader(view, type, seq, baseSeq, state) {
+    view.setUint8(0, type);
+    view.setUint16(1, seq, true);
+    view.setUint16(3, baseSeq, true);
+    view.setUint32(5, state.score >>> 0, true);
+    view.setUint8(9, Math.min(state.level, 255));
+    view.setUint16(10, Math.min(state.lines, 65535), true);
+
+    const piece = state.currentPiece;
+    if (!piece) {
+        view.setUint8(12, 0xFF);
+        return;
+    }
+
+    let mask = 0;
+    piece.shape.forEach((row, y) => {
+        row.forEach((value, x) => {
+            if (value && x < 4 && y < 4) {
+                mask |= 1 << (y * 4 + x);
+            }
+        });
+    });
+    view.setUint8(12, piece.type);
+    view.setInt8(13, piece.x);
+    view.setInt8(14, piece.y);
+    view.setUint8(15, (piece.shape.length << 4) | piece.shape[0].length);
+    view.setUint16(16, mask, true);
+}
+
+// Encode the local game state as a keyframe or a row-level delta.
+// Returns { frame, key } so the caller can tell the server which frames
+// must not be dropped when coalescing.
+function encodeGameFrame(state, forceKeyframe = false) {
+    const rows = state.board.map(packRow);
+    let isKey = forceKeyframe || !keyRows || framesSinceKey >= KEYFRAME_INTERVAL;
+
+    let changed = [];
+    if (!isKey) {
+        for (let y = 0; y < ROWS; y++) {
+            if (!rowsEqual(rows[y], keyRows[y])) {
+                changed.push(y);
+            }
+        }
+        // A delta covering most of the board is no smaller than a keyframe
+        if (changed.length > ROWS / 2) {
+            isKey = true;
+        }
+    }
+
+    const bodyBytes = isKey ? ROWS * ROW_BYTES : 1 + changed.length * (1 + ROW_BYTES);
+    const buffer = new ArrayBuffer(HEADER_BYTES + bodyBytes);
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+
+    syncSeq = (syncSeq + 1) & 0xFFFF;
+    if (isKey) {
+        keySeq = syncSeq;
+    }
+    writeHeader(view, isKey ? FRAME_KEY : FRAME_DELTA, syncSeq, keySeq, state);
+
+    let offset = HEADER_BYTES;
+    if (isKey) {
+        rows.forEach(row => {
+            bytes.set(row, offset);
+            offset += ROW_BYTES;
+        });
+        keyRows = rows;
+        framesSinceKey = 0;
+    } else {
+        bytes[offset++] = changed.length;
+        changed.forEach(y => {
+            bytes[offset++] = y;
+            bytes.set(rows[y], offset);
+            offset += ROW_BYTES;
+        });
+        framesSinceKey++;
+    }
+
+    return { frame: buffer, key: isKey };
+}
+
+// Reset sender state so the next frame is a keyframe
+function resetGameFrames() {
+    keyRows = null;
+    framesSinceKey = KEYFRAME_INTERVAL;
+}
+
+// Apply a frame from an opponent. Returns the rebuilt game state, or null
+// when the frame cannot be applied and a resync is needed. Frames older
+// than the last one applied are ignored (returns the current state).
+function decodeGameFrame(playerId, frame) {
+    const bytes = frame instanceof Uint8Array ? frame : new Uint8Array(frame);
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    const type = view.getUint8(0);
+    const seq = view.getUint16(1, true);
+    const baseSeq = view.getUint16(3, true);
+    let sync = opponentSync[playerId];
+
+    // Out-of-order frame: a newer one has already been applied
+    if (sync && sync.board && ((seq - sync.seq) & 0xFFFF) >= 0x8000) {
+        return sync.state;
+    }
+
+    if (type === FRAME_KEY) {
+        const keyBoard = [];
+        for (let y = 0; y < ROWS; y++) {
+            keyBoard.push(unpackRow(bytes, HEADER_BYTES + y * ROW_BYTES));
+        }
+        sync = opponentSync[playerId] = { seq, keySeq: seq, keyBoard, board: keyBoard, state: null };
+    } else {
+        // Deltas only apply on top of the keyframe they were taken against
+        if (!sync || !sync.keyBoard || sync.keySeq !== baseSeq) {
+            return null;
+        }
+        const board = sync.keyBoard.slice();
+        let offset = HEADER_BYTES;
+        const count = bytes[offset++];
+        for (let i = 0; i < count; i++) {
+            const y = bytes[offset++];
+            board[y] = unpackRow(bytes, offset);
+            offset += ROW_BYTES;
+        }
+        sync.board = board;
+        sync.seq = seq;
+    }
+
+    let currentPiece = null;
+    const pieceType = view.getUint8(12);
+    if (pieceType !== 0xFF) {
+        const size = view.getUint8(15);
+        const mask = view.getUint16(16, true);
+        const shape = Array.from({ length: size >> 4 }, (_, y) =>
+            Array.from({ length: size & 0x0F }, (_, x) => (mask >> (y * 4 + x)) & 1)
+        );
+        currentPiece = {
+            shape,
+            color: COLORS[pieceType],
+            x: view.getInt8(13),
+            y: view.getInt8(14),
+            type: pieceType
+        };
+    }
+
+    sync.state = {
+        board: sync.board,
+        currentPiece,
+        score: view.getUint32(5, true),
+        level: view.getUint8(9),
+        lines: view.getUint16(10, true)
+    };
+    return sync.state;
+}
+
+// Forget an opponent's sync state (e.g. when they leave)
+function forgetOpponentFrames(playerId) {
+    delete opponentSync[playerId];
+}
+
+// Export functions for external use
+window.encodeGameFrame = encodeGameFrame;
+window.decodeGameFrame = decodeGameFrame;
+window.resetGameFrames = resetGameFrames;
+window.forgetOpponentFrames = forgetOpponentFrames;
@@ -77,6 +77,14 @@ let pressedKeys = {};
 let canHold = true;
 let ghostPieceEnabled = true;
 
+// Seeded pieces and the input log the server replays to verify scores
+// (action codes match tetris_engine.py)
+const ACTION = { LEFT: 0, RIGHT: 1, SOFT_DROP: 2, ROTATE_CW: 3, ROTATE_CCW: 4, HARD_DROP: 5, HOLD: 6, GRAVITY: 7 };
+let gameSeed = null; // { seed, token } issued by the server
+let nextPieceType = randomPieceType;
+let inputLog = [];
+let gameNumber = 0; // counts restarts, which reuse the room's seed
+
 // Auto-repeat timing variables
 let autoRepeatDelay = 170; // milliseconds before repeating starts
 let autoRepeatRate = 100;  // milliseconds between repeats (higher = slower)
@@ -114,6 +122,12 @@ function initGame(boardId, nextPieceId, scoreId, levelId, linesId, singlePlayer
         holdCtx.imageSmoothingEnabled = false;
     }
     
+    // Seed for the first game
+    const seedInput = document.getElementById('game-seed');
+    if (seedInput && seedInput.value) {
+        setGameSeed({ seed: Number(seedInput.dataset.seed), token: seedInput.value });
+    }
+    
     // Get DOM elements
     scoreElement = document.getElementById(scoreId);
     levelElement = document.getElementById(levelId);
@@ -161,6 +175,12 @@ function resetGame() {
     rightRepeatTimer = 0;
     downRepeatTimer = 0;
     
+    // Same seed, same pieces: the server replays the game from it, and
+    // everyone in a room gets the room's seed
+    nextPieceType = gameSeed ? pieceBag(gameSeed.seed) : randomPieceType;
+    inputLog = [];
+    gameNumber = (gameNumber + 1) & 0xFFFF;
+    
     // Create the first pieces
     currentPiece = createPiece();
     nextPiece = createPiece();
@@ -184,10 +204,66 @@ function resetGame() {
     console.log("Game reset complete. Current piece:", currentPiece, "Next piece:", nextPiece);
 }
 
+// Seeded PRNG (mulberry32), mirrored by tetris_engine.mulberry32
+function mulberry32(seed) {
+    let a = seed;
+    return function() {
+        a |= 0;
+        a = a + 0x6D2B79F5 | 0;
+        let t = Math.imul(a ^ a >>> 15, 1 | a);
+        t = t + Math.imul(t ^ t >>> 7, 61 | t) ^ t;
+        return ((t ^ t >>> 14) >>> 0) / 4294967296;
+    };
+}
+
+// 7-bag randomizer: every run of seven pieces is a shuffled full set.
+// Mirrored by tetris_engine.seven_bag
+function pieceBag(seed) {
+    const random = mulberry32(seed);
+    let bag = [];
+    return function() {
+        if (bag.length === 0) {
+            bag = SHAPES.map((_, type) => type);
+            for (let i = bag.length - 1; i > 0; i--) {
+                const j = Math.floor(random() * (i + 1));
+                [bag[i], bag[j]] = [bag[j], bag[i]];
+            }
+        }
+        return bag.shift();
+    };
+}
+
+// Unseeded games
+function randomPieceType() {
+    return Math.floor(Math.random() * SHAPES.length);
+}
+
+// Use a server-issued seed from the next game on
+function setGameSeed(seed) {
+    gameSeed = seed;
+}
+
+// Seed token and packed input log (two actions per byte, base64) for score submission
+function getReplay() {
+    const bytes = [];
+    for (let i = 0; i < inputLog.length; i += 2) {
+        const high = i + 1 < inputLog.length ? inputLog[i + 1] : 0xF;
+        bytes.push(inputLog[i] | high << 4);
+    }
+    let binary = '';
+    for (let i = 0; i < bytes.length; i += 0x8000) {
+        binary += String.fromCharCode.apply(null, bytes.slice(i, i + 0x8000));
+    }
+    return {
+        seed_token: gameSeed ? gameSeed.token : null,
+        actions: btoa(binary)
+    };
+}
+
 // Create a new tetromino piece
 function createPiece(type = null) {
     if (type === null) {
-        type = Math.floor(Math.random() * SHAPES.length);
+        type = nextPieceType();
     }
     
     // Ensure the type is valid
@@ -547,6 +623,32 @@ function holdCurrentPiece() {
     drawHoldPiece();
 }
 
+// Point the page's "Watch replay" link at the game just recorded
+function showReplayLink(replayId) {
+    const link = document.getElementById('replay-link');
+    if (link) {
+        link.href = `/replay/${replayId}`;
+        link.style.display = '';
+    }
+}
+
+// A score saved over HTTP is stored as a replay once the server has
+// verified it; poll for the replay id under the key the save returned
+function waitForReplay(replayKey, attempts = 30) {
+    fetch(`/api/replays/pending/${replayKey}`)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.pending) {
+                if (data.replay_id) showReplayLink(data.replay_id);
+            } else if (attempts > 1) {
+                setTimeout(() => waitForReplay(replayKey, attempts - 1), 1000);
+            }
+        })
+        .catch(error => {
+            console.error('Error checking for replay:', error);
+        });
+}
+
 // Save score to the server
 function saveHighscore(score) {
     fetch('/api/save_highscore', {
@@ -554,10 +656,16 @@ function saveHighscore(score) {
         headers: {
             'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ score: score })
+        body: JSON.stringify(Object.assign({ score: score }, getReplay()))
     })
     .then(response => response.json())
     .then(data => {
+        if (data.next_seed) {
+            setGameSeed(data.next_seed);
+        }
+        if (data.replay_key) {
+            waitForReplay(data.replay_key);
+        }
         if (data.success && data.is_new_highscore) {
             // Show new high score message
             alert('New High Score: ' + data.score);
@@ -620,28 +728,13 @@ function lockPiece() {
         }
         
         // Single player: Save high score
-        if (isSinglePlayer) {
+        const tournamentId = document.getElementById('tournament-id')?.value || null;
+        if (isSinglePlayer && tournamentId) {
+            // Tournament games are recorded as tournament scores
+            saveScore(score, tournamentId);
+        } else if (isSinglePlayer) {
             // Save score to the server
-            fetch('/api/save_highscore', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ 
-                    score: score,
-                    tournament_id: document.getElementById('tournament-id')?.value || null
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success && data.is_new_highscore) {
-                    // Show new high score message
-                    alert('New High Score: ' + data.score);
-                }
-            })
-            .catch(error => {
-                console.error('Error saving score:', error);
-            });
+            saveHighscore(score);
         }
     }
 }
@@ -741,16 +834,19 @@ function handleKeyDown(event) {
     switch (event.keyCode) {
         case 37: // Left arrow
         case 65: // A key
+            inputLog.push(ACTION.LEFT);
             movePiece(-1, 0);
             leftRepeatTimer = 0;
             break;
         case 39: // Right arrow
         case 68: // D key
+            inputLog.push(ACTION.RIGHT);
             movePiece(1, 0);
             rightRepeatTimer = 0;
             break;
         case 40: // Down arrow
         case 83: // S key
+            inputLog.push(ACTION.SOFT_DROP);
             if (dropPiece()) {
                 score += 1;
                 updateScore();
@@ -759,15 +855,19 @@ function handleKeyDown(event) {
             break;
         case 38: // Up arrow
         case 87: // W key
+            inputLog.push(ACTION.ROTATE_CW);
             rotatePiece(true); // Clockwise
             break;
         case 90: // Z key
+            inputLog.push(ACTION.ROTATE_CCW);
             rotatePiece(false); // Counter-clockwise
             break;
         case 32: // Space - Hard drop
+            inputLog.push(ACTION.HARD_DROP);
             hardDrop();
             break;
         case 67: // C key - Hold piece
+            inputLog.push(ACTION.HOLD);
             holdCurrentPiece();
             break;
         case 27: // ESC - Reset game
@@ -793,6 +893,7 @@ function handleAutoRepeat(deltaTime) {
     if (pressedKeys[37] || pressedKeys[65]) {
         leftRepeatTimer += deltaTime;
         if (leftRepeatTimer > autoRepeatDelay) {
+            inputLog.push(ACTION.LEFT);
             movePiece(-1, 0);
             leftRepeatTimer = autoRepeatDelay - autoRepeatRate;
         }
@@ -804,6 +905,7 @@ function handleAutoRepeat(deltaTime) {
     if (pressedKeys[39] || pressedKeys[68]) {
         rightRepeatTimer += deltaTime;
         if (rightRepeatTimer > autoRepeatDelay) {
+            inputLog.push(ACTION.RIGHT);
             movePiece(1, 0);
             rightRepeatTimer = autoRepeatDelay - autoRepeatRate;
         }
@@ -815,6 +917,7 @@ function handleAutoRepeat(deltaTime) {
     if (pressedKeys[40] || pressedKeys[83]) {
         downRepeatTimer += deltaTime;
         if (downRepeatTimer > autoRepeatDelay / 2) {
+            inputLog.push(ACTION.SOFT_DROP);
             if (dropPiece()) {
                 score += 1;
                 updateScore();
@@ -931,13 +1034,19 @@ function saveScore(score, tournamentId = null) {
         headers: {
             'Content-Type': 'application/json',
         },
-        body: JSON.stringify({
+        body: JSON.stringify(Object.assign({
             score: score,
             tournament_id: tournamentId
-        })
+        }, getReplay()))
     })
     .then(response => response.json())
     .then(data => {
+        if (data.next_seed) {
+            setGameSeed(data.next_seed);
+        }
+        if (data.replay_key) {
+            waitForReplay(data.replay_key);
+        }
         if (data.success && data.is_new_highscore) {
             // Show new high score message
             alert('New High Score: ' + data.score);
@@ -949,6 +1058,15 @@ function saveScore(score, tournamentId = null) {
 }
 
 
+// This game's input log as it grows, for input-only multiplayer (see lockstep.js)
+function getInputState() {
+    return {
+        seed: gameSeed ? gameSeed.seed : null,
+        game: gameNumber,
+        actions: inputLog
+    };
+}
+
 // Game loop
 function gameLoop(timestamp) {
     // Make sure we have a valid canvas context before proceeding
@@ -967,7 +1085,9 @@ function gameLoop(timestamp) {
         // Update drop counter
         dropCounter += deltaTime;
         
-        if (dropCounter > dropInterval) {
+        // Auto-repeat may have just ended the game
+        if (dropCounter > dropInterval && !gameOver) {
+            inputLog.push(ACTION.GRAVITY);
             dropPiece();
             dropCounter = 0;
             
@@ -1018,3 +1138,7 @@ function gameLoop(timestamp) {
 window.initGame = initGame;
 window.updateOpponentBoard = updateOpponentBoard;
 window.getGameState = getGameState;
+window.getReplay = getReplay;
+window.getInputState = getInputState;
+window.setGameSeed = setGameSeed;
+window.showReplayLink = showReplayLink;
@@ -0,0 +1,263 @@
+// Input-only multiplayer sync (rooms started in "inputs" mode)
+// Instead of boards, each client sends the actions game.js already records
+// for score replays, and every peer rebuilds the opponents' games from the
+// room seed with the same rules as game.js (and tetris_engine.py on the
+// server). A few bytes per batch of key presses replace a board per update.
+//
+// Packet layout (little endian), shared with lockstep.py:
+//   [0..1]   game number (uint16, counts the sender's restarts, which reuse
+//            the room seed)
+//   [2..5]   index of the first action in the game's log (uint32)
+//   [6..9]   seed (uint32), only in packets starting at index 0
+//   then the actions, two per byte, low nibble first; an odd tail is
+//   padded with 0xF
+// Gravity ticks are logged as actions, so no timestamps are needed.
+
+const INPUT_HEADER_BYTES = 6;
+const INPUT_SEND_INTERVAL = 100; // ms between input packets while playing
+// Most actions per packet (MAX_PACKET_ACTIONS in lockstep.py); longer
+// resends go out over several intervals
+const INPUT_MAX_PACKET_ACTIONS = 8192;
+
+function encodeInputPacket(seed, game, start, actions) {
+    const offset = INPUT_HEADER_BYTES + (start === 0 ? 4 : 0);
+    const bytes = new Uint8Array(offset + Math.ceil(actions.length / 2));
+    const view = new DataView(bytes.buffer);
+    view.setUint16(0, game, true);
+    view.setUint32(2, start, true);
+    if (start === 0) {
+        view.setUint32(6, seed >>> 0, true);
+    }
+    for (let i = 0; i < actions.length; i += 2) {
+        const high = i + 1 < actions.length ? actions[i + 1] : 0xF;
+        bytes[offset + (i >> 1)] = actions[i] | high << 4;
+    }
+    return bytes;
+}
+
+function decodeInputPacket(packet) {
+    const bytes = packet instanceof Uint8Array ? packet : new Uint8Array(packet);
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    const start = view.getUint32(2, true);
+    const offset = INPUT_HEADER_BYTES + (start === 0 ? 4 : 0);
+    const actions = [];
+    for (let i = offset; i < bytes.length; i++) {
+        actions.push(bytes[i] & 0xF);
+        if (bytes[i] >> 4 !== 0xF) {
+            actions.push(bytes[i] >> 4);
+        }
+    }
+    return {
+        game: view.getUint16(0, true),
+        start,
+        seed: start === 0 ? view.getUint32(6, true) : null,
+        actions
+    };
+}
+
+// Sender state: how much of the current input log has gone out
+let inputsLog = null;
+let inputsSent = 0;
+
+// Next packet of our own inputs, or null if there is nothing new.
+// A new game is announced with a packet from index 0, even if empty.
+function takeInputPacket() {
+    const state = getInputState();
+    if (state.seed === null) return null;
+    if (state.actions !== inputsLog) {
+        inputsLog = state.actions;
+        inputsSent = -1;
+    }
+    const start = Math.max(inputsSent, 0);
+    if (inputsSent >= state.actions.length) return null;
+    inputsSent = Math.min(state.actions.length, start + INPUT_MAX_PACKET_ACTIONS);
+    return encodeInputPacket(state.seed, state.game, start, state.actions.slice(start, inputsSent));
+}
+
+// The server missed part of our log: send it again from `index`
+function resendInputsFrom(index) {
+    if (inputsLog !== null) {
+        inputsSent = Math.min(inputsSent, index);
+    }
+}
+
+// Rotations of every shape, clockwise from spawn, as rotatePiece() makes them
+const LOCKSTEP_ROTATIONS = SHAPES.map(shape => {
+    const rotations = [shape];
+    for (let r = 1; r < 4; r++) {
+        const previous = rotations[r - 1];
+        const n = previous.length;
+        rotations.push(Array.from({ length: n }, (_, y) =>
+            Array.from({ length: n }, (_, x) => previous[n - 1 - x][y])));
+    }
+    return rotations;
+});
+const LOCKSTEP_KICKS = [[0, 0], [-1, 0], [1, 0], [0, -1], [-1, -1], [1, -1], [0, -2], [-1, -2], [1, -2]];
+const LOCKSTEP_I_KICKS = [[0, 0], [-2, 0], [1, 0], [-2, -1], [1, -1], [0, -1]];
+const LOCKSTEP_LINE_POINTS = [0, 40, 100, 300, 1200];
+
+// An opponent's game, advanced one recorded action at a time.
+// Hold needs a hold canvas in game.js, which the multiplayer page does not
+// have, so HOLD is a no-op here as well.
+class LockstepGame {
+    constructor(seed) {
+        this.nextType = pieceBag(seed);
+        this.board = Array.from({ length: ROWS }, () => Array(COLS).fill(0));
+        this.score = 0;
+        this.level = 1;
+        this.lines = 0;
+        this.gameOver = false;
+        this.applied = 0;
+
+        // resetGame(): the first two pieces are never the same type
+        this.spawn(this.nextType());
+        this.next = this.nextType();
+        while (this.next === this.type) {
+            this.next = this.nextType();
+        }
+    }
+
+    spawn(type) {
+        this.type = type;
+        this.rotation = 0;
+        this.x = Math.floor(COLS / 2) - Math.floor(SHAPES[type][0].length / 2);
+        this.y = 0;
+    }
+
+    fits(rotation, x, y) {
+        const shape = LOCKSTEP_ROTATIONS[this.type][rotation];
+        for (let dy = 0; dy < shape.length; dy++) {
+            for (let dx = 0; dx < shape[dy].length; dx++) {
+                if (!shape[dy][dx]) continue;
+                const bx = x + dx, by = y + dy;
+                if (bx < 0 || bx >= COLS || by >= ROWS || (by >= 0 && this.board[by][bx] !== 0)) {
+                    return false;
+                }
+            }
+        }
+        return true;
+    }
+
+    move(dx, dy) {
+        if (this.fits(this.rotation, this.x + dx, this.y + dy)) {
+            this.x += dx;
+            this.y += dy;
+            return true;
+        }
+        return false;
+    }
+
+    rotate(turn) {
+        const rotation = (this.rotation + turn + 4) % 4;
+        for (const [dx, dy] of this.type === 0 ? LOCKSTEP_I_KICKS : LOCKSTEP_KICKS) {
+            if (this.fits(rotation, this.x + dx, this.y + dy)) {
+                this.rotation = rotation;
+                this.x += dx;
+                this.y += dy;
+                return;
+            }
+        }
+    }
+
+    drop() {
+        if (this.move(0, 1)) return true;
+        this.lock();
+        return false;
+    }
+
+    lock() {
+        const shape = LOCKSTEP_ROTATIONS[this.type][this.rotation];
+        shape.forEach((row, dy) => row.forEach((value, dx) => {
+            if (!value) return;
+            if (this.y + dy < 0) {
+                // Locked above the board
+                this.gameOver = true;
+                return;
+            }
+            this.board[this.y + dy][this.x + dx] = COLORS[this.type];
+        }));
+        if (this.gameOver) return;
+
+        const kept = this.board.filter(row => row.some(cell => cell === 0));
+        const cleared = ROWS - kept.length;
+        if (cleared) {
+            this.board = Array.from({ length: cleared }, () => Array(COLS).fill(0)).concat(kept);
+            this.score += LOCKSTEP_LINE_POINTS[cleared] * this.level;
+            this.lines += cleared;
+            this.level = Math.max(this.level, Math.floor(this.lines / 10) + 1);
+        }
+
+        this.spawn(this.next);
+        this.next = this.nextType();
+        if (!this.fits(0, this.x, this.y)) {
+            this.gameOver = true;
+        }
+    }
+
+    step(action) {
+        this.applied++;
+        if (this.gameOver) return;
+        switch (action) {
+            case ACTION.GRAVITY: this.drop(); break;
+            case ACTION.LEFT: this.move(-1, 0); break;
+            case ACTION.RIGHT: this.move(1, 0); break;
+            case ACTION.SOFT_DROP: if (this.drop()) this.score += 1; break;
+            case ACTION.ROTATE_CW: this.rotate(1); break;
+            case ACTION.ROTATE_CCW: this.rotate(-1); break;
+            case ACTION.HARD_DROP: {
+                let distance = 0;
+                while (this.move(0, 1)) distance++;
+                this.score += distance * 2;
+                this.lock();
+                break;
+            }
+        }
+    }
+
+    // Same shape as getGameState(), for updateOpponentBoard()
+    getState() {
+        const currentPiece = this.gameOver ? null : {
+            shape: LOCKSTEP_ROTATIONS[this.type][this.rotation],
+            color: COLORS[this.type],
+            x: this.x,
+            y: this.y,
+            type: this.type
+        };
+        return {
+            board: this.board,
+            currentPiece,
+            score: this.score,
+            level: this.level,
+            lines: this.lines,
+            gameOver: this.gameOver
+        };
+    }
+}
+
+// Receiver state, keyed by opponent player id
+const lockstepGames = {};
+
+// Apply an opponent's input packet. Returns their game state, or null if
+// actions are missing (ask the server for the whole stream).
+function applyInputPacket(playerId, packet) {
+    const update = decodeInputPacket(packet);
+    let entry = lockstepGames[playerId];
+    if (!entry || entry.game !== update.game || (update.start === 0 && entry.seed !== update.seed)) {
+        if (update.start !== 0) return null;
+        entry = lockstepGames[playerId] = {
+            seed: update.seed,
+            game: update.game,
+            state: new LockstepGame(update.seed)
+        };
+    }
+    const game = entry.state;
+    if (update.start > game.applied) return null;
+    for (let i = game.applied - update.start; i < update.actions.length; i++) {
+        game.step(update.actions[i]);
+    }
+    return game.getState();
+}
+
+function forgetOpponentInputs(playerId) {
+    delete lockstepGames[playerId];
+}
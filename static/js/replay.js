@@ -0,0 +1,152 @@
+// Replay playback: fetches a recorded game from /api/replays/<id> and plays
+// it back with LockstepGame (lockstep.js), the same rules the server uses.
+//
+// Record layout (replay_store.py): version byte, varints player id, score
+// and recorded-at, the seed (uint32, little endian), a varint action count,
+// then the actions as runs in nibbles, low nibble first. A nibble is an
+// action code; with 0x8 set the action repeats, and (count - 2) follows as
+// 3-bit groups, low first, 0x8 set on every group but the last.
+//
+// Only gravity ticks carry time, so each gravity interval is played at the
+// level's drop speed (as game.js sets dropInterval) and the inputs made
+// during it are spread evenly across it.
+
+const REPLAY_VERSION = 1;
+
+function readVarint(bytes, pos) {
+    let value = 0;
+    let scale = 1;
+    for (;;) {
+        const byte = bytes[pos++];
+        value += (byte & 0x7F) * scale;
+        if (byte < 0x80) return [value, pos];
+        scale *= 128;
+    }
+}
+
+function decodeReplay(buffer) {
+    const bytes = new Uint8Array(buffer);
+    if (bytes[0] !== REPLAY_VERSION) {
+        throw new Error(`Unknown replay version ${bytes[0]}`);
+    }
+    let pos = 1;
+    let playerId, score, recordedAt, count;
+    [playerId, pos] = readVarint(bytes, pos);
+    [score, pos] = readVarint(bytes, pos);
+    [recordedAt, pos] = readVarint(bytes, pos);
+    const seed = new DataView(bytes.buffer, bytes.byteOffset + pos, 4).getUint32(0, true);
+    [count, pos] = readVarint(bytes, pos + 4);
+
+    let nibbleIndex = pos * 2;
+    const nextNibble = () => {
+        const byte = bytes[nibbleIndex >> 1];
+        if (byte === undefined) throw new Error('Replay is truncated');
+        return nibbleIndex++ & 1 ? byte >> 4 : byte & 0xF;
+    };
+    const actions = [];
+    while (actions.length < count) {
+        const nibble = nextNibble();
+        if (!(nibble & 0x8)) {
+            actions.push(nibble);
+            continue;
+        }
+        let extra = 0;
+        let shift = 0;
+        let part;
+        do {
+            part = nextNibble();
+            extra += (part & 0x7) << shift;
+            shift += 3;
+        } while (part & 0x8);
+        for (let i = 0; i < extra + 2; i++) {
+            actions.push(nibble & 0x7);
+        }
+    }
+    return { playerId, score, recordedAt, seed, actions };
+}
+
+// Milliseconds between gravity ticks: one second until the first line
+// (resetGame()), then the level's speed as removeFullRows() sets it
+function gravityInterval(game) {
+    if (game.lines === 0) return 1000;
+    return Math.max(16, Math.max(1, 48 - game.level * 5) * 16.67);
+}
+
+// Play `replay` into `container` (see updateOpponentBoard). Returns a
+// controller with setSpeed(), pause(), resume() and stop().
+function playReplay(replay, container, onProgress) {
+    const game = new LockstepGame(replay.seed);
+    const actions = replay.actions;
+    let index = 0;
+    let speed = 1;
+    let paused = false;
+    let frame = null;
+    let lastTime = null;
+
+    // Current gravity interval: its actions [start, end) and time spent in it
+    let tickStart = 0, tickEnd = 0, tickElapsed = 0, tickLength = 0;
+
+    function nextTick() {
+        tickStart = index;
+        tickEnd = index;
+        while (tickEnd < actions.length && actions[tickEnd] !== ACTION.GRAVITY) tickEnd++;
+        if (tickEnd < actions.length) tickEnd++; // the gravity tick closes the interval
+        tickElapsed = 0;
+        tickLength = gravityInterval(game);
+    }
+
+    function draw() {
+        updateOpponentBoard(replay.playerId, game.getState(), container);
+        if (onProgress) onProgress(game, index, actions.length);
+    }
+
+    function loop(timestamp) {
+        frame = null;
+        if (lastTime !== null && !paused) {
+            tickElapsed += (timestamp - lastTime) * speed;
+            // Actions of the interval are evenly spaced, the gravity tick last
+            while (index < actions.length && !game.gameOver) {
+                const due = (index - tickStart + 1) / (tickEnd - tickStart) * tickLength;
+                if (due > tickElapsed) break;
+                game.step(actions[index++]);
+                if (index >= tickEnd) {
+                    const carry = tickElapsed - tickLength;
+                    nextTick();
+                    tickElapsed = Math.max(0, carry);
+                }
+            }
+            draw();
+        }
+        lastTime = timestamp;
+        if (index < actions.length && !game.gameOver) {
+            frame = requestAnimationFrame(loop);
+        }
+    }
+
+    nextTick();
+    draw();
+    frame = requestAnimationFrame(loop);
+
+    return {
+        setSpeed(value) { speed = value; },
+        pause() { paused = true; },
+        resume() { paused = false; },
+        stop() {
+            if (frame) cancelAnimationFrame(frame);
+            frame = null;
+        }
+    };
+}
+
+function loadReplay(replayId) {
+    return fetch(`/api/replays/${replayId}`)
+        .then(response => {
+            if (!response.ok) throw new Error(`Replay ${replayId} not found`);
+            return response.arrayBuffer();
+        })
+        .then(decodeReplay);
+}
+
+window.decodeReplay = decodeReplay;
+window.loadReplay = loadReplay;
+window.playReplay = playReplay;
@@ -73,15 +73,40 @@ function setupSocketEvents() {
         }
     });
     
-    socket.on('game_update', function(data) {
-        console.log('Game update from player:', data.player_id);
-        
-        // Update the opponent's board
-        if (typeof updateOpponentBoard === 'function') {
-            updateOpponentBoard(data.player_id, data.game_state, opponentBoardsContainer);
-        } else {
-            console.error('updateOpponentBoard function not found');
-        }
+    socket.on('room_snapshot', function(data) {
+        data.players.forEach(function(update) {
+            if (update.player_id === userId) return;
+            
+            // Decode the packed frames (boardsync.js); request a keyframe if they can't be applied
+            let gameState = null;
+            update.frames.forEach(function(frame) {
+                gameState = decodeGameFrame(update.player_id, frame);
+            });
+            if (!gameState) {
+                socket.emit('request_resync', { room_code: roomCode, player_id: update.player_id });
+                return;
+            }
+            
+            // Update the opponent's board
+            if (typeof updateOpponentBoard === 'function') {
+                updateOpponentBoard(update.player_id, gameState, opponentBoardsContainer);
+            } else {
+                console.error('updateOpponentBoard function not found');
+            }
+        });
+    });
+    
+    socket.on('resync_requested', function() {
+        resetGameFrames();
+        onGameUpdate(getGameState());
+    });
+    
+    socket.on('game_seed', function(seed) {
+        setGameSeed(seed);
+    });
+    
+    socket.on('replay_saved', function(data) {
+        showReplayLink(data.replay_id);
     });
     
     socket.on('player_game_over', function(data) {
@@ -115,9 +140,11 @@ function setupSocketEvents() {
 // Game state update callback
 function onGameUpdate(gameState) {
     if (socket && socket.connected) {
+        const encoded = encodeGameFrame(gameState);
         socket.emit('game_update', {
             room_code: roomCode,
-            game_state: gameState
+            frame: encoded.frame,
+            key: encoded.key
         });
     }
 }
@@ -125,10 +152,10 @@ function onGameUpdate(gameState) {
 // Game over callback
 function onGameOver(score) {
     if (socket && socket.connected) {
-        socket.emit('game_over', {
+        socket.emit('game_over', Object.assign({
             room_code: roomCode,
             score: score
-        });
+        }, getReplay()));
     }
 }
 
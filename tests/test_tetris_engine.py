@@ -0,0 +1,36 @@
+import base64
+import unittest
+
+from tetris_engine import pack_actions, replay, seeded_pieces, unpack_actions
+
+# A 100-piece game played in static/js/game.js with seed 20261018: the
+# `actions` field getReplay() sent, and the score, lines and level the page
+# showed when it was taken
+RECORDED_SEED = 20261018
+RECORDED_ACTIONS = (
+    'AAAFFVEzEVEzADUAAFAXNVMREQVQM1EDAABVNzMAUBERNRMRNQAAUFBzUQBQAzUAUAMAABURNXM1EVETUVEzExFRAwB1AwAANVAR'
+    'UTMRUVE3MwA1AABQEVEzAwAFAHAFFVUTETUAFQVwUAMFADUzEREVEVEDcABQUQAFAFATUREXUVADAAA1M1EDAHVQUDMANTMAABVR'
+    'NzMRETUAAFARNVA3MxFRA1BTAwBQEVE3ERE1AABQM1EDAHURERVRMwAANVA3NTMAFVEAAHUTEVEDNQMAUDMDBzUTUTMFAFAAdVER'
+    'UQBVMwBw9Q=='
+)
+RECORDED_SCORE = 6962
+RECORDED_LINES = 37
+RECORDED_LEVEL = 4
+
+
+class RecordedGameTest(unittest.TestCase):
+    def setUp(self):
+        self.packed = base64.b64decode(RECORDED_ACTIONS)
+
+    def test_replay_matches_game_js(self):
+        game = replay(unpack_actions(self.packed), seeded_pieces(RECORDED_SEED))
+        self.assertEqual((game.score, game.lines, game.level), (RECORDED_SCORE, RECORDED_LINES, RECORDED_LEVEL))
+        self.assertEqual(game.pieces_locked, 100)
+        self.assertFalse(game.game_over)
+
+    def test_pack_round_trip(self):
+        self.assertEqual(pack_actions(unpack_actions(self.packed)), self.packed)
+
+
+if __name__ == '__main__':
+    unittest.main()
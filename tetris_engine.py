@@ -0,0 +1,359 @@
+"""Server-side Tetris rules, matching static/js/game.js.
+
+The board is a list of ROWS ints, one per row, with bit x set when column x
+is filled, so collision tests and line clears are bitwise operations. Every
+piece in each of its four orientations is precomputed as a list of
+(row offset, column mask) pairs.
+
+A game is driven by a stream of piece types (the values the client's
+createPiece() drew, or `seeded_pieces(seed)` for seeded games) and a log of
+actions, one small int per action. Logs travel packed two actions per byte
+(see `pack_actions`).
+"""
+import functools
+import threading
+
+COLS = 10
+ROWS = 20
+FULL_ROW = (1 << COLS) - 1
+
+# Same order as SHAPES in game.js: I, J, L, O, S, T, Z
+SHAPES = [
+    [[0, 0, 0, 0], [1, 1, 1, 1], [0, 0, 0, 0], [0, 0, 0, 0]],
+    [[1, 0, 0], [1, 1, 1], [0, 0, 0]],
+    [[0, 0, 1], [1, 1, 1], [0, 0, 0]],
+    [[1, 1], [1, 1]],
+    [[0, 1, 1], [1, 1, 0], [0, 0, 0]],
+    [[0, 1, 0], [1, 1, 1], [0, 0, 0]],
+    [[1, 1, 0], [0, 1, 1], [0, 0, 0]],
+]
+I_PIECE = 0
+
+# Wall kicks tried in order by rotatePiece() in game.js (x, y offsets)
+KICKS = [(0, 0), (-1, 0), (1, 0), (0, -1), (-1, -1), (1, -1), (0, -2), (-1, -2), (1, -2)]
+I_KICKS = [(0, 0), (-2, 0), (1, 0), (-2, -1), (1, -1), (0, -1)]
+
+# Original Nintendo scoring, multiplied by the level before the clear
+LINE_POINTS = [0, 40, 100, 300, 1200]
+
+# Actions: the moves handleKeyDown / handleAutoRepeat make, plus a gravity tick
+LEFT, RIGHT, SOFT_DROP, ROTATE_CW, ROTATE_CCW, HARD_DROP, HOLD, GRAVITY = range(8)
+ACTIONS = ['left', 'right', 'soft_drop', 'rotate_cw', 'rotate_ccw', 'hard_drop', 'hold', 'gravity']
+
+
+def _rotate_cw(shape):
+    n = len(shape)
+    return [[shape[n - 1 - x][y] for x in range(n)] for y in range(n)]
+
+
+def _cells(shape):
+    """(row offset, column mask, leftmost column, rightmost column) for a shape."""
+    rows = []
+    for dy, row in enumerate(shape):
+        mask = sum(1 << x for x, value in enumerate(row) if value)
+        if mask:
+            rows.append((dy, mask))
+    columns = [x for row in shape for x, value in enumerate(row) if value]
+    return tuple(rows), min(columns), max(columns)
+
+
+# ORIENTATIONS[type][rotation] for rotation 0..3, clockwise from spawn
+ORIENTATIONS = []
+for _shape in SHAPES:
+    _orientations = []
+    for _ in range(4):
+        _orientations.append(_cells(_shape))
+        _shape = _rotate_cw(_shape)
+    ORIENTATIONS.append(_orientations)
+
+# PLACEMENTS[type][rotation][x] -> ((row offset, mask already shifted to x), ...)
+# for every x at which the piece is inside the walls
+PLACEMENTS = [
+    [{x: tuple((dy, mask << x if x >= 0 else mask >> -x) for dy, mask in rows)
+      for x in range(-left, COLS - right)}
+     for rows, left, right in orientations]
+    for orientations in ORIENTATIONS
+]
+
+SPAWN_X = [COLS // 2 - len(shape[0]) // 2 for shape in SHAPES]
+
+
+def mulberry32(seed):
+    """Yield floats in [0, 1), the same sequence as mulberry32() in game.js."""
+    a = seed & 0xFFFFFFFF
+    while True:
+        a = (a + 0x6D2B79F5) & 0xFFFFFFFF
+        t = ((a ^ (a >> 15)) * (a | 1)) & 0xFFFFFFFF
+        t = ((t + (((t ^ (t >> 7)) * (t | 61)) & 0xFFFFFFFF)) & 0xFFFFFFFF) ^ t
+        yield (t ^ (t >> 14)) / 4294967296
+
+
+def seven_bag(seed):
+    """Yield piece types from shuffled bags of all seven, as pieceBag() in game.js."""
+    rand = mulberry32(seed)
+    while True:
+        bag = list(range(len(SHAPES)))
+        # Fisher-Yates, one draw per swap
+        for i in range(len(bag) - 1, 0, -1):
+            j = int(next(rand) * (i + 1))
+            bag[i], bag[j] = bag[j], bag[i]
+        yield from bag
+
+
+class PieceSequence:
+    """Random access to the 7-bag sequence for one seed.
+
+    The first `lookahead` pieces are generated up front and the buffer grows
+    a bag at a time past that, so any piece index can be looked up without
+    replaying the generator.
+    """
+
+    def __init__(self, seed, lookahead=700):
+        self.seed = seed
+        self._bags = seven_bag(seed)
+        self._pieces = []
+        self._lock = threading.Lock()
+        self._fill(lookahead)
+
+    def _fill(self, count):
+        if len(self._pieces) >= count:
+            return
+        with self._lock:
+            while len(self._pieces) < count:
+                self._pieces.extend(next(self._bags) for _ in range(len(SHAPES)))
+
+    def __getitem__(self, index):
+        self._fill(index + 1)
+        return self._pieces[index]
+
+    def window(self, start, count):
+        self._fill(start + count)
+        return self._pieces[start:start + count]
+
+    def __iter__(self):
+        index = 0
+        while True:
+            yield self[index]
+            index += 1
+
+
+@functools.lru_cache(maxsize=256)
+def piece_sequence(seed):
+    """Shared PieceSequence for a seed; every player in a room uses the same one."""
+    return PieceSequence(seed)
+
+
+def seeded_pieces(seed):
+    """Piece types drawn by createPiece() in a game seeded with `seed`."""
+    return iter(piece_sequence(seed))
+
+
+def pack_actions(actions):
+    """Pack actions two per byte, low nibble first; an odd tail is padded with 0xF."""
+    data = bytearray()
+    for i in range(0, len(actions) - 1, 2):
+        data.append(actions[i] | actions[i + 1] << 4)
+    if len(actions) % 2:
+        data.append(actions[-1] | 0xF0)
+    return bytes(data)
+
+
+def unpack_actions(data):
+    actions = bytearray()
+    for byte in data:
+        actions.append(byte & 0xF)
+        if byte >> 4 != 0xF:
+            actions.append(byte >> 4)
+    return bytes(actions)
+
+
+class PiecesExhausted(Exception):
+    """The piece sequence ran out before the game did."""
+
+
+class Game:
+    """One game of Tetris, advanced by `step(action)`.
+
+    `pieces` yields piece types (0-6) in the order the client generated
+    them. `hold` mirrors whether the page has a hold canvas; the shipped
+    templates do not, so hold is off by default and HOLD is a no-op.
+    """
+
+    def __init__(self, pieces, hold=False):
+        self._pieces = iter(pieces)
+        self.hold_enabled = hold
+        self.board = [0] * ROWS
+        self._top = ROWS  # every row above this one is empty
+        self.score = 0
+        self.level = 1
+        self.lines = 0
+        self.pieces_locked = 0
+        self.game_over = False
+        self.hold_type = None
+        self.can_hold = True
+
+        # resetGame(): the first two pieces are never the same type
+        self._spawn(self._draw())
+        self.next_type = self._draw()
+        while self.next_type == self.type:
+            self.next_type = self._draw()
+
+    def _draw(self):
+        try:
+            return next(self._pieces)
+        except StopIteration:
+            raise PiecesExhausted() from None
+
+    def _spawn(self, piece_type):
+        self.type = piece_type
+        self.rotation = 0
+        self.x = SPAWN_X[piece_type]
+        self.y = 0
+
+    def fits(self, rotation, x, y):
+        rows = PLACEMENTS[self.type][rotation].get(x)
+        if rows is None:
+            return False
+        board = self.board
+        for dy, mask in rows:
+            row = y + dy
+            if row >= ROWS:
+                return False
+            # Cells above the board never collide
+            if row >= 0 and board[row] & mask:
+                return False
+        return True
+
+    def _move(self, dx, dy):
+        if self.fits(self.rotation, self.x + dx, self.y + dy):
+            self.x += dx
+            self.y += dy
+            return True
+        return False
+
+    def _rotate(self, turn):
+        rotation = (self.rotation + turn) % 4
+        for dx, dy in I_KICKS if self.type == I_PIECE else KICKS:
+            if self.fits(rotation, self.x + dx, self.y + dy):
+                self.rotation = rotation
+                self.x += dx
+                self.y += dy
+                return True
+        return False
+
+    def _drop_distance(self):
+        # How far the piece falls, found without moving it a row at a time
+        rows = PLACEMENTS[self.type][self.rotation][self.x]
+        board = self.board
+        # Fall straight through the empty rows above the stack
+        y = max(self.y + 1, self._top - rows[-1][0])
+        while True:
+            for dy, mask in rows:
+                row = y + dy
+                if row >= ROWS or (row >= 0 and board[row] & mask):
+                    return y - 1 - self.y
+            y += 1
+
+    def _drop(self):
+        if self._move(0, 1):
+            return True
+        self._lock()
+        return False
+
+    def _lock(self):
+        y, board = self.y, self.board
+        rows = PLACEMENTS[self.type][self.rotation][self.x]
+        self._top = min(self._top, max(y + rows[0][0], 0))
+        for dy, mask in rows:
+            row = y + dy
+            if row < 0:
+                # Locked above the board
+                self.game_over = True
+                continue
+            board[row] |= mask
+        self.pieces_locked += 1
+        if self.game_over:
+            return
+
+        cleared = board.count(FULL_ROW)
+        if cleared:
+            kept = [row for row in board if row != FULL_ROW]
+            self.board = [0] * cleared + kept
+            self._top += cleared
+            self.score += LINE_POINTS[cleared] * self.level
+            self.lines += cleared
+            self.level = max(self.level, self.lines // 10 + 1)
+
+        self.can_hold = True
+        self._spawn(self.next_type)
+        self.next_type = self._draw()
+        if not self.fits(0, self.x, self.y):
+            self.game_over = True
+
+    def _hold(self):
+        if not self.hold_enabled or not self.can_hold:
+            return
+        if self.hold_type is None:
+            self.hold_type = self.type
+            self._spawn(self.next_type)
+            self.next_type = self._draw()
+        else:
+            self.hold_type, swap = self.type, self.hold_type
+            self._spawn(swap)
+        self.can_hold = False
+
+    def step(self, action):
+        """Apply one action. Returns False once the game is over."""
+        if self.game_over:
+            return False
+        if action == GRAVITY:
+            self._drop()
+        elif action == LEFT:
+            self._move(-1, 0)
+        elif action == RIGHT:
+            self._move(1, 0)
+        elif action == SOFT_DROP:
+            if self._drop():
+                self.score += 1
+        elif action == ROTATE_CW:
+            self._rotate(1)
+        elif action == ROTATE_CCW:
+            self._rotate(-1)
+        elif action == HARD_DROP:
+            distance = self._drop_distance()
+            self.y += distance
+            self.score += distance * 2
+            self._lock()
+        elif action == HOLD:
+            self._hold()
+        else:
+            raise ValueError(f'unknown action {action!r}')
+        return not self.game_over
+
+    @property
+    def drop_interval(self):
+        """Gravity interval in ms at the current level, as game.js computes it."""
+        if not self.lines:
+            return 1000
+        return max(16, max(1, 48 - self.level * 5) * 16.67)
+
+    def rows(self):
+        """The board as a list of rows of 0/1 cells, top row first."""
+        return [[(row >> x) & 1 for x in range(COLS)] for row in self.board]
+
+
+def replay(actions, pieces, hold=False):
+    """Play `actions` from the start and return the finished Game.
+
+    Actions after the game ends are ignored. If the client's piece list runs
+    out before the log does, the game stops there; a list too short to even
+    start a game raises PiecesExhausted.
+    """
+    game = Game(pieces, hold=hold)
+    try:
+        for action in actions:
+            if not game.step(action):
+                break
+    except PiecesExhausted:
+        pass
+    return game
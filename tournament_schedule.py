@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+
+class TournamentInfo(namedtuple('TournamentInfo', 'tournament_id name description start_date end_date created_by')):
+    """Detached, read-only copy of a Tournament row."""
+
+    __slots__ = ()
+
+    @property
+    def is_active(self):
+        now = datetime.now()
+        return self.start_date <= now <= self.end_date
+
+
+class TournamentSchedule:
+    """In-memory cache of active and upcoming tournaments.
+
+    Active/upcoming tournaments are read from the database once and then
+    served from memory. The active tournament is recomputed in memory exactly
+    at the next start or end boundary, so only admin writes (which call
+    `invalidate()`) and the `ttl` safety net, for writes made by other
+    workers, go back to the database.
+    """
+
+    def __init__(self, app, model, ttl=300):
+        self.app = app
+        self.model = model
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._invalidate()
+
+    def _invalidate(self):
+        self._upcoming = None  # active + upcoming, ordered by start_date
+        self._all = None
+        self._loaded_at = 0.0
+        self._all_loaded_at = 0.0
+        self._active = None
+        self._next_boundary = datetime.min
+
+    def invalidate(self):
+        with self._lock:
+            self._invalidate()
+
+    def _snapshot(self, tournament):
+        return TournamentInfo(tournament.tournament_id, tournament.name, tournament.description,
+                              tournament.start_date, tournament.end_date, tournament.created_by)
+
+    def _ensure_loaded(self):
+        if self._upcoming is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        Tournament = self.model
+        with self.app.app_context():
+            rows = Tournament.query.filter(Tournament.end_date >= datetime.now()).order_by(Tournament.start_date).all()
+            self._upcoming = [self._snapshot(t) for t in rows]
+        self._loaded_at = time.monotonic()
+        self._next_boundary = datetime.min
+
+    def _refresh(self, now):
+        # Drop finished tournaments and pick the active one
+        self._upcoming = [t for t in self._upcoming if t.end_date >= now]
+        self._active = next((t for t in self._upcoming if t.start_date <= now), None)
+
+        # The answer stays valid until something starts or ends. end_date is
+        # inclusive, so an active tournament only drops out just after it.
+        boundaries = [t.start_date for t in self._upcoming if t.start_date > now]
+        boundaries += [t.end_date + timedelta(microseconds=1) for t in self._upcoming if t.start_date <= now]
+        self._next_boundary = min(boundaries) if boundaries else datetime.max
+
+    def active(self):
+        """The tournament running right now, or None."""
+        with self._lock:
+            self._ensure_loaded()
+            now = datetime.now()
+            if now >= self._next_boundary:
+                self._refresh(now)
+            return self._active
+
+    def upcoming(self):
+        """Active and upcoming tournaments, ordered by start date."""
+        with self._lock:
+            self._ensure_loaded()
+            now = datetime.now()
+            if now >= self._next_boundary:
+                self._refresh(now)
+            return list(self._upcoming)
+
+    def get(self, tournament_id):
+        """An active or upcoming tournament by id, or None."""
+        try:
+            tournament_id = int(tournament_id)
+        except (TypeError, ValueError):
+            return None
+        return next((t for t in self.upcoming() if t.tournament_id == tournament_id), None)
+
+    def all(self):
+        """Every tournament, cached until the next invalidation."""
+        with self._lock:
+            if self._all is None or time.monotonic() - self._all_loaded_at >= self.ttl:
+                with self.app.app_context():
+                    self._all = [self._snapshot(t) for t in self.model.query.order_by(self.model.start_date).all()]
+                self._all_loaded_at = time.monotonic()
+            return list(self._all)